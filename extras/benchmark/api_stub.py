@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+"""
+A stand-in for the unoparty and unoblock JSON-RPC APIs, for trying out `fednode bench-api`.
+
+Answers every call (with HTTP keep-alive) after --latency seconds, with a canned result; a --slow-rate fraction
+of the calls take --slow-latency seconds instead. A --error-rate fraction of the calls get a JSON-RPC error
+instead, and a --http-error-rate fraction an HTTP 500.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+RESULTS = {
+    'get_running_info': {'server_ready': True, 'db_caught_up': True, 'last_block': {'block_index': 1000000}},
+    'is_ready': {'caught_up': True, 'last_message_index': 1000},
+    'get_balances': [{'address': "address", 'asset': "XUP", 'quantity': 100000000}],
+    'get_normalized_balances': [{'address': "address", 'asset': "XUP", 'normalized_quantity': 1.0}],
+}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # (so a burst of new connections isn't dropped and retried a second later)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # (the headers and body are sent separately)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode("utf-8"))
+        time.sleep(self.server.slow_latency if random.random() < self.server.slow_rate else self.server.latency)
+        roll = random.random()
+        if roll < self.server.http_error_rate:
+            self.reply(500, {'error': "internal server error"})
+        elif roll < self.server.http_error_rate + self.server.error_rate:
+            self.reply(200, {'jsonrpc': "2.0", 'id': request.get('id'), 'error': {'code': -32000, 'message': "stub error"}})
+        else:
+            self.reply(200, {'jsonrpc': "2.0", 'id': request.get('id'), 'result': RESULTS.get(request.get('method'), [])})
+        with self.server.lock:
+            self.server.calls[request.get('method')] = self.server.calls.get(request.get('method'), 0) + 1
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_api_stub(port=0, latency=0.0, error_rate=0.0, http_error_rate=0.0, slow_rate=0.0, slow_latency=0.0):
+    """Serve the stand-in API from a background thread; returns the server (server.calls counts the calls per method)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), APIHandler)
+    server.latency, server.error_rate, server.http_error_rate = latency, error_rate, http_error_rate
+    server.slow_rate, server.slow_latency = slow_rate, slow_latency
+    server.calls = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-p", "--port", type=int, default=4120, help="Port to listen on (on 127.0.0.1)")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds to delay each reply by")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls to answer with a JSON-RPC error")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Fraction of calls to answer with an HTTP 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of calls to answer after --slow-latency instead")
+    parser.add_argument("--slow-latency", type=float, default=0.5, help="Seconds to delay the slow calls by")
+    args = parser.parse_args()
+    server = start_api_stub(args.port, args.latency, args.error_rate, args.http_error_rate, args.slow_rate, args.slow_latency)
+    print("Serving a stand-in JSON-RPC API at 127.0.0.1:{}".format(server.server_address[1]))
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(server.calls))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
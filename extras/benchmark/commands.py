@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+"""
+Benchmark fednode commands end to end against a fake docker/docker-compose/git/sudo backend.
+
+Reports the median wall time, the number of external commands run and the peak RSS of each command.
+Save the results of one commit with --save and check another against them with --compare.
+With --docker-api, fednode talks to a fake docker API socket (docker_api_stub.py) instead of the docker CLI stub.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import collections
+import time
+import glob
+import re
+
+import registry
+import docker_api_stub
+
+
+SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
+FEDNODE_DIR = os.path.realpath(os.path.join(SCRIPTDIR, "..", ".."))
+STUB_COMMANDS = ['sudo', 'logname', 'docker', 'docker-compose', 'git']
+DEFAULT_LATENCIES = {'sudo': 0.005, 'logname': 0.0, 'docker': 0.05, 'docker-compose': 0.3, 'git': 0.1, 'registry': 0.05, 'docker-api': 0.002}
+INSTALL_STATE = ['.fednode.config', 'src', 'data']
+# (name, fednode arguments, whether to uninstall before each run); the first entry leaves the sandbox installed
+COMMANDS = [
+    ('install', ['install', '{config}', 'master', '--no-wait'], True),
+    ('update', ['update'], False),
+    ('update --force', ['update', '--force'], False),
+    ('update --dry-run', ['update', '--dry-run'], False),
+    ('status', ['status', '--max-age', '0'], False),
+    ('status (cached)', ['status'], False),
+    ('configcheck', ['configcheck'], False),
+    ('tail', ['tail', 'unoparty'], False),
+    ('pull', ['pull'], False),
+    ('pull --force', ['pull', '--force'], False),
+]
+
+
+def make_sandbox(root, latencies, registry_host):
+    """Copy fednode.py, its compose files and configs to a scratch dir, with the stub commands first on PATH.
+
+    The images in the compose files are pointed at the stand-in registry (host:port).
+    """
+    node_dir = os.path.join(root, "federatednode")
+    os.mkdir(node_dir)
+    shutil.copy2(os.path.join(FEDNODE_DIR, "fednode.py"), node_dir)
+    for path in glob.glob(os.path.join(FEDNODE_DIR, "docker-compose.*.yml")):
+        with open(path) as f:
+            compose = f.read()
+        with open(os.path.join(node_dir, os.path.basename(path)), 'w') as f:
+            f.write(re.sub(r'^(\s+image:\s*)', r'\g<1>{}/'.format(registry_host), compose, flags=re.M))
+    shutil.copytree(os.path.join(FEDNODE_DIR, "config"), os.path.join(node_dir, "config"))
+
+    bin_dir = os.path.join(root, "bin")
+    os.mkdir(bin_dir)
+    for name in STUB_COMMANDS:
+        os.symlink(os.path.join(SCRIPTDIR, "stub.py"), os.path.join(bin_dir, name))
+    env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+               FEDNODE_STUB_LOG=os.path.join(root, "calls.log"), FEDNODE_STUB_STATE=os.path.join(root, "state"),
+               FEDNODE_STUB_LATENCY=json.dumps(latencies))
+    return node_dir, env
+
+
+def uninstall(node_dir):
+    for name in INSTALL_STATE:
+        path = os.path.join(node_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+
+def run_command(node_dir, env, cmd):
+    """Run fednode once; returns the wall time (ms), exit code, peak RSS (KiB) and the external commands it ran"""
+    calls_log = env['FEDNODE_STUB_LOG']
+    if os.path.exists(calls_log):
+        os.remove(calls_log)
+    start = time.perf_counter()
+    options = [] if 'DOCKER_HOST' in env else ["--no-docker-api"]
+    proc = subprocess.Popen([sys.executable, os.path.join(node_dir, "fednode.py")] + options + cmd, cwd=node_dir, env=env,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 gives the peak RSS of this run alone (getrusage(RUSAGE_CHILDREN) would be the max over all runs)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_ms = (time.perf_counter() - start) * 1000
+    proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8  # (reaped already)
+    calls = []
+    if os.path.exists(calls_log):
+        with open(calls_log) as f:
+            calls = [line.split()[0] for line in f if line.strip()]
+    return wall_ms, proc.returncode, rusage.ru_maxrss, calls
+
+
+def benchmark(node_dir, env, name, cmd, reset, runs):
+    samples = []
+    for i in range(runs):
+        if reset:
+            uninstall(node_dir)
+        samples.append(run_command(node_dir, env, cmd))
+    walls = sorted(sample[0] for sample in samples)
+    calls = max((sample[3] for sample in samples), key=len)
+    return {'command': name, 'args': cmd, 'wall_ms': walls[len(walls) // 2], 'min_wall_ms': walls[0],
+            'subprocesses': len(calls), 'calls': dict(collections.Counter(calls)),
+            'peak_rss_kb': max(sample[2] for sample in samples), 'returncodes': sorted(set(sample[1] for sample in samples))}
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print the change of each command against a baseline; returns True if any command regressed"""
+    old_results = {result['command']: result for result in baseline['results']}
+    regressed = False
+    print("\ncompared to {} ({}):".format(baseline.get('commit') or "baseline", baseline.get('time', '?')))
+    for result in results:
+        old = old_results.get(result['command'])
+        if old is None:
+            continue
+        delta_ms = result['wall_ms'] - old['wall_ms']
+        slower = delta_ms > min_delta_ms and delta_ms > old['wall_ms'] * threshold / 100.0
+        more_calls = result['subprocesses'] > old['subprocesses']
+        regressed = regressed or slower or more_calls
+        print("{:<20} {:+8.1f} ms ({:+.0%})  {:+d} subprocesses  {:+d} KiB  {}".format(
+            result['command'], delta_ms, delta_ms / old['wall_ms'] if old['wall_ms'] else 0,
+            result['subprocesses'] - old['subprocesses'], result['peak_rss_kb'] - old['peak_rss_kb'],
+            "REGRESSED" if slower or more_calls else "OK"))
+    return regressed
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "-C", FEDNODE_DIR, "describe", "--always", "--dirty"],
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Number of runs per command")
+    parser.add_argument("--latency", action="append", default=[], metavar="NAME=SECONDS",
+                        help="Latency of a stub command or the stand-in registry (default: {})".format(
+                            ", ".join("{}={}".format(name, latency) for name, latency in DEFAULT_LATENCIES.items())))
+    parser.add_argument("--config", choices=['base', 'base_extbtc', 'unoblock', 'full'], default='base',
+                        help="The service configuration to install (only unoblock and full have images to pull)")
+    parser.add_argument("--docker-api", action="store_true", help="Talk to a fake docker API socket (docker_api_stub.py) instead of the docker CLI stub")
+    parser.add_argument("--only", action="append", default=[], metavar="COMMAND", help="Only benchmark these commands (and install)")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as JSON, to --compare later runs against")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against results saved with --save; exits 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Percentage of extra wall time that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=20.0, help="Ignore wall time changes smaller than this")
+    args = parser.parse_args()
+
+    if os.geteuid() == 0:
+        print("Please run this benchmark as a non-root user (fednode refuses to run as root).")
+        sys.exit(1)
+    latencies = dict(DEFAULT_LATENCIES)
+    for setting in args.latency:
+        name, _, latency = setting.partition('=')
+        if name not in latencies:
+            parser.error("unknown stub command {} (choose from {})".format(name, ", ".join(latencies)))
+        latencies[name] = float(latency)
+
+    results = []
+    registry_server = registry.start_registry(latency=latencies['registry'])
+    with tempfile.TemporaryDirectory() as root:
+        node_dir, env = make_sandbox(root, latencies, "127.0.0.1:{}".format(registry_server.server_address[1]))
+        if args.docker_api:
+            socket_path = os.path.join(root, "docker.sock")
+            docker_api_stub.start_docker_api_stub(socket_path, state_dir=env['FEDNODE_STUB_STATE'], latency=latencies['docker-api'])
+            env['DOCKER_HOST'] = "unix://" + socket_path
+        print("{:<20} {:>10} {:>14} {:>12}  {}".format("command", "wall", "subprocesses", "peak RSS", "external commands"))
+        for i, (name, cmd, reset) in enumerate(COMMANDS):
+            if args.only and i > 0 and name not in args.only:
+                continue
+            result = benchmark(node_dir, env, name, [arg.format(config=args.config) for arg in cmd], reset, args.runs)
+            results.append(result)
+            print("{:<20} {:7.1f} ms {:>14} {:>8} KiB  {}{}".format(
+                name, result['wall_ms'], result['subprocesses'], result['peak_rss_kb'],
+                " ".join("{}x{}".format(call, count) for call, count in sorted(result['calls'].items())),
+                "" if result['returncodes'] == [0] else "  (exit code {})".format(result['returncodes'])))
+
+    registry_server.shutdown()
+    print("{} config{}, median of {} runs; stub latencies: {}".format(args.config, " (docker API)" if args.docker_api else "", args.runs, ", ".join("{}={}s".format(*item) for item in sorted(latencies.items()))))
+    report = {'commit': get_commit(), 'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'runs': args.runs, 'config': args.config, 'docker_api': args.docker_api,
+              'latencies': latencies, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('latencies') != latencies or baseline.get('config', 'base') != args.config or baseline.get('docker_api', False) != args.docker_api:
+            print("warning: the baseline was recorded with a different config or stub latencies")
+        if compare(results, baseline, args.threshold, args.min_delta_ms):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+A stand-in for `docker-compose config`, for the docker-compose stub (see stub.py): resolves a compose file's
+`extends` chains, ${VAR} interpolation, relative host paths and env_files, then writes the result out as YAML,
+the way docker-compose does. Only what fednode's compose files use is supported.
+"""
+import os
+import re
+import sys
+import json
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+import fednode  # noqa: E402  (for its YAML reader)
+
+
+def interpolate_env(text, env):
+    """Substitute $VAR, ${VAR}, ${VAR:-default} and ${VAR-default} like docker-compose does ($$ is a literal $)"""
+    def substitute(match):
+        if match.group(0) == '$$':
+            return '$'
+        name = match.group(1) or match.group(2)
+        value = env.get(name)
+        if match.group(4) is not None and (value is None or (match.group(3) == ':-' and not value)):
+            return match.group(4)
+        return value or ''
+    return re.sub(r'\$\$|\$(\w+)|\$\{(\w+)(?:(:?-)([^}]*))?\}', substitute, text)
+
+
+def load_compose_file(path, env, files):
+    if path not in files:
+        with open(path) as f:
+            lines = [line for line in f.read().splitlines() if not line.lstrip().startswith('#')]
+        files[path] = fednode.parse_yaml(interpolate_env("\n".join(lines), env))
+    return files[path]
+
+
+def merge_config(base, override):
+    merged = collections.OrderedDict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        elif isinstance(value, list) and isinstance(merged.get(key), list):
+            merged[key] = merged[key] + [item for item in value if item not in merged[key]]
+        else:
+            merged[key] = value
+    return merged
+
+
+def resolve_service(path, name, env, files):
+    """Return a service's configuration with its `extends` chain merged in and host paths made absolute"""
+    config = collections.OrderedDict(load_compose_file(path, env, files)['services'][name])
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if isinstance(config.get('build'), str):
+        config['build'] = {'context': config['build']}
+    if isinstance(config.get('build'), dict) and 'context' in config['build']:
+        config['build'] = dict(config['build'], context=os.path.normpath(os.path.join(base_dir, config['build']['context'])))
+    if isinstance(config.get('env_file'), str):
+        config['env_file'] = [config['env_file']]
+    config['env_file'] = [os.path.normpath(os.path.join(base_dir, item)) for item in config.get('env_file', [])]
+    config['volumes'] = [re.sub(r'^(\.[^:]*)', lambda m: os.path.normpath(os.path.join(base_dir, m.group(1))), item)
+                         for item in config.get('volumes', [])]
+    if isinstance(config.get('environment'), list):
+        config['environment'] = collections.OrderedDict(item.split('=', 1) for item in config['environment'])
+    extends = config.pop('extends', None)
+    if extends is None:
+        return config
+    if isinstance(extends, str):
+        extends = {'service': extends}
+    base_path = os.path.join(base_dir, extends['file']) if 'file' in extends else path
+    base = resolve_service(base_path, extends['service'], env, files)
+    for key in ('links', 'volumes_from', 'depends_on', 'net'):  # never inherited through extends
+        base.pop(key, None)
+    return merge_config(base, config)
+
+
+def render(path, env):
+    """Resolve a compose file into the config docker-compose would run (a dict)"""
+    files = {}
+    compose = load_compose_file(path, env, files)
+    services = collections.OrderedDict()
+    for name in sorted(compose.get('services') or {}):
+        config = resolve_service(path, name, env, files)
+        environment = collections.OrderedDict()
+        for env_file in config.pop('env_file'):  # (a missing env_file is an error, as with docker-compose)
+            with open(env_file) as f:
+                environment.update(line.strip().split('=', 1) for line in f if '=' in line and not line.startswith('#'))
+        environment.update(config.get('environment') or {})
+        if environment:
+            config['environment'] = environment
+        if not config['volumes']:
+            del config['volumes']
+        services[name] = config
+    return collections.OrderedDict([('services', services), ('version', compose.get('version', '2')),
+                                    ('volumes', collections.OrderedDict((name, {}) for name in compose.get('volumes') or {}))])
+
+
+def dump_scalar(value):
+    if isinstance(value, (dict, list)):
+        return "{}" if isinstance(value, dict) else "[]"
+    return "null" if value is None else json.dumps(str(value))
+
+
+def dump(value, indent=0):
+    """Write out a config as block-style YAML, with every scalar quoted"""
+    pad = ' ' * indent
+    lines = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and item:
+                lines += ["{}{}:".format(pad, json.dumps(str(key))), dump(item, indent + 2)]
+            else:
+                lines.append("{}{}: {}".format(pad, json.dumps(str(key)), dump_scalar(item)))
+    else:
+        for item in value:
+            if isinstance(item, dict) and item:  # "- key: value", with its other keys indented past the dash
+                lines.append(pad + "- " + dump(item, indent + 2).lstrip())
+            else:
+                lines.append("{}- {}".format(pad, dump_scalar(item)))
+    return "\n".join(lines)
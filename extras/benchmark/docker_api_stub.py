@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+"""
+A fake Docker Engine API on a Unix socket, answering the requests fednode's DockerClient makes.
+
+Containers are running unless stopped through the API; with --containers, only those exist (others get
+a 404, like the real daemon). Volumes live under --state, and images are those pulled with the docker
+stub (see stub.py). With --drop-idle, each keep-alive connection is closed silently after one response,
+like a daemon dropping idle connections, so clients have to reconnect.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+
+import stub
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class DockerAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "fednode-docker-api-stub"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if self.server.drop_idle:
+            self.close_connection = True  # (without a Connection: close header, as when the daemon drops it)
+
+    def not_found(self, kind, name):
+        self.send(404, {'message': "No such {}: {}".format(kind, name)})
+
+    def handle_request(self):
+        time.sleep(self.server.latency)
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+        with self.server.lock:
+            self.server.requests.append((self.command, path))
+        containers = self.server.containers
+        match = re.match(r'^/containers/([^/]+)/(json|start|stop|restart|logs)$', path)
+        if path == '/_ping':
+            self.send(200, "OK")
+        elif path == '/containers/json':
+            self.send(200, [{'Id': hashlib.sha256(name.encode("utf-8")).hexdigest(), 'Names': ["/" + name], 'Command': "start.sh",
+                             'State': self.server.get_state(name), 'Status': "Up 1 hour", 'Ports': []}
+                            for name in sorted(containers or [])])
+        elif match:
+            name, action = match.groups()
+            if containers is not None and name not in containers:
+                return self.not_found("container", name)
+            if action == 'json':
+                info = stub.container_info(name, (containers or {}).get(name) if self.server.state_dir else None)
+                info['State'].update(Status=self.server.get_state(name), Running=self.server.get_state(name) == "running")
+                self.send(200, info)
+            elif action == 'logs':
+                self.send(200)
+            else:
+                with self.server.lock:
+                    if action == 'stop':
+                        self.server.stopped.add(name)
+                    else:
+                        self.server.stopped.discard(name)
+                self.send(204)
+        elif path.startswith('/images/') and path.endswith('/json'):
+            name = path[len('/images/'):-len('/json')]
+            image = stub.inspect_image(name) if self.server.state_dir else None
+            if image is None:
+                return self.not_found("image", name)
+            self.send(200, image)
+        elif path == '/images/json':
+            self.send(200, [])
+        elif path.startswith('/volumes/'):
+            name = path[len('/volumes/'):]
+            mountpoint = os.path.join(self.server.state_dir or "/tmp", "volumes", name)
+            self.send(200, {'Name': name, 'Mountpoint': mountpoint})
+        else:
+            self.send(404, {'message': "page not found"})
+
+    do_GET = do_POST = do_HEAD = handle_request
+
+
+def start_docker_api_stub(socket_path, containers=None, state_dir=None, latency=0.0, drop_idle=False, verbose=False):
+    """Serve the fake docker API on socket_path from a background thread; returns the server.
+
+    server.requests has the (method, path) of each request and server.connections counts the connections made.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = ThreadingUnixHTTPServer(socket_path, DockerAPIHandler)
+    # (a list of container names, or a dict of container name to the image it was created from)
+    if containers is not None and not isinstance(containers, dict):
+        containers = dict.fromkeys(containers)
+    server.containers = containers
+    server.state_dir = state_dir
+    server.latency = latency
+    server.drop_idle = drop_idle
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = []
+    server.connections = 0
+    server.stopped = set()
+    server.get_state = lambda name: "exited" if name in server.stopped else "running"
+    if state_dir:
+        os.environ['FEDNODE_STUB_STATE'] = state_dir  # (where stub.inspect_image() finds the pulled images)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("socket", help="Path of the Unix socket to listen on (point fednode at it with DOCKER_HOST=unix://<path>)")
+    parser.add_argument("--containers", nargs='*', help="The only containers that exist (default: any)")
+    parser.add_argument("--state", help="Directory with the stub's volumes and pulled images")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay each response by")
+    parser.add_argument("--drop-idle", action="store_true", help="Close each connection after one response")
+    args = parser.parse_args()
+    start_docker_api_stub(args.socket, args.containers, args.state, args.latency, args.drop_idle, verbose=True)
+    print("Serving a fake docker API at {}".format(args.socket))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+"""
+A stand-in docker registry, answering the manifest requests `fednode pull` makes with made-up images.
+
+Every repository:tag exists. Its manifest depends on the revision given for it in the --revisions JSON
+file (re-read on every request, so edit it to make an image change upstream). All images share one base
+layer. With --token, clients must get a bearer token first, like on Docker Hub.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+LAYER_TYPE = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+
+
+def sha256(text):
+    return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_manifest(repository, tag, revision):
+    seed = "{}:{}@{}".format(repository, tag, revision)
+    layers = [{'mediaType': LAYER_TYPE, 'size': 30 * 1024 ** 2, 'digest': sha256("base")}]
+    for i in range(3):
+        layers.append({'mediaType': LAYER_TYPE, 'size': (i + 1) * 5 * 1024 ** 2, 'digest': sha256("{}/{}".format(seed, i))})
+    manifest = {'schemaVersion': 2, 'mediaType': MANIFEST_TYPE,
+                'config': {'mediaType': "application/vnd.docker.container.image.v1+json", 'size': 1024, 'digest': sha256(seed)},
+                'layers': layers}
+    return json.dumps(manifest, indent=3).encode("utf-8")
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    server_version = "fednode-registry-standin"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def handle_request(self):
+        time.sleep(self.server.latency)
+        if self.path.startswith('/token'):
+            return self.send(200, json.dumps({'token': self.server.token}).encode("utf-8"), {'Content-Type': "application/json"})
+        if self.server.token and self.headers.get('Authorization') != "Bearer {}".format(self.server.token):
+            challenge = 'Bearer realm="http://{}:{}/token",service="standin"'.format(*self.server.server_address)
+            match = re.match(r'^/v2/(.+)/manifests/', self.path)
+            if match:
+                challenge += ',scope="repository:{}:pull"'.format(match.group(1))
+            return self.send(401, b'{"errors":[{"code":"UNAUTHORIZED"}]}', {'WWW-Authenticate': challenge})
+        if self.path in ('/v2', '/v2/'):
+            return self.send(200, b'{}', {'Content-Type': "application/json"})
+        match = re.match(r'^/v2/(.+)/manifests/([^/]+)$', self.path)
+        if not match:
+            return self.send(404, b'{"errors":[{"code":"NAME_UNKNOWN"}]}')
+        repository, reference = match.groups()
+        revisions = self.server.get_revisions()
+        if reference.startswith('sha256:'):
+            body = self.server.by_digest.get(reference)
+            if body is None:
+                return self.send(404, b'{"errors":[{"code":"MANIFEST_UNKNOWN"}]}')
+        else:
+            body = make_manifest(repository, reference, revisions.get("{}:{}".format(repository, reference), 0))
+            self.server.by_digest[sha256(body.decode("utf-8"))] = body
+        self.send(200, body, {'Content-Type': MANIFEST_TYPE, 'Docker-Content-Digest': sha256(body.decode("utf-8"))})
+
+    do_GET = do_HEAD = handle_request
+
+
+def start_registry(port=0, latency=0.0, revisions_path=None, token=None, verbose=False):
+    """Serve the stand-in registry from a background thread; returns the server (server.server_address has the port)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), RegistryHandler)
+    server.latency = latency
+    server.token = token
+    server.verbose = verbose
+    server.by_digest = {}
+
+    def get_revisions():
+        if revisions_path is None or not os.path.exists(revisions_path):
+            return {}
+        with open(revisions_path) as f:
+            return json.load(f)
+    server.get_revisions = get_revisions
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-p", "--port", type=int, default=5000, help="Port to listen on (on 127.0.0.1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay each response by")
+    parser.add_argument("--revisions", metavar="FILE", help="JSON object of 'repository:tag' to revision number")
+    parser.add_argument("--token", help="Require this bearer token, handed out anonymously at /token")
+    args = parser.parse_args()
+    server = start_registry(args.port, args.latency, args.revisions, args.token, verbose=True)
+    print("Serving a stand-in registry at 127.0.0.1:{} (images are e.g. 127.0.0.1:{}/library/redis:3.2)".format(
+        server.server_address[1], server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+"""
+Check that pure inspection fednode commands start up quickly and never shell out
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import time
+
+
+SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
+FEDNODE_DIR = os.path.realpath(os.path.join(SCRIPTDIR, "..", ".."))
+STUB_COMMANDS = ['sudo', 'logname', 'docker', 'docker-compose', 'git']
+INSPECTION_COMMANDS = [
+    ['--version'],
+    ['--help'],
+    ['install', '--help'],
+    ['configcheck'],
+]
+
+
+def make_sandbox(root):
+    """Copy fednode.py and its configs to a scratch dir, with stub privileged commands first on PATH"""
+    node_dir = os.path.join(root, "federatednode")
+    os.mkdir(node_dir)
+    shutil.copy2(os.path.join(FEDNODE_DIR, "fednode.py"), node_dir)
+    shutil.copytree(os.path.join(FEDNODE_DIR, "config"), os.path.join(node_dir, "config"))
+    with open(os.path.join(node_dir, ".fednode.config"), 'w') as f:
+        f.write("[Default]\nbranch = master\nconfig = base\n\n")
+
+    bin_dir = os.path.join(root, "bin")
+    os.mkdir(bin_dir)
+    calls_log = os.path.join(root, "calls.log")
+    for name in STUB_COMMANDS:
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write("#!/bin/sh\necho {} \"$@\" >> {}\nexit 1\n".format(name, calls_log))
+        os.chmod(path, 0o755)
+    return node_dir, bin_dir, calls_log
+
+
+def time_command(node_dir, env, cmd, runs):
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.call([sys.executable, os.path.join(node_dir, "fednode.py")] + cmd, env=env,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="Maximum allowed median wall time per command")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Number of runs per command")
+    args = parser.parse_args()
+
+    if os.geteuid() == 0:
+        print("Please run this benchmark as a non-root user (fednode refuses to run as root).")
+        sys.exit(1)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as root:
+        node_dir, bin_dir, calls_log = make_sandbox(root)
+        env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''))
+
+        for cmd in INSPECTION_COMMANDS:
+            median_ms = time_command(node_dir, env, cmd, args.runs)
+            calls = []
+            if os.path.exists(calls_log):
+                with open(calls_log) as f:
+                    calls = [line.strip() for line in f]
+                os.remove(calls_log)
+            ok = median_ms <= args.budget_ms and not calls
+            failed = failed or not ok
+            print("{:<20} {:8.1f} ms  {}".format(' '.join(cmd), median_ms, "OK" if ok else "FAILED"))
+            for call in sorted(set(calls)):
+                print("    unexpected external command: {}".format(call))
+
+    print("budget: {:.0f} ms (median of {} runs)".format(args.budget_ms, args.runs))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
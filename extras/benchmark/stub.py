@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+"""
+Fake sudo, logname, docker, docker-compose and git for the command benchmark (see commands.py).
+
+Symlinked into a bin dir under each of those names. Every call is appended to $FEDNODE_STUB_LOG and
+delayed by the latency configured for that name in $FEDNODE_STUB_LATENCY (a JSON object of seconds),
+then answers just enough for fednode to carry on: all containers are running, volumes live under
+$FEDNODE_STUB_STATE, images are pulled from the stand-in registry (registry.py) and every source
+checkout is up to date.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import getpass
+import hashlib
+
+
+def fake_commit(path):
+    return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+
+def container_info(name, image=None):
+    """A running container; created from the given image (if pulled) or else from an image of its own"""
+    pulled = inspect_image(image) if image else None
+    return {'Name': "/" + name, 'Image': pulled['Id'] if pulled else "sha256:" + hashlib.sha256(name.encode("utf-8")).hexdigest(),
+            'Config': {'Image': image or name}, 'RestartCount': 0,
+            'State': {'Status': "running", 'Running': True,
+                      'StartedAt': time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime(time.time() - 3600))}}
+
+
+def sudo(args):
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option in ('-u', '-g') and args:
+            args.pop(0)
+    if args:
+        os.execvp(args[0], args)
+    return 0
+
+
+def image_path(image):
+    return os.path.join(os.environ['FEDNODE_STUB_STATE'], "images", hashlib.sha1(image.encode("utf-8")).hexdigest() + ".json")
+
+
+def inspect_image(image):
+    """The pulled image with that name, or with that ID"""
+    if os.path.exists(image_path(image)):
+        with open(image_path(image)) as f:
+            return json.load(f)
+    for path in glob.glob(os.path.join(os.environ['FEDNODE_STUB_STATE'], "images", "*.json")):
+        with open(path) as f:
+            info = json.load(f)
+        if info['Id'] == image:
+            return info
+    return None
+
+
+def pull(image):
+    """Record an image as pulled, with the digest the stand-in registry has for it (see registry.py)"""
+    import urllib.request
+    name, _, tag = image.rpartition(':') if ':' in image.rsplit('/', 1)[-1] else (image, None, 'latest')
+    registry, _, repository = name.partition('/')
+    url = "http://{}/v2/{}/manifests/{}".format(registry, repository, tag)
+    with urllib.request.urlopen("http://{}/token".format(registry)) as response:  # (in case it was started with --token)
+        token = json.loads(response.read().decode("utf-8"))['token']
+    request = urllib.request.Request(url, method='HEAD', headers={'Authorization': "Bearer {}".format(token)})
+    with urllib.request.urlopen(request) as response:
+        digest = response.headers['Docker-Content-Digest']
+    os.makedirs(os.path.dirname(image_path(image)), exist_ok=True)
+    with open(image_path(image), 'w') as f:
+        json.dump({'Id': digest, 'RepoTags': [image], 'RepoDigests': ["{}@{}".format(name, digest)]}, f)
+
+
+def docker(args):
+    if args[:1] == ['pull']:
+        pull(args[-1])
+    elif args[:2] == ['image', 'inspect']:
+        images = [inspect_image(name) for name in args[2:]]
+        print(json.dumps([image for image in images if image is not None]))
+        return 0 if None not in images else 1
+    elif args[:2] == ['volume', 'inspect']:
+        volumes = []
+        for name in args[2:]:
+            mountpoint = os.path.join(os.environ['FEDNODE_STUB_STATE'], "volumes", name)
+            os.makedirs(mountpoint, exist_ok=True)
+            volumes.append({'Name': name, 'Mountpoint': mountpoint})
+        print(json.dumps(volumes))
+    elif args[:1] == ['inspect']:
+        names = [arg for arg in args[1:] if not arg.startswith('-')]
+        if any(arg.startswith('--format') for arg in args):
+            print("\n".join("true" for name in names))
+        else:
+            print(json.dumps([container_info(name) for name in names]))
+    return 0
+
+
+def docker_compose(args):
+    if 'config' in args:
+        import compose_config
+        sys.stdout.write(compose_config.dump(compose_config.render(args[args.index('-f') + 1], os.environ)) + "\n")
+    return 0
+
+
+def git(args):
+    repo_dir = '.'
+    if args[:1] == ['-C']:
+        repo_dir = args[1]
+        args = args[2:]
+    if args[:1] == ['clone']:
+        os.makedirs(args[-1], exist_ok=True)
+    elif args[:1] == ['rev-parse']:
+        print(fake_commit(repo_dir))
+        if '--abbrev-ref' in args:
+            print("master")
+    elif args[:1] == ['rev-list']:
+        print(0)
+    return 0
+
+
+def logname(args):
+    print(getpass.getuser())
+    return 0
+
+
+STUBS = {'sudo': sudo, 'docker': docker, 'docker-compose': docker_compose, 'git': git, 'logname': logname}
+
+
+def main():
+    name = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    with open(os.environ['FEDNODE_STUB_LOG'], 'a') as f:
+        f.write("{} {}\n".format(name, " ".join(args)))
+    time.sleep(json.loads(os.environ.get('FEDNODE_STUB_LATENCY', '{}')).get(name, 0))
+    sys.exit(STUBS[name](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+"""
+A stand-in for the RPC interfaces `fednode sync` polls: unobtanium's JSON-RPC (getblockchaininfo), addrindexrs'
+newline-delimited JSON-RPC over TCP (blockchain.headers.subscribe) and unoparty's JSON-RPC API (get_running_info).
+
+The chain tip is at --headers blocks; each layer starts at its own height and catches up at --rate blocks per
+second (unobtanium first: the indexers never get ahead of it). Other methods get a JSON-RPC "method not found".
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Chain:
+    """The heights of each layer, advancing at `rate` blocks per second up to the tip"""
+    def __init__(self, headers, heights, rate=0.0):
+        self.headers = headers
+        self.heights = dict(heights)
+        self.rate = rate
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.calls = []  # (layer, method) of each call
+
+    def height(self, layer):
+        advanced = self.heights[layer] + int(self.rate * (time.time() - self.start))
+        if layer != 'unobtanium':
+            advanced = min(advanced, self.height('unobtanium'))
+        return min(advanced, self.headers)
+
+    def answer(self, layer, request):
+        """Return the JSON-RPC reply to a request"""
+        method = request.get('method')
+        with self.lock:
+            self.calls.append((layer, method))
+        if layer == 'unobtanium' and method == 'getblockchaininfo':
+            result = {'chain': "main", 'blocks': self.height('unobtanium'), 'headers': self.headers}
+        elif layer == 'addrindexrs' and method == 'blockchain.headers.subscribe':
+            result = {'height': self.height('addrindexrs'), 'hex': "00" * 80}
+        elif layer == 'unoparty' and method == 'get_running_info':
+            result = {'server_ready': True, 'db_caught_up': self.height('unoparty') >= self.headers,
+                      'unobtanium_block_count': self.height('unobtanium'),
+                      'last_block': {'block_index': self.height('unoparty')}}
+        else:
+            return {'jsonrpc': "2.0", 'id': request.get('id'), 'error': {'code': -32601, 'message': "Method not found"}}
+        return {'jsonrpc': "2.0", 'id': request.get('id'), 'result': result}
+
+
+class JSONRPCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode("utf-8"))
+        body = json.dumps(self.server.chain.answer(self.server.layer, request)).encode("utf-8")
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LineJSONRPCHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.chain.answer(self.server.layer, json.loads(line.decode("utf-8")))
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+class SyncStub:
+    """The three servers, on 127.0.0.1; see .ports for the port of each layer"""
+    def __init__(self, chain, ports=None):
+        ports = ports or {}
+        self.chain = chain
+        self.servers = {
+            'unobtanium': ThreadingHTTPServer(('127.0.0.1', ports.get('unobtanium', 0)), JSONRPCHandler),
+            'addrindexrs': ThreadingTCPServer(('127.0.0.1', ports.get('addrindexrs', 0)), LineJSONRPCHandler),
+            'unoparty': ThreadingHTTPServer(('127.0.0.1', ports.get('unoparty', 0)), JSONRPCHandler),
+        }
+        self.ports = {layer: server.server_address[1] for layer, server in self.servers.items()}
+        for layer, server in self.servers.items():
+            server.chain, server.layer = chain, layer
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self, layer=None):
+        """Shut down one layer's server (as if the service went down), or all of them"""
+        for name in [layer] if layer else list(self.servers):
+            self.servers[name].shutdown()
+            self.servers[name].server_close()
+
+
+def start_sync_stub(headers, heights, rate=0.0, ports=None):
+    """Serve the stand-in RPC interfaces from background threads; heights is a dict of layer to starting height"""
+    return SyncStub(Chain(headers, heights, rate), ports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--testnet", action="store_true", help="Listen on the testnet ports instead of the mainnet ones")
+    parser.add_argument("--headers", type=int, default=1000000, help="Height of the chain tip")
+    parser.add_argument("--heights", type=int, nargs=3, default=[990000, 950000, 900000], metavar=("UNO", "IDX", "XUP"),
+                        help="Starting heights of unobtanium, addrindexrs and unoparty")
+    parser.add_argument("--rate", type=float, default=10.0, help="Blocks per second each layer catches up at")
+    args = parser.parse_args()
+    ports = ({'unobtanium': 65531, 'addrindexrs': 18122, 'unoparty': 14120} if args.testnet else
+             {'unobtanium': 65535, 'addrindexrs': 8122, 'unoparty': 4120})
+    stub = start_sync_stub(args.headers, dict(zip(['unobtanium', 'addrindexrs', 'unoparty'], args.heights)), args.rate, ports)
+    print("Serving stand-in unobtanium, addrindexrs and unoparty RPC at 127.0.0.1:{unobtanium}, :{addrindexrs} and "
+          ":{unoparty}".format(**stub.ports))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
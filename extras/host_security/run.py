@@ -1,17 +1,86 @@
 #! /usr/bin/env python3
 """
 Tighten up an Ubuntu host box
+
+Works out what differs from the desired state first (packages missing, config files out of date) and only
+does that: all packages go in one apt transaction, each config file is read and written once, and a service
+is only restarted if one of its config files changed. Re-running it on a hardened host does nothing.
 """
 import os
 import sys
 import re
 import logging
 import socket
+import argparse
 import platform
+import subprocess
 
 
 DIST_PATH = os.path.join(os.path.dirname(__file__), "dist")
 
+# note that installing psad will install postfix, which will prompt the user
+PACKAGES = ['unattended-upgrades', 'fail2ban', 'psad', 'rkhunter', 'chkrootkit', 'logwatch', 'libdate-manip-perl',
+            'apparmor', 'apparmor-profiles', 'auditd', 'audispd-plugins', 'iwatch']
+AUTO_UPGRADES = 'APT::Periodic::Update-Package-Lists "1";\nAPT::Periodic::Unattended-Upgrade "1";\n'
+RKHUNTER_COMMANDS = [
+    'bash -c "rkhunter --update; exit 0"',
+    "rkhunter --propupd",
+    'bash -c "rkhunter --check --sk; exit 0"',
+    "rkhunter --propupd",
+]
+
+
+class ConfigFile(object):
+    """The desired state of a config file: installed from DIST_PATH (source) or given outright (content), or
+    an existing file; then with each (param_re, content_to_add, dotall) edit applied"""
+
+    def __init__(self, path, source=None, content=None, mode=None, edits=None, restart=None, after=None):
+        self.path = path
+        self.source = source
+        self.content = content
+        self.mode = mode  # (files with a mode set are owned by root:root)
+        self.edits = edits or []
+        self.restart = restart or []  # services to restart when the file changes
+        self.after = after or []  # commands to run when the file changes
+
+    def plan(self):
+        """Returns the list of changes the file needs (empty if up to date) and its desired content;
+        the content is None if the file is still to be created by a package"""
+        current = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                current = f.read()
+        if self.source:
+            with open(os.path.join(DIST_PATH, self.source), 'r') as f:
+                content = f.read()
+        elif self.content is not None:
+            content = self.content
+        elif current is None:
+            return ["edit (once its package is installed)"], None
+        else:
+            content = current
+        content = apply_edits(content, self.edits)
+
+        changes = []
+        if current is None:
+            changes.append("create")
+        elif content != current:
+            changes.append("update" if self.source or self.content is not None else
+                           "edit (%d of %d settings)" % (count_edits(current, self.edits), len(self.edits)))
+        elif self.mode is not None:
+            st = os.stat(self.path)
+            if st.st_mode & 0o7777 != self.mode or st.st_uid != 0 or st.st_gid != 0:
+                changes.append("chmod %04o, chown root:root" % self.mode)
+        return changes, content
+
+    def apply(self, content):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            f.write(content)
+        if self.mode is not None:
+            os.chmod(self.path, self.mode)
+            os.chown(self.path, 0, 0)
+
 
 def runcmd(command, abort_on_failure=True):
     logging.debug("RUNNING COMMAND: %s" % command)
@@ -21,88 +90,145 @@ def runcmd(command, abort_on_failure=True):
         sys.exit(1)
 
 
-def modify_config(param_re, content_to_add, filenames, replace_if_exists=True, dotall=False):
-    if not isinstance(filenames, (list, tuple)):
-        filenames = [filenames,]
-
-    re_flags = re.MULTILINE | re.DOTALL if dotall else re.MULTILINE
-
-    for filename in filenames:
-        f = open(filename, 'r')
-        content = f.read()
-        f.close()
-        if not re.search(param_re, content, re_flags): #missing; add to config 
-            if content[-1] != '\n': content += '\n'
-            content += content_to_add 
-        elif replace_if_exists: #replace in config
+def apply_edits(content, edits):
+    """Make sure each param_re is in the content, replacing it by (or else appending) content_to_add"""
+    for param_re, content_to_add, dotall in edits:
+        re_flags = re.MULTILINE | re.DOTALL if dotall else re.MULTILINE
+        if not re.search(param_re, content, re_flags):  # missing; add to config
+            if content and content[-1] != '\n':
+                content += '\n'
+            content += content_to_add
+        else:  # replace in config
             content = re.sub(param_re, content_to_add, content, flags=re_flags)
-        f = open(filename, 'w')
-        f.write(content)
-        f.close()
-
-
-def do_security_setup():
+    return content
+
+
+def count_edits(content, edits):
+    return sum(1 for edit in edits if apply_edits(content, [edit]) != content)
+
+
+def get_config_files():
+    psad_log_rules = ('^# End required lines.*?# allow all on loopback$',
+                      '# End required lines\n\n#CUSTOM: for psad\n-A INPUT -j LOG\n-A FORWARD -j LOG\n\n# allow all on loopback', True)
+    return [
+        ConfigFile('/etc/host.conf', edits=[(r'^nospoof on$', 'nospoof on', False)]),
+        # enable automatic security updates
+        ConfigFile('/etc/apt/apt.conf.d/20auto-upgrades', content=AUTO_UPGRADES,
+                   after=["dpkg-reconfigure -fnoninteractive -plow unattended-upgrades"]),
+        ConfigFile('/etc/sysctl.d/60-tweaks.conf', source="sysctl_rules.conf", mode=0o644),
+        ConfigFile('/etc/fail2ban/jail.d/unoblock.conf', source="fail2ban.jail.conf", mode=0o644, restart=['fail2ban']),
+        ConfigFile('/etc/psad/psad.conf', edits=[
+            (r'^ENABLE_AUTO_IDS\s+?[YN];$', 'ENABLE_AUTO_IDS\tY;', False),
+            (r'^ENABLE_AUTO_IDS_EMAILS\s+?[YN];$', 'ENABLE_AUTO_IDS_EMAILS\tN;', False),
+        ], restart=['psad'], after=["psad -R && psad --sig-update"]),
+        ConfigFile('/etc/ufw/before.rules', edits=[psad_log_rules], restart=['ufw', 'psad']),
+        ConfigFile('/etc/ufw/before6.rules', edits=[psad_log_rules], restart=['ufw', 'psad']),
+        # note that auditd will need a reboot to fully apply the rules, due to it operating in "immutable mode" by default
+        ConfigFile('/etc/audit/rules.d/unoblock.rules', source="audit.rules", mode=0o640, restart=['auditd']),
+        ConfigFile('/etc/default/auditd', edits=[(r'^USE_AUGENRULES=.*?$', 'USE_AUGENRULES="yes"', False)], restart=['auditd']),
+        ConfigFile('/etc/default/iwatch', edits=[(r'^START_DAEMON=.*?$', 'START_DAEMON=true', False)], restart=['iwatch']),
+        ConfigFile('/etc/iwatch/iwatch.xml', source="iwatch.xml", mode=0o644, restart=['iwatch'], edits=[
+            (r'guard email="root@localhost"', 'guard email="noreply@%s"' % socket.gethostname(), False),
+        ]),
+    ]
+
+
+def get_missing_packages(packages):
+    """Query dpkg for all packages at once; returns those not installed"""
+    proc = subprocess.run(["dpkg-query", "-W", "-f=${Package} ${Status}\n"] + packages,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    installed = set(line.split()[0] for line in proc.stdout.splitlines() if line.endswith(" install ok installed"))
+    return [package for package in packages if package not in installed]
+
+
+def unique(items):
+    return sorted(set(items), key=items.index)
+
+
+def plan_files(config_files):
+    """Returns (config file, changes, desired content) for each config file that isn't up to date"""
+    plan = []
+    for config_file in config_files:
+        changes, content = config_file.plan()
+        if changes:
+            plan.append((config_file, changes, content))
+    return plan
+
+
+def print_plan(missing_packages, file_plan, restarts, commands):
+    if not missing_packages and not file_plan and not restarts and not commands:
+        print("Nothing to do: the host is already set up.")
+        return
+    if missing_packages:
+        print("install packages: %s" % " ".join(missing_packages))
+    for config_file, changes, content in file_plan:
+        print("%s: %s" % (config_file.path, ", ".join(changes)))
+    for command in commands:
+        print("run: %s" % command)
+    if restarts:
+        print("restart: %s" % " ".join(restarts))
+
+
+def do_security_setup(dry_run=False):
     """Some helpful security-related tasks, to tighten up the box"""
+    config_files = get_config_files()
+    missing_packages = get_missing_packages(PACKAGES)
+    file_plan = plan_files(config_files)
+
+    def get_steps(file_plan):
+        restarts = unique([service for config_file, changes, content in file_plan for service in config_file.restart])
+        commands = [command for config_file, changes, content in file_plan for command in config_file.after]
+        if 'unattended-upgrades' in missing_packages:
+            commands.append("dpkg-reconfigure -fnoninteractive -plow unattended-upgrades")
+        if 'psad' in missing_packages:
+            commands.append("psad -R && psad --sig-update")
+        if missing_packages:  # (the file properties rkhunter checks against change with each install)
+            commands.extend(RKHUNTER_COMMANDS)
+        return restarts, unique(commands)
+
+    restarts, commands = get_steps(file_plan)
+    print_plan(missing_packages, file_plan, restarts, commands)
+    if dry_run:
+        return
+
+    if missing_packages:
+        runcmd("apt-get -y install %s" % " ".join(missing_packages))
+        # re-plan: the packages just installed created (or changed) some of the files
+        file_plan = plan_files(config_files)
+        restarts, commands = get_steps(file_plan)
+    for config_file, changes, content in file_plan:
+        if content is None:
+            logging.warning("Not found after installing packages, skipping: %s" % config_file.path)
+            continue
+        logging.debug("WRITING: %s" % config_file.path)
+        config_file.apply(content)
+    for command in commands:
+        runcmd(command)
+    for service in restarts:
+        runcmd("service %s restart" % service)
+
+
+def get_distribution():
+    if hasattr(platform, 'dist'):  # (removed in python 3.8)
+        return platform.dist()[0]
+    try:
+        with open('/etc/os-release') as f:
+            fields = dict(line.rstrip('\n').split('=', 1) for line in f if '=' in line)
+    except OSError:
+        return None
+    return fields.get('NAME', '').strip('"')
 
-    # modify host.conf
-    modify_config(r'^nospoof on$', 'nospoof on', '/etc/host.conf')
-
-    # enable automatic security updates
-    runcmd("apt-get -y install unattended-upgrades")
-    runcmd('''bash -c "echo -e 'APT::Periodic::Update-Package-Lists "1";\nAPT::Periodic::Unattended-Upgrade "1";' > /etc/apt/apt.conf.d/20auto-upgrades" ''')
-    runcmd("dpkg-reconfigure -fnoninteractive -plow unattended-upgrades")
-
-    # sysctl
-    runcmd("install -m 0644 -o root -g root -D %s/sysctl_rules.conf /etc/sysctl.d/60-tweaks.conf" % DIST_PATH)
-
-    # set up fail2ban
-    runcmd("apt-get -y install fail2ban")
-    runcmd("install -m 0644 -o root -g root -D %s/fail2ban.jail.conf /etc/fail2ban/jail.d/unoblock.conf" % DIST_PATH)
-    runcmd("service fail2ban restart")
-
-    # set up psad (this will install postfix, which will prompt the user)
-    runcmd("apt-get -y install psad")
-    modify_config(r'^ENABLE_AUTO_IDS\s+?N;$', 'ENABLE_AUTO_IDS\tY;', '/etc/psad/psad.conf')
-    modify_config(r'^ENABLE_AUTO_IDS_EMAILS\s+?Y;$', 'ENABLE_AUTO_IDS_EMAILS\tN;', '/etc/psad/psad.conf')
-    for f in ['/etc/ufw/before.rules', '/etc/ufw/before6.rules']:
-        modify_config(
-            r'^# End required lines.*?# allow all on loopback$',
-            '# End required lines\n\n#CUSTOM: for psad\n-A INPUT -j LOG\n-A FORWARD -j LOG\n\n# allow all on loopback',
-            f, dotall=True)
-    runcmd("psad -R && psad --sig-update")
-    runcmd("service ufw restart")
-    runcmd("service psad restart")
-
-    # set up chkrootkit, rkhunter
-    runcmd("apt-get -y install rkhunter chkrootkit")
-    runcmd('bash -c "rkhunter --update; exit 0"')
-    runcmd("rkhunter --propupd")
-    runcmd('bash -c "rkhunter --check --sk; exit 0"')
-    runcmd("rkhunter --propupd")
-
-    # logwatch
-    runcmd("apt-get -y install logwatch libdate-manip-perl")
-
-    # apparmor
-    runcmd("apt-get -y install apparmor apparmor-profiles")
-
-    # auditd
-    # note that auditd will need a reboot to fully apply the rules, due to it operating in "immutable mode" by default
-    runcmd("apt-get -y install auditd audispd-plugins")
-    runcmd("install -m 0640 -o root -g root -D %s/audit.rules /etc/audit/rules.d/unoblock.rules" % DIST_PATH)
-    modify_config(r'^USE_AUGENRULES=.*?$', 'USE_AUGENRULES="yes"', '/etc/default/auditd')
-    runcmd("service auditd restart")
-
-    # iwatch
-    runcmd("apt-get -y install iwatch")
-    modify_config(r'^START_DAEMON=.*?$', 'START_DAEMON=true', '/etc/default/iwatch')
-    runcmd("install -m 0644 -o root -g root -D %s/iwatch.xml /etc/iwatch/iwatch.xml" % DIST_PATH)
-    modify_config(r'guard email="root@localhost"', 'guard email="noreply@%s"' % socket.gethostname(), '/etc/iwatch/iwatch.xml')
-    runcmd("service iwatch restart")
 
 if __name__ == "__main__":
-    if platform.dist()[0] != "Ubuntu":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be done")
+    args = parser.parse_args()
+
+    if get_distribution() != "Ubuntu":
         logging.error("Script requires Ubuntu linux")
         sys.exit(1)
+    if not args.dry_run and os.geteuid() != 0:
+        logging.error("Please run this script as root (or with --dry-run)")
+        sys.exit(1)
 
-    do_security_setup()
+    do_security_setup(args.dry_run)
@@ -5,16 +5,25 @@ fednode.py: script to set up and manage a Unoparty federated node
 
 import sys
 import os
+import abc
 import re
 import argparse
-import copy
 import subprocess
 import configparser
 import socket
 import glob
 import shutil
 import json
-import difflib
+import time
+import struct
+import threading
+import math
+import collections
+import base64
+import bisect
+import hashlib
+import heapq
+import mmap
 from datetime import datetime, timezone
 
 
@@ -25,225 +34,3654 @@ CURDIR = os.getcwd()
 SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
 FEDNODE_CONFIG_FILE = ".fednode.config"
 FEDNODE_CONFIG_PATH = os.path.join(SCRIPTDIR, FEDNODE_CONFIG_FILE)
+FEDNODE_CACHE_DIR = os.path.join(SCRIPTDIR, ".fednode.cache")
+FLEET_INVENTORY_PATH = os.path.join(SCRIPTDIR, "fleet.ini")
+STATUS_CACHE_TTL = 5
+METRICS_PORT_DEFAULT = 9141
+METRICS_WINDOW_DEFAULT = 360
+SYNC_NETWORKS = {
+    'mainnet': {'suffix': '', 'unobtanium_conf': 'unobtanium.conf', 'unobtanium_section': 'main', 'unoparty_conf': 'server.conf',
+                'unobtanium_port': 65535, 'addrindexrs_port': 8122, 'unoparty_port': 4120},
+    'testnet': {'suffix': '-testnet', 'unobtanium_conf': 'unobtanium.testnet.conf', 'unobtanium_section': 'test',
+                'unoparty_conf': 'server.testnet.conf', 'unobtanium_port': 65531, 'addrindexrs_port': 18122,
+                'unoparty_port': 14120},
+}
+BENCH_API_PORTS = {'unoparty': {'mainnet': 4120, 'testnet': 14120}, 'unoblock': {'mainnet': 4420, 'testnet': 14420}}
+# the JSON-RPC calls bench-api can make ({address} and {asset} are filled in from --address and --asset per request)
+BENCH_API_WORKLOADS = {
+    'unoparty': collections.OrderedDict([
+        ('running_info', ('get_running_info', {})),
+        ('balances', ('get_balances', {'filters': [{'field': 'address', 'op': '==', 'value': '{address}'}]})),
+        ('asset_info', ('get_asset_info', {'assets': ['{asset}']})),
+    ]),
+    'unoblock': collections.OrderedDict([
+        ('is_ready', ('is_ready', {})),
+        ('balances', ('get_normalized_balances', {'addresses': ['{address}']})),
+        ('asset_info', ('get_assets_info', {'assetsList': ['{asset}']})),
+    ]),
+}
+BENCH_API_ASSETS = ['UNO', 'XUP']
+WATCH_POLL_INTERVAL = 60  # seconds between block height polls
+WATCH_STALL_MINUTES = 30
+WATCH_BACKOFF_MIN = 10  # seconds before the first restart of a failed service; doubled for each further one
+WATCH_BACKOFF_MAX = 600
+WATCH_MAX_RESTARTS = 5  # consecutive restarts of a service that keeps failing before giving up on it
+WATCH_RECOVERY_TIME = 600  # a service that doesn't fail for this long after a restart counts as recovered
+WATCH_STOP_GRACE = 60  # a container that dies this soon after being sent a kill/stop was stopped on purpose
+WATCH_ALERT_TIMEOUT = 30
+WATCH_DOCKER_EVENTS = ['start', 'kill', 'die', 'oom', 'health_status']
+READINESS_TIMEOUT = 300
+READINESS_POLL_INTERVAL = 1
+READINESS_MIN_UPTIME = 3
+READINESS_PORTS = {'unoblock': 4420, 'unoblock-testnet': 14420, 'xup-proxy': 8197, 'xup-proxy-testnet': 18197}
+LOG_INDEX_STRIDE = 1024 * 1024
+LOG_LEVELS = ['debug', 'info', 'warning', 'error', 'critical']
+LOG_LEVEL_RE = re.compile(r'\b(DEBUG|INFO|WARN(?:ING)?|ERROR|CRITICAL|FATAL)\b')
+# commands that don't touch the source checkouts or configs, and may therefore be run as root (e.g. re-executed via sudo)
+ROOT_ALLOWED_COMMANDS = ['logs', 'vacuum', 'snapshot', 'rollback', 'reparse', 'export', 'bootstrap', 'du']
+# the syntax of the config files in each config/ subdirectory, for set_config_value()
+CONFIG_SYNTAXES = {'unobtanium': 'bitcoin', 'addrindexrs': 'env', 'unoparty': 'ini', 'redis': 'redis', 'mongodb': 'yaml'}
+TUNE_MEMORY_BUDGET = 0.5  # fraction of the RAM all the services' caches together are sized to (see get_tuned_profile())
+UNOPARTY_DB_FILES = {'unoparty': 'unoparty.db', 'unoparty-testnet': 'unoparty.testnet.db'}
+DB_MAX_FREE_RATIO = 0.10
+DB_ANALYSIS_LIMIT = 1000
+DB_INCREMENTAL_VACUUM_PAGES = 1000
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_KEEP_LAST = 3
+SNAPSHOT_KEEP_EVERY = 10000  # blocks
+SNAPSHOT_KEEP_SPARSE = 10
+TIMINGS_TOP = 10  # number of slowest commands listed by --timings
+ARCHIVE_PART_SIZE = 1024 ** 3
+ARCHIVE_JOBS_DEFAULT = min(4, os.cpu_count() or 1)
+# each archive part is extracted into a directory named like this in the volume, then moved into place once verified
+ARCHIVE_STAGING_PREFIX = ".fednode-bootstrap."
+DU_JOBS_DEFAULT = 8
+DU_HISTORY_DAYS = 90
+DU_FORECAST_DAYS = 7
+SIZE_UNITS = {'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3, 'tb': 1000 ** 4,
+              'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4}
+
+REPO_BASE_HTTPS = "https://github.com/terhnt/{}.git"
+REPO_BASE_SSH = "git@github.com:terhnt/{}.git"
+REPOS_BASE = ['unoparty-lib', 'unoparty-cli', 'addrindexrs']
+REPOS_UNOBLOCK = REPOS_BASE + ['unoblock', ]
+REPOS_FULL = REPOS_UNOBLOCK + ['unowallet', 'armory-utxsvr', 'xup-proxy']
+GIT_JOBS_DEFAULT = 4
+FLEET_JOBS_DEFAULT = 8
+FLEET_SSH_PERSIST = 300  # seconds an idle multiplexed ssh connection is kept open for the next fleet command
+# the commands fleet mode runs on each node, with the options that make them output JSON to aggregate
+FLEET_COMMANDS = collections.OrderedDict([
+    ('status', ['status', '--json']), ('configcheck', ['configcheck', '--json']), ('sync', ['sync', '--once', '--json']),
+    ('update', ['update']), ('restart', ['restart']),
+])
+PULL_JOBS_DEFAULT = 4
+REGISTRY_TIMEOUT = 30
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+# most specific last; a HEAD for any of these returns the digest `docker pull` records in RepoDigests
+REGISTRY_MANIFEST_TYPES = ['application/vnd.docker.distribution.manifest.list.v2+json', 'application/vnd.oci.image.index.v1+json',
+                           'application/vnd.docker.distribution.manifest.v2+json', 'application/vnd.oci.image.manifest.v1+json']
+
+# the environment docker-compose interpolates the compose files with (set in main())
+COMPOSE_ENV_VARS = ['FEDNODE_RELEASE_TAG', 'HOSTNAME_BASE', 'MONGODB_HOST_INTERFACE']
+COMPOSE_MODEL_VERSION = 3  # bump when the output of build_compose_model() changes, to invalidate cached models
+# the escapes of YAML double-quoted scalars that JSON doesn't have (see yaml_scalar())
+YAML_ESCAPES = {' ': ' ', '0': '\\u0000', 'a': '\\u0007', 'e': '\\u001b', 'v': '\\u000b', 'N': '\\u0085', '_': '\\u00a0',
+                'L': '\\u2028', 'P': '\\u2029'}
+REPARSE_CHOICES = ['unoparty', 'unoparty-testnet', 'unoblock', 'unoblock-testnet']
+ROLLBACK_CHOICES = ['unoparty', 'unoparty-testnet']
+VACUUM_CHOICES = ['unoparty', 'unoparty-testnet']
+
+CONFIGCHECK_FILES_BASE_EXTERNAL_UNOBTANIUM = [
+    ['addrindexrs', 'addrindexrs.env.default', 'addrindexrs.env'],
+    ['addrindexrs', 'addrindexrs.testnet.env.default', 'addrindexrs.testnet.env'],
+    ['unoparty', 'client.conf.default', 'client.conf'],
+    ['unoparty', 'client.testnet.conf.default', 'client.testnet.conf'],
+    ['unoparty', 'server.conf.default', 'server.conf'],
+    ['unoparty', 'server.testnet.conf.default', 'server.testnet.conf'],
+];
+CONFIGCHECK_FILES_BASE = [
+    ['unobtanium', 'unobtanium.conf.default', 'unobtanium.conf'],
+    ['unobtanium', 'unobtanium.testnet.conf.default', 'unobtanium.testnet.conf'],
+    ['addrindexrs', 'addrindexrs.env.default', 'addrindexrs.env'],
+    ['addrindexrs', 'addrindexrs.testnet.env.default', 'addrindexrs.testnet.env'],
+    ['unoparty', 'client.conf.default', 'client.conf'],
+    ['unoparty', 'client.testnet.conf.default', 'client.testnet.conf'],
+    ['unoparty', 'server.conf.default', 'server.conf'],
+    ['unoparty', 'server.testnet.conf.default', 'server.testnet.conf'],
+];
+CONFIGCHECK_FILES_UNOBLOCK = CONFIGCHECK_FILES_BASE + [
+    ['unoblock', 'server.conf.default', 'server.conf'],
+    ['unoblock', 'server.testnet.conf.default', 'server.testnet.conf'],
+    ['mongodb', 'mongod.conf.default', 'mongod.conf'],
+]
+CONFIGCHECK_FILES_FULL = CONFIGCHECK_FILES_UNOBLOCK;
+CONFIGCHECK_FILES = {
+    'base_extbtc': CONFIGCHECK_FILES_BASE_EXTERNAL_UNOBTANIUM,
+    'base': CONFIGCHECK_FILES_BASE,
+    'unoblock': CONFIGCHECK_FILES_UNOBLOCK,
+    'full': CONFIGCHECK_FILES_FULL,
+}
+# (like the docker CLI, DOCKER_HOST=unix://<path> points fednode at another daemon socket)
+DOCKER_SOCKET_PATH = os.environ["DOCKER_HOST"][len("unix://"):] if os.environ.get("DOCKER_HOST", "").startswith("unix://") else "/var/run/docker.sock"
+DOCKER_API_VERSION = "1.24"
+IS_WINDOWS = os.name == 'nt'
+SUDO_CMD = '' if IS_WINDOWS else "sudo -E"
+# determined lazily (once per run) by get_session_user() and get_sudo_cmd()
+SESSION_USER = None
+IS_SUDO_ACTIVE = None
+# set in ensure_active_configs()
+ACTIVE_CONFIGS_CHECKED = False
+# set in main()
+DOCKER_CONFIG_PATH = None
+DOCKER_API_ENABLED = True
+COMMAND_TRACE = None
+# set in get_docker_client()
+DOCKER_CLIENT = None
+# set in unix_http_connection(), on first use (so http.client is only imported when needed)
+UNIX_HTTP_CONNECTION_CLASS = None
+# resolved docker-compose models, by compose file path (see get_compose_model())
+COMPOSE_MODELS = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='fednode', description='fednode utility v{}'.format(VERSION))
+    parser.add_argument("-V", '--version', action='version', version='%(prog)s {}'.format(VERSION))
+    parser.add_argument("-d", "--debug", action='store_true', default=False, help="increase output verbosity")
+    parser.add_argument("--no-pull", action='store_true', default=False, help="use only local docker images (for debugging)")
+    parser.add_argument("--no-docker-api", action='store_true', default=False, help="always shell out to the docker CLI instead of talking to the docker socket directly")
+    parser.add_argument("--timings", action='store_true', default=False, help="list the slowest external commands run (git, docker, etc) at exit")
+    parser.add_argument("--trace", metavar="FILE", help="write the timings of all external commands run to FILE, in the Chrome trace format (implies --timings)")
+
+    subparsers = parser.add_subparsers(help='help on modes', dest='command')
+    subparsers.required = True
+
+    parser_install = subparsers.add_parser('install', help="install fednode services")
+    parser_install.add_argument("config", choices=['base', 'base_extbtc', 'unoblock', 'full'], help="The name of the service configuration to utilize")
+    parser_install.add_argument("branch", choices=['master', 'develop'], help="The name of the git branch to utilize for the build (note that 'master' pulls the docker 'latest' tags)")
+    parser_install.add_argument("--use-ssh-uris", action="store_true", help="Use SSH URIs for source checkouts from Github, instead of HTTPS URIs")
+    parser_install.add_argument("--mongodb-interface", default="127.0.0.1",
+        help="Bind mongo to this host interface. Localhost by default, enter 0.0.0.0 for all host interfaces.")
+    parser_install.add_argument("-j", "--jobs", type=int, default=GIT_JOBS_DEFAULT, help="Number of source checkouts to run concurrently")
+    parser_install.add_argument("--depth", type=int, default=None, help="Make shallow source checkouts with a history truncated to this many commits")
+    parser_install.add_argument("--partial", action="store_true", help="Make partial (blobless) source checkouts, fetching file contents on demand")
+    parser_install.add_argument("--no-wait", action="store_true", help="Start all services at once, without waiting for their dependencies to be ready")
+    parser_install.add_argument("--timeout", type=int, default=READINESS_TIMEOUT, help="Seconds to wait for a service to be ready before starting its dependents anyway")
+
+    parser_uninstall = subparsers.add_parser('uninstall', help="uninstall fednode services")
+
+    parser_start = subparsers.add_parser('start', help="start fednode services")
+    parser_start.add_argument("services", nargs='*', default='', help="The service or services to start (or blank for all services)")
+    parser_start.add_argument("--no-wait", action="store_true", help="Start the services at once, without waiting for their dependencies to be ready")
+    parser_start.add_argument("--timeout", type=int, default=READINESS_TIMEOUT, help="Seconds to wait for a service to be ready before starting its dependents anyway")
+
+    parser_stop = subparsers.add_parser('stop', help="stop fednode services")
+    parser_stop.add_argument("services", nargs='*', default='', help="The service or services to stop (or blank for all services)")
+
+    parser_restart = subparsers.add_parser('restart', help="restart fednode services")
+    parser_restart.add_argument("services", nargs='*', default='', help="The service or services to restart (or blank for all services)")
+    parser_restart.add_argument("--no-wait", action="store_true", help="Restart the services at once, without waiting for their dependencies to be ready")
+    parser_restart.add_argument("--timeout", type=int, default=READINESS_TIMEOUT, help="Seconds to wait for a service to be ready before starting its dependents anyway")
+
+    parser_reparse = subparsers.add_parser('reparse', help="reparse a unoparty-server or unoblock service")
+    parser_reparse.add_argument("service", choices=REPARSE_CHOICES, help="The name of the service for which to kick off a reparse")
+    parser_reparse.add_argument("--from-block", type=int,
+        help="(unoparty only) Restore the newest snapshot at or before this block and reparse only the blocks after it, "
+             "instead of reparsing from scratch")
+
+    parser_rollback = subparsers.add_parser('rollback', help="rollback a unoparty-server")
+    parser_rollback.add_argument("block_index", type=int, help="the index of the last known good block")
+    parser_rollback.add_argument("service", choices=ROLLBACK_CHOICES, help="The name of the service to rollback")
+    parser_rollback.add_argument("--no-snapshot", action="store_true", help="Don't restore a snapshot, even if there is one at or before the block")
+
+    parser_snapshot = subparsers.add_parser('snapshot', help="manage block-height checkpoint snapshots of a unoparty-server database")
+    parser_snapshot.add_argument("action", choices=['create', 'list', 'prune', 'verify'], help="What to do")
+    parser_snapshot.add_argument("service", choices=ROLLBACK_CHOICES, help="The name of the service whose database to snapshot")
+    parser_snapshot.add_argument("--min-blocks", type=int, default=0,
+        help="(create) Only snapshot if the newest snapshot is at least this many blocks old (for running from cron)")
+    parser_snapshot.add_argument("--no-prune", action="store_true", help="(create) Don't apply the retention policy afterwards")
+    parser_snapshot.add_argument("--keep-last", type=int, default=SNAPSHOT_KEEP_LAST, help="Retention: keep this many of the newest snapshots")
+    parser_snapshot.add_argument("--keep-every", type=int, default=SNAPSHOT_KEEP_EVERY, help="Retention: also keep one snapshot per this many blocks (0: none) ...")
+    parser_snapshot.add_argument("--keep-sparse", type=int, default=SNAPSHOT_KEEP_SPARSE, help="... for this many of the newest such intervals")
+
+    parser_vacuum = subparsers.add_parser('vacuum', help="vacuum the unoparty-server database for better runtime performance")
+    parser_vacuum.add_argument("service", choices=VACUUM_CHOICES, help="The name of the service whose database to vacuum")
+    parser_vacuum.add_argument("--report", action="store_true", help="Only report database statistics; don't change anything")
+    parser_vacuum.add_argument("--force", action="store_true", help="Analyze and compact the database even if the thresholds aren't exceeded")
+    parser_vacuum.add_argument("--max-free-ratio", type=float, default=DB_MAX_FREE_RATIO,
+        help="Compact the database once this fraction of its pages is free")
+    parser_vacuum.add_argument("--offline", action="store_true", help="Stop the service and run a full VACUUM in a transient container (the old behavior)")
+
+    parser_export = subparsers.add_parser('export', help="export data volumes to archives, for bootstrapping other nodes")
+    parser_export.add_argument("output_dir", help="The directory to write the archives to")
+    parser_export.add_argument("volumes", nargs='*', default='', help="The volume or volumes to export (or blank for all volumes)")
+    parser_export.add_argument("-j", "--jobs", type=int, default=ARCHIVE_JOBS_DEFAULT, help="Number of archive parts to compress concurrently")
+    parser_export.add_argument("--part-size", type=parse_size, default=ARCHIVE_PART_SIZE, help="Approximate uncompressed size of each archive part (e.g. 1GiB)")
+
+    parser_bootstrap = subparsers.add_parser('bootstrap', help="restore data volumes from archives made with 'export', instead of syncing from scratch")
+    parser_bootstrap.add_argument("archive_dir", help="The directory holding the archives")
+    parser_bootstrap.add_argument("volumes", nargs='*', default='', help="The volume or volumes to restore (or blank for all volumes archived)")
+    parser_bootstrap.add_argument("-j", "--jobs", type=int, default=ARCHIVE_JOBS_DEFAULT, help="Number of archive parts to extract concurrently")
+    parser_bootstrap.add_argument("--overwrite", action="store_true", help="Replace the contents of volumes that aren't empty")
+
+    parser_du = subparsers.add_parser('du', help="show the disk usage of the data volumes, how fast it grows and when the disk will be full")
+    parser_du.add_argument("volumes", nargs='*', default='', help="The volume or volumes to scan (or blank for all volumes)")
+    parser_du.add_argument("-j", "--jobs", type=int, default=DU_JOBS_DEFAULT, help="Number of directories to scan concurrently")
+    parser_du.add_argument("--full", action="store_true", help="Rescan every directory, instead of reusing the cached results of unchanged ones")
+    parser_du.add_argument("--no-record", action="store_true", help="Don't add this scan to the usage history")
+    parser_du.add_argument("--json", action="store_true", help="Output JSON instead of tables")
+
+    parser_ps = subparsers.add_parser('ps', help="list installed services")
+
+    parser_tail = subparsers.add_parser('tail', help="tail fednode logs")
+    parser_tail.add_argument("services", nargs='*', default='', help="The name of the service or services whose logs to tail (or blank for all services)")
+    parser_tail.add_argument("-n", "--num-lines", type=int, default=50, help="Number of lines to tail")
+
+    parser_logs = subparsers.add_parser('logs', help="tail fednode logs")
+    parser_logs.add_argument("services", nargs='*', default='', help="The name of the service or services whose logs to view (or blank for all services)")
+    parser_logs.add_argument("--since", type=parse_time_arg, help="Only show lines logged since this time (e.g. 2017-05-01T12:00, or 30m, 2h, 1d ago)")
+    parser_logs.add_argument("--until", type=parse_time_arg, help="Only show lines logged until this time (same formats as --since)")
+    parser_logs.add_argument("--grep", type=re.compile, help="Only show lines matching this regular expression")
+    parser_logs.add_argument("--level", choices=LOG_LEVELS, help="Only show lines logged at this level or above")
+    parser_logs.add_argument("-t", "--timestamps", action="store_true", help="Show the time each line was logged")
+
+    parser_exec = subparsers.add_parser('exec', help="execute a command on a specific container")
+    parser_exec.add_argument("service", help="The name of the service to execute the command on")
+    parser_exec.add_argument("cmd", nargs=argparse.REMAINDER, help="The shell command to execute")
+
+    parser_shell = subparsers.add_parser('shell', help="get a shell on a specific service container")
+    parser_shell.add_argument("service", help="The name of the service to shell into")
+
+    parser_update = subparsers.add_parser('update', help="upgrade fednode services (i.e. update source code and restart the container, but don't update the container itself')")
+    parser_update.add_argument("-n", "--no-restart", action="store_true", help="Don't restart the container after updating the code'")
+    parser_update.add_argument("-j", "--jobs", type=int, default=GIT_JOBS_DEFAULT, help="Number of source updates to run concurrently")
+    parser_update.add_argument("--dry-run", action="store_true", help="Only fetch the new code, and show what would be updated and restarted")
+    parser_update.add_argument("--force", action="store_true", help="Clean up and restart the services even if their code didn't change")
+    parser_update.add_argument("services", nargs='*', default='', help="The name of the service or services to update (or blank to for all applicable services)")
+
+    parser_pull = subparsers.add_parser('pull', help="pull the images of the services whose digest changed upstream")
+    parser_pull.add_argument("services", nargs='*', default='', help="The name of the service or services whose images to pull (or blank for all services)")
+    parser_pull.add_argument("-j", "--jobs", type=int, default=PULL_JOBS_DEFAULT, help="Number of images to pull concurrently")
+    parser_pull.add_argument("--check", action="store_true", help="Only show which images are outdated, without pulling them")
+    parser_pull.add_argument("--force", action="store_true", help="Pull every image, even if its digest didn't change")
+
+    parser_rebuild = subparsers.add_parser('rebuild', help="rebuild fednode services (i.e. remove and refetch/install docker containers)")
+    parser_rebuild.add_argument("services", nargs='*', default='', help="The name of the service or services to rebuild (or blank for all services)")
+    parser_rebuild.add_argument("--mongodb-interface", default="127.0.0.1")
+
+    parser_docker_clean = subparsers.add_parser('docker_clean', help="remove ALL docker containers and cached images (use with caution!)")
+
+    parser_configcheck = subparsers.add_parser('configcheck', help="check configuration")
+    parser_configcheck.add_argument("--json", action="store_true", help="Output the results as JSON")
+
+    parser_tune = subparsers.add_parser('tune', help="generate service settings sized for this host's hardware")
+    parser_tune.add_argument("--apply", action="store_true", help="Write the tuned settings to the active config files")
+    parser_tune.add_argument("--cores", type=int, help="Size for this many CPU cores instead of the detected number")
+    parser_tune.add_argument("--memory", type=int, help="Size for this much RAM (in MB) instead of the detected amount")
+    parser_tune.add_argument("--disk", choices=['ssd', 'hdd'], help="Size for this disk type instead of the detected one")
+
+    parser_status = subparsers.add_parser('status', help="show state, health, restarts, uptime and image of every service")
+    parser_status.add_argument("--json", action="store_true", help="Output JSON instead of a table")
+    parser_status.add_argument("--max-age", type=float, default=STATUS_CACHE_TTL,
+        help="Reuse a cached status up to this many seconds old (0 to always query docker)")
+
+    parser_metrics = subparsers.add_parser('metrics', help="stream per-service resource usage and export it for Prometheus")
+    parser_metrics.add_argument("services", nargs='*', default='', help="The service or services to monitor (or blank for all services)")
+    parser_metrics.add_argument("--listen", default="127.0.0.1", help="Host interface to serve Prometheus metrics on")
+    parser_metrics.add_argument("--port", type=int, default=METRICS_PORT_DEFAULT, help="Port to serve Prometheus metrics on (0 to disable)")
+    parser_metrics.add_argument("--window", type=int, default=METRICS_WINDOW_DEFAULT, help="Number of samples kept per service for the rolling summaries")
+    parser_metrics.add_argument("--interval", type=float, default=10, help="Seconds between printed summaries")
+
+    parser_sync = subparsers.add_parser('sync', help="show block heights, lag and ETA of unobtanium, addrindexrs and unoparty")
+    parser_sync.add_argument("--network", choices=['mainnet', 'testnet', 'both'], default='both', help="The network(s) to monitor")
+    parser_sync.add_argument("--host", default="127.0.0.1", help="Host the service RPC ports are published on")
+    parser_sync.add_argument("--interval", type=float, default=10, help="Seconds between polls")
+    parser_sync.add_argument("--once", action="store_true", help="Poll once and exit")
+    parser_sync.add_argument("--json", action="store_true", help="Output a line of JSON per poll instead of a table")
+
+    parser_bench_api = subparsers.add_parser('bench-api', help="load test the unoparty or unoblock JSON-RPC API, reporting throughput and latency percentiles")
+    parser_bench_api.add_argument("api", choices=list(BENCH_API_PORTS), help="The API to load")
+    parser_bench_api.add_argument("--network", choices=['mainnet', 'testnet'], default='mainnet', help="The network whose API to load")
+    parser_bench_api.add_argument("--host", default="127.0.0.1", help="Host the API port is published on")
+    parser_bench_api.add_argument("--port", type=int, help="API port (default: from the service config, else 4120/14120 for unoparty and 4420/14420 for unoblock)")
+    parser_bench_api.add_argument("-w", "--workload", action="append", default=[], metavar="NAME[=WEIGHT]",
+                                  help="A call to make, and how often relative to the others (default: all calls, equally often); one of: {}".format(
+                                      ", ".join(sorted(set(name for workloads in BENCH_API_WORKLOADS.values() for name in workloads)))))
+    parser_bench_api.add_argument("-c", "--concurrency", type=int, default=8, help="Number of connections making requests at once")
+    parser_bench_api.add_argument("--rps", type=float, help="Target requests per second (default: as many as the connections can make)")
+    parser_bench_api.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run for")
+    parser_bench_api.add_argument("--timeout", type=float, default=120, help="Seconds after which a request counts as timed out")
+    parser_bench_api.add_argument("--address", action="append", default=[], help="Address to look up balances of (may be given more than once)")
+    parser_bench_api.add_argument("--asset", action="append", default=[], help="Asset to look up (may be given more than once; default: {})".format(", ".join(BENCH_API_ASSETS)))
+    parser_bench_api.add_argument("--json", action="store_true", help="Output the results as JSON")
+
+    parser_watch = subparsers.add_parser('watch', help="restart services that die, turn unhealthy or stop making block progress, and raise alerts (runs until interrupted)")
+    parser_watch.add_argument("services", nargs='*', default='', help="The service or services to watch (or blank for all services)")
+    parser_watch.add_argument("--stall-minutes", type=float, default=WATCH_STALL_MINUTES,
+        help="Minutes a service may go without a new block while behind before it counts as stalled (0 to not check block heights)")
+    parser_watch.add_argument("--poll-interval", type=float, default=WATCH_POLL_INTERVAL, help="Seconds between block height polls")
+    parser_watch.add_argument("--host", default="127.0.0.1", help="Host the service RPC ports are published on")
+    parser_watch.add_argument("--backoff", type=float, default=WATCH_BACKOFF_MIN, help="Seconds to wait before restarting a failed service, doubled for each further restart")
+    parser_watch.add_argument("--max-backoff", type=float, default=WATCH_BACKOFF_MAX, help="Longest wait before a restart, in seconds")
+    parser_watch.add_argument("--max-restarts", type=int, default=WATCH_MAX_RESTARTS, help="Give up on a service after this many restarts that didn't help")
+    parser_watch.add_argument("--no-restart", action="store_true", help="Only log and alert, without restarting anything")
+    parser_watch.add_argument("--alert-cmd", metavar="CMD",
+        help="Shell command to run on each failure, with FEDNODE_ALERT_SERVICE, FEDNODE_ALERT_KIND, FEDNODE_ALERT_MESSAGE and FEDNODE_ALERT_HOST set")
+    parser_watch.add_argument("--dry-run", action="store_true", help="Log the restarts that would be made, without making them")
+    parser_watch.add_argument("--events", metavar="FILE",
+        help="Read events from a file of JSON lines ('-' for stdin) instead of docker and the service RPC ports, for testing")
+
+    parser_fleet = subparsers.add_parser('fleet', help="run a fednode command on every node of an inventory concurrently, and aggregate the results")
+    parser_fleet.add_argument("-i", "--inventory", default=FLEET_INVENTORY_PATH, help="The inventory of nodes (an INI file with a section per node)")
+    parser_fleet.add_argument("-n", "--nodes", action="append", default=[], help="Only run on these nodes (may be given more than once)")
+    parser_fleet.add_argument("-j", "--jobs", type=int, default=FLEET_JOBS_DEFAULT, help="Number of nodes to run on concurrently")
+    parser_fleet.add_argument("--rolling", type=int, metavar="N", help="Run on N nodes at a time, stopping at the first batch with a failure")
+    parser_fleet.add_argument("--keep-going", action="store_true", help="With --rolling, carry on with the next batches even if a node failed")
+    parser_fleet.add_argument("--timeout", type=float, default=None, help="Seconds to give the command on each node before giving up on it")
+    parser_fleet.add_argument("--json", action="store_true", help="Output the aggregated results as JSON")
+    parser_fleet.add_argument("fleet_command", choices=list(FLEET_COMMANDS), help="The command to run on each node")
+    parser_fleet.add_argument("fleet_args", nargs=argparse.REMAINDER, help="Arguments for the command (e.g. services to restart)")
+
+    return parser.parse_args()
+
+
+def write_config(config):
+    cfg_file = open(FEDNODE_CONFIG_PATH, 'w')
+    config.write(cfg_file)
+    cfg_file.close()
+
+
+def ensure_active_configs():
+    """Copy over the configs from .default to active versions, if they don't already exist"""
+    global ACTIVE_CONFIGS_CHECKED
+    if ACTIVE_CONFIGS_CHECKED:
+        return
+    ACTIVE_CONFIGS_CHECKED = True
+    for default_config in glob.iglob(os.path.join(SCRIPTDIR, 'config', '**/*.default'), recursive=True):
+        active_config = default_config.replace('.default', '')
+        if not os.path.exists(active_config):
+            print("Generating config from defaults at {} ...".format(active_config))
+            shutil.copy2(default_config, active_config)
+            default_config_stat = os.stat(default_config)
+            if not IS_WINDOWS:
+                os.chown(active_config, default_config_stat.st_uid, default_config_stat.st_gid)
+
+
+class CommandTrace(object):
+    """Timings of the external commands run (with --timings or --trace), written out at exit"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.records = []
+        self.threads = {threading.main_thread().ident: 0}
+        self.lock = threading.Lock()
+
+    def add(self, cmd, start, end, returncode, output_bytes):
+        with self.lock:
+            thread = self.threads.setdefault(threading.get_ident(), len(self.threads))
+            self.records.append({'command': cmd, 'start': start, 'end': end, 'returncode': returncode,
+                                 'output_bytes': output_bytes, 'thread': thread})
+
+    def write(self, path):
+        """Write the records in the Chrome trace event format (for chrome://tracing or ui.perfetto.dev)"""
+        events = [{'name': "fednode {}".format(' '.join(sys.argv[1:])), 'cat': "fednode", 'ph': "X", 'pid': os.getpid(), 'tid': 0,
+                   'ts': 0, 'dur': int((time.time() - self.start) * 1e6)}]
+        for record in self.records:
+            events.append({'name': record['command'][:80], 'cat': "command", 'ph': "X", 'pid': os.getpid(), 'tid': record['thread'],
+                           'ts': int((record['start'] - self.start) * 1e6), 'dur': int((record['end'] - record['start']) * 1e6),
+                           'args': {'command': record['command'], 'returncode': record['returncode'], 'output_bytes': record['output_bytes']}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, f)
+
+    def print_summary(self, top=TIMINGS_TOP):
+        total = sum(record['end'] - record['start'] for record in self.records)
+        print("\n{} external command{} ran for {:.1f}s in total ({:.1f}s wall time); the slowest:".format(
+            len(self.records), '' if len(self.records) == 1 else 's', total, time.time() - self.start), file=sys.stderr)
+        rows = [["Time", "Exit", "Output", "Command"]]
+        for record in heapq.nlargest(top, self.records, key=lambda record: record['end'] - record['start']):
+            rows.append(["{:.2f}s".format(record['end'] - record['start']), "-" if record['returncode'] is None else record['returncode'],
+                         "-" if record['output_bytes'] is None else format_size(record['output_bytes']),
+                         record['command'] if len(record['command']) <= 100 else record['command'][:97] + "..."])
+        if len(rows) > 1:
+            sys.stdout.flush()
+            print_table(rows, file=sys.stderr)  # (so it doesn't end up in --json output)
+
+    def finish(self, path=None):
+        if path:
+            self.write(path)
+        self.print_summary()
+
+
+class traced_command(object):
+    """Time one external command for the command trace (a no-op unless --timings or --trace is given).
+
+    The caller sets returncode and output_bytes (when the output is captured) on the yielded object.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd if isinstance(cmd, str) else ' '.join(cmd)
+        self.returncode = None
+        self.output_bytes = None
+        self.start = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if COMMAND_TRACE is not None:
+            COMMAND_TRACE.add(self.cmd, self.start, time.time(), self.returncode, self.output_bytes)
+
+
+def traced_system(cmd):
+    with traced_command(cmd) as trace:
+        status = os.system(cmd)
+        trace.returncode = status if IS_WINDOWS else os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return status
+
+
+def traced_call(cmd, **kwargs):
+    with traced_command(cmd) as trace:
+        trace.returncode = subprocess.call(cmd, **kwargs)
+    return trace.returncode
+
+
+def traced_check_output(cmd, **kwargs):
+    with traced_command(cmd) as trace:
+        try:
+            output = subprocess.check_output(cmd, **kwargs)
+        except subprocess.CalledProcessError as e:
+            trace.returncode, trace.output_bytes = e.returncode, len(e.output or b'')
+            raise
+        trace.returncode, trace.output_bytes = 0, len(output)
+    return output
+
+
+def run_compose_cmd(cmd):
+    assert DOCKER_CONFIG_PATH
+    assert os.environ['FEDNODE_RELEASE_TAG']
+    # compose mounts some of the active configs, so make sure they exist (e.g. ones added since install)
+    ensure_active_configs()
+    return traced_system("{} docker-compose -f {} -p {} {}".format(get_sudo_cmd(), get_rendered_compose_file(), PROJECT_NAME, cmd))
+
+
+def session_user_cmd(cmd):
+    if not IS_WINDOWS:  # make sure to run as the original user, so the permissions are right
+        return "{} -u {} bash -c \"{}\"".format(get_sudo_cmd(), get_session_user(), cmd)
+    return cmd
+
+
+def run_git_job(name, cmd):
+    start = time.time()
+    with traced_command(cmd) as trace:
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        trace.returncode, trace.output_bytes = proc.returncode, len(output)
+    return {'name': name, 'returncode': proc.returncode, 'output': output.decode("utf-8", "replace"), 'elapsed': time.time() - start}
+
+
+def run_git_jobs(jobs, max_workers=GIT_JOBS_DEFAULT):
+    """Run a list of (name, shell command) git jobs on a bounded worker pool.
+
+    Progress is printed as each job completes. Returns the list of per-job results
+    (name, returncode, output, elapsed) in completion order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    results = []
+    if not jobs:
+        return results
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(run_git_job, name, cmd) for name, cmd in jobs]
+        for i, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            print("[{}/{}] {}: {} ({:.1f}s)".format(i, len(jobs), result['name'],
+                "OK" if result['returncode'] == 0 else "FAILED", result['elapsed']))
+            if result['returncode'] != 0:
+                print("\n".join("    {}".format(line) for line in result['output'].rstrip().splitlines()))
+
+    failed = [result['name'] for result in results if result['returncode'] != 0]
+    print("Finished {} git job(s) in {:.1f}s (sum of per-repo times: {:.1f}s)".format(
+        len(results), time.time() - start, sum(result['elapsed'] for result in results)))
+    if failed:
+        print("Git operations failed for: {}".format(', '.join(sorted(failed))))
+    return results
+
+
+def git_head(repo_dir):
+    """Return the (branch, commit) checked out in a repo; branch is None if HEAD is detached"""
+    commit, branch = traced_check_output(["git", "-C", repo_dir, "rev-parse", "HEAD", "--abbrev-ref", "HEAD"]).decode("utf-8").split()
+    return (branch if branch != 'HEAD' else None), commit
+
+
+def git_rev(repo_dir, rev):
+    try:
+        return traced_check_output(["git", "-C", repo_dir, "rev-parse", "--verify", "-q", rev]).decode("utf-8").strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def git_count_commits(repo_dir, old, new):
+    return int(traced_check_output(["git", "-C", repo_dir, "rev-list", "--count", "{}..{}".format(old, new)]).decode("utf-8"))
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__("Docker API error {}: {}".format(status, message))
+        self.status = status
+
+
+class UnixSocketConnectionMixin:
+    """Connects an http.client.HTTPConnection over the Unix domain socket at self.socket_path instead of TCP"""
+    socket_path = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def unix_http_connection(socket_path, timeout=60):
+    """Return an HTTP connection over a Unix domain socket (e.g. the docker daemon socket)"""
+    global UNIX_HTTP_CONNECTION_CLASS
+    if UNIX_HTTP_CONNECTION_CLASS is None:
+        import http.client  # imported lazily, as most commands never need it
+        UNIX_HTTP_CONNECTION_CLASS = type('UnixHTTPConnection', (UnixSocketConnectionMixin, http.client.HTTPConnection), {})
+    conn = UNIX_HTTP_CONNECTION_CLASS('localhost', timeout=timeout)
+    conn.socket_path = socket_path
+    return conn
+
+
+class DockerClient:
+    """Minimal Docker Engine API client, reusing one keep-alive connection for all requests.
+
+    Streaming requests (followed logs) get a connection of their own, so they don't block the shared one.
+    """
+    def __init__(self, socket_path=DOCKER_SOCKET_PATH, api_version=DOCKER_API_VERSION, timeout=60):
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _url(self, path, params=None):
+        import urllib.parse
+        url = "/v{}{}".format(self.api_version, path)
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        return url
+
+    def _request(self, method, path, params=None):
+        import http.client
+        with self._lock:
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = unix_http_connection(self.socket_path, timeout=self.timeout)
+                try:
+                    self._conn.request(method, self._url(path, params), headers={'Host': 'docker'})
+                    response = self._conn.getresponse()
+                    return response.status, response.read()
+                except (http.client.HTTPException, ConnectionError):
+                    # the daemon may have dropped the idle keep-alive connection; reconnect once
+                    self.close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def call(self, method, path, params=None, not_found_ok=False):
+        status, data = self._request(method, path, params)
+        if status == 404 and not_found_ok:
+            return None
+        if status >= 400:
+            try:
+                message = json.loads(data.decode("utf-8"))['message']
+            except (ValueError, KeyError):
+                message = data.decode("utf-8", "replace").strip()
+            raise DockerAPIError(status, message)
+        if not data:
+            return True
+        return json.loads(data.decode("utf-8"))
+
+    def ping(self):
+        status, data = self._request('GET', '/_ping')
+        return status == 200
+
+    def inspect_container(self, name):
+        return self.call('GET', '/containers/{}/json'.format(name), not_found_ok=True)
+
+    def inspect_image(self, name):
+        return self.call('GET', '/images/{}/json'.format(name), not_found_ok=True)
+
+    def inspect_volume(self, name):
+        return self.call('GET', '/volumes/{}'.format(name), not_found_ok=True)
+
+    def list_containers(self, all=False, filters=None):
+        params = {'all': int(all)}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        return self.call('GET', '/containers/json', params)
+
+    def list_images(self):
+        return self.call('GET', '/images/json')
+
+    def start(self, name):
+        return self.call('POST', '/containers/{}/start'.format(name))
+
+    def stop(self, name, timeout=10):
+        return self.call('POST', '/containers/{}/stop'.format(name), {'t': timeout})
+
+    def restart(self, name, timeout=10):
+        return self.call('POST', '/containers/{}/restart'.format(name), {'t': timeout})
+
+    def stats(self, name):
+        """Yield a stats object for a running container about once a second, until it stops"""
+        conn = unix_http_connection(self.socket_path, timeout=None)
+        try:
+            conn.request('GET', self._url('/containers/{}/stats'.format(name), {'stream': 1}), headers={'Host': 'docker'})
+            response = conn.getresponse()
+            if response.status >= 400:
+                raise DockerAPIError(response.status, response.read().decode("utf-8", "replace").strip())
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield json.loads(line.decode("utf-8"))
+        finally:
+            conn.close()
+
+    def logs(self, name, tail='all', follow=False, timestamps=False, tty=False):
+        """Yield raw log chunks for a container, demultiplexing stdout/stderr unless it uses a TTY"""
+        params = {'stdout': 1, 'stderr': 1, 'tail': tail, 'follow': int(follow), 'timestamps': int(timestamps)}
+        conn = unix_http_connection(self.socket_path, timeout=None if follow else self.timeout)
+        try:
+            conn.request('GET', self._url('/containers/{}/logs'.format(name), params), headers={'Host': 'docker'})
+            response = conn.getresponse()
+            if response.status >= 400:
+                raise DockerAPIError(response.status, response.read().decode("utf-8", "replace").strip())
+            while True:
+                if tty:
+                    chunk = response.read1(65536) if hasattr(response, 'read1') else response.read(4096)
+                    if not chunk:
+                        break
+                    yield chunk
+                    continue
+                header = response.read(8)
+                if len(header) < 8:
+                    break
+                size = struct.unpack('>BxxxL', header)[1]
+                yield response.read(size)
+        finally:
+            conn.close()
+
+
+def get_docker_client():
+    """Return the shared docker API client, or None if the docker CLI must be used instead"""
+    global DOCKER_CLIENT
+    if DOCKER_CLIENT is None:
+        if not DOCKER_API_ENABLED or IS_WINDOWS or not os.access(DOCKER_SOCKET_PATH, os.R_OK | os.W_OK):
+            return None
+        import http.client
+        client = DockerClient(DOCKER_SOCKET_PATH)
+        try:
+            client.ping()
+        except (OSError, http.client.HTTPException):
+            return None
+        DOCKER_CLIENT = client
+    return DOCKER_CLIENT
+
+
+def container_name(service):
+    return "{}_{}_1".format(PROJECT_NAME, service)
+
+
+def api_container_cmd(action, services):
+    """Start/stop/restart service containers through the docker API.
+
+    Returns False (doing nothing) if the API can't be used for the request, so the caller
+    should fall back to docker-compose (e.g. to handle all services in dependency order).
+    """
+    client = get_docker_client()
+    if client is None or not services:
+        return False
+    containers = [container_name(service) for service in services]
+    if any(client.inspect_container(name) is None for name in containers):
+        return False
+    for name in containers:
+        print("{} {} ...".format({'start': "Starting", 'stop': "Stopping", 'restart': "Restarting"}[action], name))
+        getattr(client, action)(name)
+    return True
+
+
+def print_container_logs(client, service, tail, follow, prefix):
+    name = container_name(service)
+    info = client.inspect_container(name)
+    if info is None:
+        print("Container {} doesn't seem to exist".format(service))
+        return
+    tty = info['Config'].get('Tty', False)
+    pending = b''
+    for chunk in client.logs(name, tail=tail, follow=follow, tty=tty):
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            sys.stdout.write("{}{}\n".format(prefix, line.decode("utf-8", "replace")))
+        sys.stdout.flush()
+    if pending:
+        sys.stdout.write("{}{}\n".format(prefix, pending.decode("utf-8", "replace")))
+
+
+def api_logs(services, tail='all', follow=False):
+    """Print (and optionally follow) service logs through the docker API; returns False if not possible"""
+    client = get_docker_client()
+    if client is None or not services:
+        return False
+    width = max(len(service) for service in services)
+    prefixes = ["{} | ".format(service.ljust(width)) if len(services) > 1 else "" for service in services]
+    threads = [threading.Thread(target=print_container_logs, args=(client, service, tail, follow, prefix), daemon=True)
+               for service, prefix in zip(services, prefixes)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    return True
+
+
+def service_cmd(action, services):
+    """Start/stop/restart services, through the docker API if possible"""
+    if not api_container_cmd(action, services):
+        run_compose_cmd("{} {}".format(action, ' '.join(services)))
+
+
+def reexec_with_sudo():
+    """Re-run this same fednode command as root (for commands that need to read or write docker's own files)"""
+    if IS_WINDOWS or os.geteuid() == 0:
+        print("Cannot access the docker data files")
+        sys.exit(1)
+    os.execvp("sudo", ["sudo", "-E", sys.executable, os.path.realpath(__file__)] + sys.argv[1:])
+
+
+def api_ps():
+    """Print the project's containers through the docker API; returns False if not possible"""
+    client = get_docker_client()
+    if client is None:
+        return False
+    containers = client.list_containers(all=True, filters={'label': ['com.docker.compose.project={}'.format(PROJECT_NAME)]})
+    rows = [["Name", "Command", "State", "Ports"]]
+    for container in sorted(containers, key=lambda c: c['Names'][0]):
+        ports = ", ".join(
+            "{}:{}->{}/{}".format(p['IP'], p['PublicPort'], p['PrivatePort'], p['Type']) if 'PublicPort' in p
+            else "{}/{}".format(p['PrivatePort'], p['Type']) for p in container.get('Ports', []))
+        command = container.get('Command', '')
+        rows.append([container['Names'][0].lstrip('/'), command if len(command) <= 30 else command[:27] + "...",
+                     container.get('Status', container.get('State', '')), ports])
+    print_table(rows)
+    return True
+
+
+def print_table(rows, file=None):
+    """Print a list of rows (the first being the header) as left-aligned columns"""
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    for i, row in enumerate(rows):
+        print("   ".join(cell.ljust(width) for cell, width in zip(row, widths)) + "   " + row[-1], file=file)
+        if i == 0:
+            print("-" * (sum(widths) + 3 * len(widths) + max(len(row[-1]) for row in rows)), file=file)
+
+
+def is_port_open(port):
+    # TCP ports only
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return sock.connect_ex(('127.0.0.1', port)) == 0  # returns True if the port is open
+
+
+def get_session_user():
+    """Return the name of the user logged in on this session (looked up once, on first use)"""
+    global SESSION_USER
+    if SESSION_USER is None and not IS_WINDOWS:
+        try:
+            SESSION_USER = traced_check_output("logname", stderr=subprocess.DEVNULL).decode("utf-8").strip()
+        except subprocess.CalledProcessError:  # no controlling terminal (e.g. cron or a wrapper script)
+            SESSION_USER = os.environ.get('SUDO_USER') or os.environ.get('USER')
+        assert SESSION_USER
+    return SESSION_USER
+
+
+def get_sudo_cmd():
+    """Return the command prefix used to run things as root, making sure sudo is usable first.
+
+    Only commands that actually shell out as root call this, so pure inspection commands never
+    fork sudo or prompt for a password. The check is done once per run.
+    """
+    global IS_SUDO_ACTIVE
+    if IS_SUDO_ACTIVE is None:
+        IS_SUDO_ACTIVE = IS_WINDOWS or traced_call(["sudo", "-n", "true"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+        if not IS_SUDO_ACTIVE:
+            print("This script requires root access (via sudo) to run. Please enter your sudo password below.")
+            traced_system("bash -c 'sudo whoami > /dev/null'")
+            IS_SUDO_ACTIVE = True
+    return SUDO_CMD
+
+
+def is_container_running(service, abort_on_not_exist=True):
+    client = get_docker_client()
+    if client is not None:
+        info = client.inspect_container(container_name(service))
+        if info is None:
+            if abort_on_not_exist:
+                print("Container {} doesn't seem to exist'".format(service))
+                sys.exit(1)
+            return None
+        return info['State']['Running']
+
+    try:
+        container_running = traced_check_output('{} docker inspect --format="{{{{ .State.Running }}}}" federatednode_{}_1'.format(get_sudo_cmd(), service), shell=True).decode("utf-8").strip()
+        container_running = container_running == 'true'
+    except subprocess.CalledProcessError:
+        container_running = None
+        if abort_on_not_exist:
+            print("Container {} doesn't seem to exist'".format(service))
+            sys.exit(1)
+    return container_running
+
+
+def get_docker_volume_path(volume_name):
+    client = get_docker_client()
+    if client is not None:
+        volume_info = client.inspect_volume(volume_name)
+        return volume_info['Mountpoint'] if volume_info is not None else None
+
+    try:
+        json_output = traced_check_output('{} docker volume inspect {}'.format(get_sudo_cmd(), volume_name), shell=True).decode("utf-8").strip()
+    except subprocess.CalledProcessError:
+        return None
+    volume_info = json.loads(json_output)
+    return volume_info[0]['Mountpoint']
+
+
+class ComposeConfigError(Exception):
+    pass
+
+
+def yaml_split_key(text):
+    """Split "key: value" (or "key:") into key and value; returns None if text isn't a mapping entry"""
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'") and i == 0:
+            quote = char
+        elif char == ':' and (i + 1 == len(text) or text[i + 1] in ' \t'):
+            return yaml_scalar(text[:i].strip()), text[i + 1:].strip()
+    return None
+
+
+def yaml_scalar(text):
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1].replace("''", "'")
+    if len(text) >= 2 and text[0] == text[-1] == '"':  # (JSON, apart from a few escapes only YAML has)
+        return json.loads(re.sub(r'\\(x[0-9a-fA-F]{2}|[ 0aevN_LP\\])', lambda m: YAML_ESCAPES.get(m.group(1)) or
+                                 ("\\u00" + m.group(1)[1:] if m.group(1)[0] == 'x' else m.group(0)), text))
+    if text in ('null', '~'):
+        return None
+    if text == '{}':
+        return {}
+    if text == '[]':
+        return []
+    return text
+
+
+def yaml_folded_scalar(lines, i, indent):
+    """Read the scalar starting at lines[i] (after its key or dash) plus the lines it was wrapped onto, which are
+    indented past indent; returns the value and the index of the next line"""
+    text = lines[i][1]
+    i += 1
+    while i < len(lines) and lines[i][0] > indent:
+        if text.startswith('"') and text.endswith('\\'):  # an escaped line break
+            text = text[:-1] + lines[i][1]
+        else:
+            text += ' ' + lines[i][1]
+        i += 1
+    return yaml_scalar(text), i
+
+
+def yaml_block(lines, i, indent):
+    """Parse the mapping or sequence starting at lines[i], whose entries are at the given indent"""
+    if lines[i][1] == '-' or lines[i][1].startswith('- '):
+        result = []
+        while i < len(lines) and lines[i][0] == indent and (lines[i][1] == '-' or lines[i][1].startswith('- ')):
+            item = lines[i][1][1:].strip()
+            if not item:
+                value, i = yaml_block(lines, i + 1, lines[i + 1][0]) if i + 1 < len(lines) and lines[i + 1][0] > indent else (None, i + 1)
+            elif yaml_split_key(item) is not None:  # "- key: value", continued by keys indented past the dash
+                lines[i] = (indent + 2, item)
+                value, i = yaml_block(lines, i, indent + 2)
+            else:
+                lines[i] = (indent, item)
+                value, i = yaml_folded_scalar(lines, i, indent)
+            result.append(value)
+        return result, i
+
+    result = collections.OrderedDict()
+    while i < len(lines) and lines[i][0] == indent and not (lines[i][1] == '-' or lines[i][1].startswith('- ')):
+        entry = yaml_split_key(lines[i][1])
+        if entry is None:
+            raise ValueError("Cannot parse YAML line: {}".format(lines[i][1]))
+        key, value = entry
+        if value:
+            lines[i] = (indent, value)
+            value, i = yaml_folded_scalar(lines, i, indent)
+        elif i + 1 < len(lines) and (lines[i + 1][0] > indent or (lines[i + 1][0] == indent and lines[i + 1][1].startswith('-'))):
+            value, i = yaml_block(lines, i + 1, lines[i + 1][0])
+        else:
+            value, i = None, i + 1
+        result[key] = value
+    if i < len(lines) and lines[i][0] > indent:
+        raise ValueError("Unexpected YAML indentation: {}".format(lines[i][1]))
+    return result, i
+
+
+def parse_yaml(text):
+    """Parse block-style YAML as written by `docker-compose config`: nested mappings and sequences of plain or
+    quoted scalars (all kept as strings), which may be wrapped over several lines. Comments, anchors, tags and
+    block scalars aren't supported.
+    """
+    lines = []
+    for line in text.splitlines():
+        if line.strip() and line.strip() not in ('---', '...'):
+            lines.append((len(line) - len(line.lstrip()), line.strip()))
+    if not lines:
+        return collections.OrderedDict()
+    return yaml_block(lines, 0, lines[0][0])[0]
+
+
+def load_yaml(text):
+    """Parse a YAML document with PyYAML if it is installed, else with parse_yaml()"""
+    try:
+        import yaml
+    except ImportError:
+        return parse_yaml(text)
+    return yaml.safe_load(text)
+
+
+def build_compose_model(config):
+    """Extract what fednode needs to know about the services from a resolved docker-compose config (as parsed
+    from `docker-compose config`, which has already merged in `extends`, interpolated the environment and made
+    host paths absolute).
+
+    Returns {'services': {name: {'links', 'ports', 'volumes', 'sources', 'image'}}, 'volumes': [names]}. Ports
+    are the published host ports, volumes the named volumes used and sources the checkouts under src/ the
+    service is built from or mounts. Image is the image to pull (None for services built locally). Both the
+    short and the long syntax of ports and volumes are understood.
+    """
+    src_dir = os.path.join(SCRIPTDIR, "src") + os.sep
+    services = collections.OrderedDict()
+    for name, service in (config.get('services') or {}).items():
+        named_volumes, host_paths = [], []
+        for entry in service.get('volumes') or []:
+            if isinstance(entry, dict):
+                source, is_named = entry.get('source') or '', entry.get('type') == 'volume'
+            else:
+                source = entry.split(':')[0]
+                is_named = not source.startswith(('/', '.', '~'))
+            (named_volumes if is_named else host_paths).append(source)
+        build = service.get('build')
+        if isinstance(build, dict):
+            host_paths.append(build.get('context') or '')
+        elif isinstance(build, str):
+            host_paths.append(build)
+        ports = []
+        for entry in service.get('ports') or []:
+            if isinstance(entry, dict):
+                published = str(entry.get('published') or '')
+            else:
+                parts = str(entry).split('/')[0].split(':')
+                published = parts[-2] if len(parts) >= 2 else ''
+            if published.isdigit():
+                ports.append(int(published))
+        sources = []
+        for host_path in host_paths:
+            host_path = os.path.realpath(host_path) if host_path else ''
+            if host_path.startswith(src_dir) and host_path[len(src_dir):].split(os.sep)[0] not in sources:
+                sources.append(host_path[len(src_dir):].split(os.sep)[0])
+        services[name] = {
+            'links': [link.split(':')[0] for link in service.get('links') or []] + list(service.get('depends_on') or []),
+            'ports': ports,
+            'volumes': [volume for volume in named_volumes if volume],
+            'sources': sources,
+            'image': service.get('image') if not build else None,
+        }
+    return {'services': services, 'volumes': list(config.get('volumes') or {})}
+
+
+def compose_inputs_hash(path):
+    """Hash the compose file, the files it extends, the env_files they name and the environment it's interpolated
+    with: everything the output of `docker-compose config` depends on"""
+    sha256 = hashlib.sha256("model {}\0".format(COMPOSE_MODEL_VERSION).encode("utf-8"))
+    paths = [path]
+    while paths:
+        input_path = paths.pop(0)
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        sha256.update(input_path.encode("utf-8") + b"\0" + data + b"\0")
+        for extended in sorted(set(re.findall(rb'^\s+file:\s*["\']?([^"\'\s]+)', data, re.M))):
+            extended_path = os.path.join(os.path.dirname(input_path), extended.decode("utf-8"))
+            if extended_path not in paths:
+                paths.append(extended_path)
+        env_files = re.findall(rb'^\s+env_file:\s*["\']?([^"\'\s]+)', data, re.M)
+        for entries in re.findall(rb'^(\s+)env_file:\s*\n((?:\1\s*-\s*\S+\s*\n)+)', data, re.M):
+            env_files += re.findall(rb'-\s*["\']?([^"\'\s]+)', entries[1])
+        for env_file in sorted(set(env_files)):
+            env_path = os.path.normpath(os.path.join(os.path.dirname(input_path), env_file.decode("utf-8")))
+            try:
+                with open(env_path, 'rb') as f:
+                    sha256.update(env_path.encode("utf-8") + b"\0" + f.read() + b"\0")
+            except OSError:  # (docker-compose config fails on it, so there's nothing to cache)
+                sha256.update(env_path.encode("utf-8") + b"\0missing\0")
+    for name in COMPOSE_ENV_VARS:
+        sha256.update("{}={}\0".format(name, os.environ.get(name, '')).encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def prune_cache(dirname, prefix, keep):
+    try:
+        for name in os.listdir(os.path.join(FEDNODE_CACHE_DIR, dirname)):
+            if name.startswith(prefix) and name not in keep:
+                os.remove(os.path.join(FEDNODE_CACHE_DIR, dirname, name))
+    except OSError:
+        pass
+
+
+def render_compose_file(path):
+    """Return the path of a fully resolved copy of a docker-compose file, rendered with `docker-compose config`
+    once per change of its inputs (see compose_inputs_hash()).
+
+    Raises ComposeConfigError if it can't be rendered (e.g. before install has checked out the sources to build).
+    """
+    ensure_active_configs()  # (the env_files are among them)
+    prefix = os.path.basename(path) + "."
+    cache_name = "{}{}.yml".format(prefix, compose_inputs_hash(path)[:16])
+    rendered_path = os.path.join(FEDNODE_CACHE_DIR, "compose", cache_name)
+    if os.path.exists(rendered_path):
+        return rendered_path
+    try:
+        rendered = traced_check_output(["docker-compose", "-f", path, "-p", PROJECT_NAME, "config"],
+                                       stderr=subprocess.PIPE).decode("utf-8")
+    except OSError as e:
+        raise ComposeConfigError("Cannot run docker-compose: {}".format(e))
+    except subprocess.CalledProcessError as e:
+        error = (e.stderr or b'').decode("utf-8", "replace").strip()
+        raise ComposeConfigError("docker-compose cannot load {}: {}".format(path, error))
+    # (the rendered file includes the contents of the env_files, so keep it private)
+    if not write_cache_text(os.path.join("compose", cache_name), rendered, mode=0o600):
+        raise ComposeConfigError("Cannot write {}".format(rendered_path))
+    prune_cache("compose", prefix, [cache_name, cache_name[:-len(".yml")] + ".json"])
+    return rendered_path
+
+
+def get_compose_model(docker_config_path=None):
+    """Return the model of a docker-compose file (see build_compose_model), built from its rendered copy and
+    cached until an input changes"""
+    path = docker_config_path or DOCKER_CONFIG_PATH
+    if path in COMPOSE_MODELS:
+        return COMPOSE_MODELS[path]
+    ensure_active_configs()
+    prefix = os.path.basename(path) + "."
+    cache_name = "{}{}.json".format(prefix, compose_inputs_hash(path)[:16])
+    model = read_cache(os.path.join("compose", cache_name))
+    if model is None:
+        try:
+            rendered_path = render_compose_file(path)
+            with open(rendered_path) as f:
+                model = build_compose_model(load_yaml(f.read()))
+        except (ComposeConfigError, OSError, ValueError) as e:
+            print("Cannot resolve the services of {}: {}".format(os.path.basename(path), e))
+            sys.exit(1)
+        write_cache(os.path.join("compose", cache_name), model)
+    COMPOSE_MODELS[path] = model
+    return model
+
+
+def get_rendered_compose_file():
+    """Return the rendered copy of the active docker-compose file (see render_compose_file()), for docker-compose
+    to load quicker; or the compose file itself if it can't be rendered"""
+    try:
+        return render_compose_file(DOCKER_CONFIG_PATH)
+    except ComposeConfigError:
+        return DOCKER_CONFIG_PATH
+
+
+def get_compose_services(docker_config_path=None):
+    """Return the names of the services defined in a docker-compose file, in file order"""
+    return list(get_compose_model(docker_config_path)['services'])
+
+
+def get_compose_links(docker_config_path=None):
+    """Return the services each service in a docker-compose file links to (or depends on)"""
+    services = get_compose_model(docker_config_path)['services']
+    return collections.OrderedDict((name, service['links']) for name, service in services.items())
+
+
+def get_source_services(docker_config_path=None):
+    """Return the services built from (or mounting) a source checkout under src/, with the repos to update for each"""
+    services = collections.OrderedDict()
+    for name, service in get_compose_model(docker_config_path)['services'].items():
+        if service['sources']:
+            # unoparty-server is built from unoparty-lib, and its image also gets unoparty-cli from src/
+            services[name] = service['sources'] + (['unoparty-cli'] if 'unoparty-lib' in service['sources'] else [])
+    return services
+
+
+def get_compose_images(services=None, docker_config_path=None):
+    """Return the images to pull for the given services (or all services), without duplicates"""
+    images = []
+    for name, service in get_compose_model(docker_config_path)['services'].items():
+        if (not services or name in services) and service['image'] and service['image'] not in images:
+            images.append(service['image'])
+    return images
+
+
+def get_dependents(services, links):
+    """Return services plus every service that (transitively) links to one of them, dependencies first"""
+    affected = set(services)
+    changed = True
+    while changed:
+        changed = False
+        for service, linked in links.items():
+            if service not in affected and affected.intersection(linked):
+                affected.add(service)
+                changed = True
+    ordered = []
+    seen = set()
+
+    def visit(service):
+        if service in seen:
+            return
+        seen.add(service)
+        for linked in links.get(service, []):
+            if linked in affected:
+                visit(linked)
+        ordered.append(service)
+
+    for service in list(links) + sorted(affected - set(links)):
+        if service in affected:
+            visit(service)
+    return ordered
+
+
+def inspect_containers(names):
+    """Inspect several containers in one go (over the shared API connection, or with a single `docker inspect`).
+
+    Returns a dict of container name to inspect info (None for containers that don't exist).
+    """
+    client = get_docker_client()
+    if client is not None:
+        return {name: client.inspect_container(name) for name in names}
+
+    try:
+        output = traced_check_output('{} docker inspect {}'.format(get_sudo_cmd(), ' '.join(names)),
+                                         shell=True, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:  # some containers don't exist; the others are still output
+        output = e.output
+    infos = json.loads(output.decode("utf-8") or '[]')
+    by_name = {info['Name'].lstrip('/'): info for info in infos}
+    return {name: by_name.get(name) for name in names}
+
+
+def inspect_images(names):
+    """Inspect several local images (by name or ID) in one go; returns a dict of name to inspect info (None if not pulled)"""
+    client = get_docker_client()
+    if client is not None:
+        return {name: client.inspect_image(name) for name in names}
+
+    try:
+        output = traced_check_output('{} docker image inspect {}'.format(get_sudo_cmd(), ' '.join(names)),
+                                     shell=True, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:  # some images aren't pulled yet; the others are still output
+        output = e.output
+    infos = json.loads(output.decode("utf-8") or '[]')
+    tagged = {name: name if ':' in name.rsplit('/', 1)[-1] else name + ":latest" for name in names}
+    return {name: next((info for info in infos if tagged[name] in (info.get('RepoTags') or []) or info.get('Id') == name), None)
+            for name in names}
+
+
+def parse_image_name(image):
+    """Split an image name into (registry, repository, tag or digest), filling in the defaults like docker does"""
+    name, _, digest = image.partition('@')
+    tag = 'latest'
+    if ':' in name.rsplit('/', 1)[-1]:
+        name, tag = name.rsplit(':', 1)
+    registry, _, repository = name.partition('/')
+    if not repository or not ('.' in registry or ':' in registry or registry == 'localhost'):
+        registry, repository = DOCKER_HUB_REGISTRY, name if '/' in name else "library/" + name
+    return registry, repository, digest or tag
+
+
+def registry_request(registry, path, method='GET', accept=REGISTRY_MANIFEST_TYPES):
+    """Make a request to a docker registry's v2 API, getting an anonymous bearer token first if it asks for one.
+
+    Registries on localhost are spoken to over plain HTTP, like docker does.
+    """
+    import urllib.request
+    import urllib.error
+    import urllib.parse
+    scheme = 'http' if registry.split(':')[0] in ('localhost', '127.0.0.1') else 'https'
+    headers = {'Accept': ', '.join(accept)}
+    for attempt in range(2):
+        request = urllib.request.Request("{}://{}{}".format(scheme, registry, path), method=method, headers=headers)
+        try:
+            return urllib.request.urlopen(request, timeout=REGISTRY_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            challenge = e.headers.get('WWW-Authenticate', '')
+            if e.code != 401 or attempt or not challenge.lower().startswith('bearer '):
+                raise
+            params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+            token_url = params.pop('realm')
+            with urllib.request.urlopen("{}?{}".format(token_url, urllib.parse.urlencode(params)), timeout=REGISTRY_TIMEOUT) as response:
+                token = json.loads(response.read().decode("utf-8"))
+            headers['Authorization'] = "Bearer {}".format(token.get('token') or token.get('access_token'))
+
+
+def get_remote_digest(image):
+    """Return the manifest digest an image name currently points to in its registry (a HEAD request, so it's cheap)"""
+    registry, repository, reference = parse_image_name(image)
+    if reference.startswith('sha256:'):
+        return reference
+    with registry_request(registry, "/v2/{}/manifests/{}".format(repository, reference), 'HEAD') as response:
+        return response.headers.get('Docker-Content-Digest')
+
+
+def get_remote_layers(image, digest):
+    """Return the (digest, compressed size) of the layers of an image (for this host's platform) from its registry"""
+    import platform
+    registry, repository, _ = parse_image_name(image)
+    arch = {'x86_64': 'amd64', 'aarch64': 'arm64', 'armv7l': 'arm'}.get(platform.machine(), platform.machine())
+    while True:
+        with registry_request(registry, "/v2/{}/manifests/{}".format(repository, digest)) as response:
+            manifest = json.loads(response.read().decode("utf-8"))
+        if 'manifests' not in manifest:
+            return [(layer['digest'], layer['size']) for layer in manifest.get('layers', [])]
+        platforms = [entry for entry in manifest['manifests']
+                     if entry.get('platform', {}).get('os') == 'linux' and entry.get('platform', {}).get('architecture') == arch]
+        if not platforms:
+            return []
+        digest = platforms[0]['digest']
+
+
+def pull_image(image, digest):
+    """Pull one image with `docker pull`; returns the result, with the layers it's made of if the registry told us"""
+    start = time.time()
+    result = {'image': image, 'digest': digest, 'layers': None, 'error': None}
+    if digest is not None:
+        try:
+            result['layers'] = get_remote_layers(image, digest)
+        except (OSError, ValueError, KeyError):
+            pass
+    try:
+        traced_check_output('{} docker pull -q {}'.format(get_sudo_cmd(), image), shell=True, stderr=subprocess.STDOUT)
+        result['state'] = 'pulled'
+    except subprocess.CalledProcessError as e:
+        result['state'] = 'failed'
+        result['error'] = e.output.decode("utf-8", "replace").strip().split('\n')[-1]
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def pull_images(images, jobs=PULL_JOBS_DEFAULT, check_only=False, force=False):
+    """Pull the images whose digest in their registry changed since they were last pulled.
+
+    Digests are looked up with concurrent HEAD requests and compared to those recorded in the pull cache
+    (and the local images' RepoDigests), then only the changed or missing images are pulled, `jobs` at a
+    time. An image whose digest can't be looked up is pulled anyway, leaving it to docker to decide.
+    Returns a result per image: its state ('current', 'outdated' with check_only, 'pulled' or 'failed'),
+    digest and the size of the layers it needed that weren't part of any image pulled before.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    def remote_digest(image):
+        try:
+            return get_remote_digest(image)
+        except (OSError, ValueError) as e:  # (urllib's errors are OSErrors)
+            return e
+
+    cache = read_cache("pulls.json") or {}
+    known_layers = set(layer for entry in cache.values() for layer in entry.get('layers') or [])
+    results = collections.OrderedDict()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        digests = dict(zip(images, executor.map(remote_digest, images)))
+        local_images = inspect_images(images) if images else {}
+        to_pull = []
+        for image in images:
+            digest = digests[image] if isinstance(digests[image], str) else None
+            info = local_images[image]
+            results[image] = {'image': image, 'digest': digest, 'layers': None, 'error': None, 'elapsed': 0.0,
+                              'state': 'outdated', 'new_bytes': None}
+            if digest is None:
+                results[image]['error'] = "digest lookup failed: {}".format(digests[image])
+            elif info is not None and not force and (cache.get(image, {}).get('digest') == digest or
+                                                     any(name.endswith('@' + digest) for name in info.get('RepoDigests') or [])):
+                results[image]['state'] = 'current'
+                continue
+            to_pull.append(image)
+        if check_only:
+            return list(results.values())
+
+        futures = [executor.submit(pull_image, image, results[image]['digest']) for image in to_pull]
+        for future in as_completed(futures):
+            result = future.result()
+            result['new_bytes'] = None
+            if result['state'] == 'pulled' and result['layers'] is not None:
+                result['new_bytes'] = sum(size for layer, size in result['layers'] if layer not in known_layers)
+                known_layers.update(layer for layer, _ in result['layers'])
+            if result['state'] == 'pulled' and result['digest'] is not None:
+                cache[result['image']] = {'digest': result['digest'], 'layers': [layer for layer, _ in result['layers'] or []],
+                                          'time': int(time.time())}
+            result['error'] = result['error'] or results[result['image']]['error']
+            results[result['image']] = result
+    write_cache("pulls.json", cache)
+    return list(results.values())
+
+
+def print_pull_results(results, elapsed):
+    rows = [["Image", "State", "Digest", "New data", "Time"]]
+    for result in results:
+        rows.append([result['image'], result['state'], (result['digest'] or "-").replace("sha256:", "")[:12],
+                     "-" if result['new_bytes'] is None else format_size(result['new_bytes']),
+                     "{:.1f}s".format(result['elapsed']) if result['state'] in ('pulled', 'failed') else "-"])
+    print_table(rows)
+    for result in results:
+        if result['error']:
+            print("{}: {}".format(result['image'], result['error']))
+    if any(result['state'] == 'outdated' for result in results):
+        print("{} of {} image(s) outdated".format(sum(result['state'] == 'outdated' for result in results), len(results)))
+        return
+    pulled = [result for result in results if result['state'] == 'pulled']
+    print("Pulled {} of {} image(s) in {:.1f}s ({} of new layers)".format(
+        len(pulled), len(results), elapsed, format_size(sum(result['new_bytes'] or 0 for result in pulled))))
+
+
+def parse_docker_time(value):
+    # docker timestamps have nanosecond precision (e.g. 2017-05-01T12:00:00.123456789Z)
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return "{}d {}h".format(days, hours)
+    if hours:
+        return "{}h {}m".format(hours, minutes)
+    if minutes:
+        return "{}m {}s".format(minutes, seconds)
+    return "{}s".format(seconds)
+
+
+def format_size(num_bytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(num_bytes) < 1024 or unit == 'TiB':
+            return "{:.1f}{}".format(num_bytes, unit) if unit != 'B' else "{}B".format(int(num_bytes))
+        num_bytes /= 1024.0
+
+
+def read_cache(name, max_age=None):
+    """Return the JSON data cached under name, or None if missing (or older than max_age seconds)"""
+    path = os.path.join(FEDNODE_CACHE_DIR, name)
+    try:
+        if max_age is not None and time.time() - os.stat(path).st_mtime > max_age:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(name, data):
+    return write_cache_text(name, json.dumps(data))
+
+
+def write_cache_text(name, text, mode=None):
+    # write to a temp file and rename, so concurrent readers never see a partial file
+    path = os.path.join(FEDNODE_CACHE_DIR, name)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            if mode is not None:
+                os.chmod(tmp_path, mode)
+            f.write(text)
+        os.replace(tmp_path, path)
+        if not IS_WINDOWS and os.geteuid() == 0 and 'SUDO_UID' in os.environ:  # keep the cache owned by the session user
+            for cache_path in (FEDNODE_CACHE_DIR, os.path.dirname(path), path):
+                os.chown(cache_path, int(os.environ['SUDO_UID']), int(os.environ['SUDO_GID']))
+    except OSError:  # caching is only an optimization
+        return False
+    return True
+
+
+def get_services_status(build_config, max_age=STATUS_CACHE_TTL):
+    """Return the status of every service in the active docker-compose config, using one batched inspect"""
+    cache_name = "status.{}.json".format(build_config)
+    if max_age > 0:
+        cached = read_cache(cache_name, max_age)
+        if cached is not None:
+            return cached
+
+    services = get_compose_services()
+    infos = inspect_containers([container_name(service) for service in services])
+    image_ids = sorted(set(info['Image'] for info in infos.values() if info is not None))
+    images = inspect_images(image_ids) if image_ids else {}
+    statuses = []
+    for service in services:
+        info = infos[container_name(service)]
+        status = {'service': service, 'state': 'missing', 'health': None, 'restarts': None, 'started_at': None,
+                  'image': None, 'digest': None}
+        if info is not None:
+            state = info['State']
+            status['state'] = state.get('Status', 'running' if state['Running'] else 'exited')
+            status['health'] = state.get('Health', {}).get('Status')
+            status['restarts'] = info.get('RestartCount', 0)
+            status['image'] = info['Image']
+            status['digest'] = image_digest((info.get('Config') or {}).get('Image'), images.get(info['Image']))
+            if state['Running']:
+                status['started_at'] = parse_docker_time(state['StartedAt']).timestamp()
+        statuses.append(status)
+    write_cache(cache_name, statuses)
+    return statuses
+
+
+def image_digest(image, info):
+    """Return the registry digest a local image was pulled as (from its RepoDigests, as `pull` compares them),
+    preferring the repository of the image name the container was created from; None if it has none"""
+    repo_digests = [parse_image_name(name) for name in (info or {}).get('RepoDigests') or []]
+    if image:
+        wanted = parse_image_name(image)[:2]
+        repo_digests = [repo_digest for repo_digest in repo_digests if repo_digest[:2] == wanted] or repo_digests
+    return repo_digests[0][2] if repo_digests else None
+
+
+def print_services_status(statuses, as_json=False):
+    now = time.time()
+    for status in statuses:
+        status['uptime'] = int(now - status['started_at']) if status['started_at'] else None
+    if as_json:
+        print(json.dumps(statuses, indent=2))
+        return
+    rows = [["Service", "State", "Health", "Restarts", "Uptime", "Image", "Digest"]]
+    for status in statuses:
+        image, digest = [(value or "-").replace("sha256:", "")[:12] for value in (status['image'], status.get('digest'))]
+        rows.append([status['service'], status['state'], status['health'] or "-",
+                     "-" if status['restarts'] is None else status['restarts'], format_duration(status['uptime']), image, digest])
+    print_table(rows)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if the list is empty)"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(math.ceil(pct / 100.0 * len(values))) - 1))]
+
+
+def parse_size(value):
+    """Parse a docker CLI size such as '1.5GiB' or '12kB' into bytes"""
+    match = re.match(r'^\s*([\d.]+)\s*([a-zA-Z]*)', value)
+    if not match:
+        return 0
+    return int(round(float(match.group(1)) * SIZE_UNITS.get(match.group(2).lower() or 'b', 1)))
+
+
+def parse_api_stats(stats):
+    """Turn a docker API stats object into a metrics sample"""
+    cpu, precpu = stats.get('cpu_stats', {}), stats.get('precpu_stats', {})
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    online_cpus = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    memory = stats.get('memory_stats', {})
+    memory_stats = memory.get('stats', {})
+    # like `docker stats`, don't count reclaimable page cache as used memory
+    cache = memory_stats.get('total_inactive_file', memory_stats.get('inactive_file', memory_stats.get('cache', 0)))
+    sample = {
+        'time': time.time(),
+        'cpu': cpu_delta / system_delta * online_cpus * 100.0 if system_delta > 0 and cpu_delta > 0 else 0.0,
+        'mem': max(0, memory.get('usage', 0) - cache),
+        'blk_read': 0, 'blk_write': 0, 'net_rx': 0, 'net_tx': 0,
+    }
+    for entry in stats.get('blkio_stats', {}).get('io_service_bytes_recursive') or []:
+        op = entry.get('op', '').lower()
+        if op in ('read', 'write'):
+            sample['blk_' + op] += entry.get('value', 0)
+    for network in (stats.get('networks') or {}).values():
+        sample['net_rx'] += network.get('rx_bytes', 0)
+        sample['net_tx'] += network.get('tx_bytes', 0)
+    return sample
+
+
+def parse_cli_stats(stats):
+    """Turn one line of `docker stats --format '{{json .}}'` output into a metrics sample"""
+    net_rx, net_tx = (stats.get('NetIO', '0B / 0B').split('/') + ['0B'])[:2]
+    blk_read, blk_write = (stats.get('BlockIO', '0B / 0B').split('/') + ['0B'])[:2]
+    return {
+        'time': time.time(),
+        'cpu': float(stats.get('CPUPerc', '0%').rstrip('%') or 0),
+        'mem': parse_size(stats.get('MemUsage', '0B').split('/')[0]),
+        'blk_read': parse_size(blk_read), 'blk_write': parse_size(blk_write),
+        'net_rx': parse_size(net_rx), 'net_tx': parse_size(net_tx),
+    }
+
+
+class MetricsCollector:
+    """Keeps the most recent resource usage samples of each service in fixed-size ring buffers"""
+    def __init__(self, services, window=METRICS_WINDOW_DEFAULT):
+        self.services = services
+        self.samples = {service: collections.deque(maxlen=window) for service in services}
+        self.mem_high_water = {service: 0 for service in services}
+        self.up = {service: 0 for service in services}  # whether the last attempt to collect the service's stats worked
+        self.last_sample = {service: None for service in services}
+        self.last_error = {}
+
+    def add(self, service, sample):
+        self.samples[service].append(sample)
+        self.mem_high_water[service] = max(self.mem_high_water[service], sample['mem'])
+        self.up[service] = 1
+        self.last_sample[service] = sample['time']
+
+    def failed(self, source, services, error):
+        """Mark the services as down, logging the error (once, until it changes) and carrying on"""
+        for service in services:
+            self.up[service] = 0
+        message = "{}: {}".format(type(error).__name__, error)
+        if self.last_error.get(source) != message:
+            self.last_error[source] = message
+            print("{} Collecting {} stats failed: {}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source, message),
+                  file=sys.stderr, flush=True)
+
+    def summary(self, service):
+        samples = list(self.samples[service])
+        if not samples:
+            return None
+        cpu = [sample['cpu'] for sample in samples]
+        summary = dict(samples[-1])
+        summary.update({'cpu_p50': percentile(cpu, 50), 'cpu_p95': percentile(cpu, 95), 'cpu_sum': sum(cpu),
+                        'mem_max': self.mem_high_water[service], 'samples': len(samples)})
+        return summary
+
+    def collect_api_once(self, client, service):
+        """Follow the service's stats stream until it ends (the container stopped) or fails"""
+        try:
+            for stats in client.stats(container_name(service)):
+                if stats.get('precpu_stats', {}).get('system_cpu_usage'):  # the first sample has no CPU delta
+                    try:
+                        self.add(service, parse_api_stats(stats))
+                    except (ValueError, AttributeError, TypeError) as e:  # a malformed sample; wait for the next one
+                        self.failed(service, [service], e)
+            self.up[service] = 0
+        except (OSError, ValueError, AttributeError, DockerAPIError) as e:
+            self.failed(service, [service], e)
+
+    def collect_api(self, client, service):
+        while True:
+            self.collect_api_once(client, service)
+            time.sleep(5)  # not running (yet); try again
+
+    def collect_cli_once(self):
+        names = {container_name(service): service for service in self.services}
+        try:
+            output = traced_check_output('{} docker stats --no-stream --format "{{{{json .}}}}" {}'.format(
+                get_sudo_cmd(), ' '.join(names)), shell=True, stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError as e:  # some containers aren't running; the others are still output
+            output = e.output or b''
+        except OSError as e:
+            self.failed('docker', self.services, e)
+            return
+        collected = set()
+        for line in output.decode("utf-8", "replace").splitlines():
+            try:
+                stats = json.loads(line)
+                service = names.get(stats.get('Name') or stats.get('Container'))
+                if service is not None:
+                    self.add(service, parse_cli_stats(stats))
+                    collected.add(service)
+            except (ValueError, AttributeError) as e:  # a malformed line; the other lines are still used
+                self.failed('docker', [], e)
+        for service in self.services:
+            if service not in collected:
+                self.up[service] = 0
+
+    def collect_cli(self):
+        while True:
+            self.collect_cli_once()
+            time.sleep(1)
+
+    def start(self):
+        client = get_docker_client()
+        if client is not None:
+            targets = [(self.collect_api, (client, service)) for service in self.services]
+        else:
+            targets = [(self.collect_cli, ())]
+        for target, args in targets:
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+    def prometheus_text(self):
+        metrics = [
+            ('fednode_container_cpu_percent', 'gauge', "CPU usage in percent of one core", 'cpu'),
+            ('fednode_container_memory_bytes', 'gauge', "Memory usage, excluding page cache", 'mem'),
+            ('fednode_container_memory_max_bytes', 'gauge', "Highest memory usage seen", 'mem_max'),
+            ('fednode_container_block_read_bytes_total', 'counter', "Bytes read from block devices", 'blk_read'),
+            ('fednode_container_block_write_bytes_total', 'counter', "Bytes written to block devices", 'blk_write'),
+            ('fednode_container_network_receive_bytes_total', 'counter', "Bytes received over the network", 'net_rx'),
+            ('fednode_container_network_transmit_bytes_total', 'counter', "Bytes sent over the network", 'net_tx'),
+        ]
+        summaries = {service: self.summary(service) for service in self.services}
+        lines = []
+        for metric, metric_type, help_text, key in metrics:
+            lines += ["# HELP {} {}".format(metric, help_text), "# TYPE {} {}".format(metric, metric_type)]
+            for service, summary in sorted(summaries.items()):
+                if summary is not None:
+                    lines.append('{}{{service="{}"}} {}'.format(metric, service, summary[key]))
+        lines += ["# HELP fednode_container_cpu_percent_window CPU usage percentiles over the sample window",
+                  "# TYPE fednode_container_cpu_percent_window summary"]
+        for service, summary in sorted(summaries.items()):
+            if summary is not None:
+                lines.append('fednode_container_cpu_percent_window{{service="{}",quantile="0.5"}} {}'.format(service, summary['cpu_p50']))
+                lines.append('fednode_container_cpu_percent_window{{service="{}",quantile="0.95"}} {}'.format(service, summary['cpu_p95']))
+                lines.append('fednode_container_cpu_percent_window_sum{{service="{}"}} {}'.format(service, summary['cpu_sum']))
+                lines.append('fednode_container_cpu_percent_window_count{{service="{}"}} {}'.format(service, summary['samples']))
+        lines += ["# HELP fednode_collector_up Whether the last attempt to collect the service's stats succeeded",
+                  "# TYPE fednode_collector_up gauge"]
+        lines += ['fednode_collector_up{{service="{}"}} {}'.format(service, self.up[service]) for service in sorted(self.services)]
+        lines += ["# HELP fednode_collector_last_sample_timestamp_seconds When the service's most recent sample was taken",
+                  "# TYPE fednode_collector_last_sample_timestamp_seconds gauge"]
+        lines += ['fednode_collector_last_sample_timestamp_seconds{{service="{}"}} {}'.format(service, self.last_sample[service])
+                  for service in sorted(self.services) if self.last_sample[service] is not None]
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self):
+        rows = [["Service", "CPU %", "CPU p50", "CPU p95", "Mem", "Mem max", "Block r/w", "Net rx/tx", "Sampled"]]
+        now = time.time()
+        for service in self.services:
+            summary = self.summary(service)
+            if summary is None:
+                rows.append([service, "-", "-", "-", "-", "-", "-", "-", "never"])
+                continue
+            rows.append([service, "{:.1f}".format(summary['cpu']), "{:.1f}".format(summary['cpu_p50']),
+                         "{:.1f}".format(summary['cpu_p95']), format_size(summary['mem']), format_size(summary['mem_max']),
+                         "{} / {}".format(format_size(summary['blk_read']), format_size(summary['blk_write'])),
+                         "{} / {}".format(format_size(summary['net_rx']), format_size(summary['net_tx'])),
+                         "{} ago".format(format_duration(now - summary['time'])) + ("" if self.up[service] else " (down)")])
+        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        print_table(rows)
+        print()
+
+
+def serve_metrics(collector, host, port):
+    """Serve the collector's metrics in the Prometheus text format from a background thread"""
+    import http.server
+    import socketserver
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = collector.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = MetricsServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_config_values(path, sections=()):
+    """Read a key=value config (or .env) file, with or without [section] headers, into a dict.
+
+    Keys outside of any section are always included; keys in the given sections override them.
+    """
+    try:
+        with open(path) as f:
+            return parse_config_values(f.read(), sections)
+    except FileNotFoundError:
+        return {}
+
+
+def parse_config_values(text, sections=()):
+    parser = configparser.ConfigParser(allow_no_value=True, strict=False, interpolation=None)
+    parser.read_string("[__top__]\n" + text)
+    values = dict(parser['__top__'])
+    for section in sections:
+        if parser.has_section(section):
+            values.update(parser[section])
+    return {key: value.strip('"\'') if value is not None else None for key, value in values.items()}
+
+
+class JSONRPCClient:
+    """JSON-RPC over HTTP, reusing one keep-alive connection"""
+    def __init__(self, host, port, path='/', user=None, password=None, timeout=10):
+        self.host, self.port, self.path, self.timeout = host, port, path, timeout
+        self.headers = {'Content-Type': 'application/json'}
+        if user is not None:
+            credentials = "{}:{}".format(user, password or '').encode("utf-8")
+            self.headers['Authorization'] = "Basic " + base64.b64encode(credentials).decode("ascii")
+        self._conn = None
+        self._id = 0
+
+    def call(self, method, params=None):
+        import http.client
+        self._id += 1
+        body = json.dumps({'jsonrpc': '2.0', 'id': self._id, 'method': method, 'params': params if params is not None else []})
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request('POST', self.path, body, self.headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt:
+                    raise
+        reply = json.loads(data.decode("utf-8"))
+        if reply.get('error'):
+            raise ValueError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class LineJSONRPCClient:
+    """Newline-delimited JSON-RPC over a persistent TCP connection (as spoken by addrindexrs)"""
+    def __init__(self, host, port, timeout=10):
+        self.host, self.port, self.timeout = host, port, timeout
+        self._sock = None
+        self._reader = None
+        self._id = 0
+
+    def call(self, method, params=None):
+        self._id += 1
+        request = json.dumps({'jsonrpc': '2.0', 'id': self._id, 'method': method, 'params': params or []}) + "\n"
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                    self._reader = self._sock.makefile('rb')
+                self._sock.sendall(request.encode("utf-8"))
+                line = self._reader.readline()
+                if not line:
+                    raise ConnectionError("connection closed")
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        reply = json.loads(line.decode("utf-8"))
+        if reply.get('error'):
+            raise ValueError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = self._reader = None
+
+
+def get_sync_clients(network, host='127.0.0.1'):
+    """Build RPC clients for the unobtanium, addrindexrs and unoparty services of a network from their configs
+    (and, for addrindexrs, the active compose file)"""
+    spec = SYNC_NETWORKS[network]
+    config_dir = os.path.join(SCRIPTDIR, 'config')
+    unobtanium = read_config_values(os.path.join(config_dir, 'unobtanium', spec['unobtanium_conf']), [spec['unobtanium_section']])
+    unoparty = read_config_values(os.path.join(config_dir, 'unoparty', spec['unoparty_conf']), ['Default'])
+    # addrindexrs gets its RPC address from the environment in the compose file, so take the port it publishes from there
+    addrindexrs = get_compose_model()['services'].get('addrindexrs' + spec['suffix']) or {}
+    addrindexrs_port = (addrindexrs.get('ports') or [spec['addrindexrs_port']])[0]
+    return {
+        'unobtanium': JSONRPCClient(host, int(unobtanium.get('rpcport') or spec['unobtanium_port']),
+                                    user=unobtanium.get('rpcuser'), password=unobtanium.get('rpcpassword')),
+        'addrindexrs': LineJSONRPCClient(host, addrindexrs_port),
+        'unoparty': JSONRPCClient(host, int(unoparty.get('rpc-port') or spec['unoparty_port']), path='/api/',
+                                  user=unoparty.get('rpc-user'), password=unoparty.get('rpc-password')),
+    }
+
+
+class SyncMonitor:
+    """Polls block heights of each layer of each network and tracks their sync rate"""
+    def __init__(self, clients, window=30):
+        self.clients = clients  # {network: {layer: client}}
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def get_heights(self, clients):
+        heights = {}
+        try:
+            info = clients['unobtanium'].call('getblockchaininfo')
+            heights['unobtanium'] = (info['blocks'], info['headers'])
+        except (OSError, ValueError, KeyError):
+            heights['unobtanium'] = (None, None)
+        chain_height = heights['unobtanium'][0]
+        try:
+            header = clients['addrindexrs'].call('blockchain.headers.subscribe')
+            heights['addrindexrs'] = (header.get('height', header.get('block_height')), chain_height)
+        except (OSError, ValueError, KeyError, AttributeError):
+            heights['addrindexrs'] = (None, chain_height)
+        try:
+            info = clients['unoparty'].call('get_running_info', {})
+            heights['unoparty'] = ((info.get('last_block') or {}).get('block_index'),
+                                   chain_height if chain_height is not None else info.get('unobtanium_block_count'))
+        except (OSError, ValueError, KeyError, AttributeError):
+            heights['unoparty'] = (None, chain_height)
+        return heights
+
+    def poll(self):
+        """Return one row per (network, layer) with height, target, lag, rate (blocks/s) and ETA (s)"""
+        rows = []
+        now = time.time()
+        for network, clients in sorted(self.clients.items()):
+            for layer, (height, target) in self.get_heights(clients).items():
+                history = self.history[(network, layer)]
+                if height is not None:
+                    history.append((now, height))
+                rate = None
+                if len(history) > 1 and history[-1][0] > history[0][0]:
+                    rate = (history[-1][1] - history[0][1]) / (history[-1][0] - history[0][0])
+                lag = target - height if height is not None and target is not None else None
+                eta = None
+                if lag is not None and lag <= 0:
+                    eta = 0
+                elif lag is not None and rate:
+                    eta = lag / rate if rate > 0 else None
+                rows.append({'network': network, 'layer': layer, 'height': height, 'target': target,
+                             'lag': lag, 'rate': rate, 'eta': eta})
+        return rows
+
+    def close(self):
+        for clients in self.clients.values():
+            for client in clients.values():
+                client.close()
+
+
+def print_sync_status(rows):
+    table = [["Network", "Layer", "Height", "Target", "Behind", "Blocks/s", "ETA"]]
+    for row in rows:
+        table.append([row['network'], row['layer'],
+                      "-" if row['height'] is None else row['height'], "-" if row['target'] is None else row['target'],
+                      "-" if row['lag'] is None else row['lag'],
+                      "-" if row['rate'] is None else "{:.2f}".format(row['rate']), format_duration(row['eta'])])
+    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    print_table(table)
+    print()
+
+
+async def read_http_head(reader):
+    """Read the status line and headers of an HTTP/1.1 response from an asyncio stream"""
+    status = int((await reader.readuntil(b"\r\n")).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            return status, headers
+        name, _, value = line.decode("latin-1").partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+class AsyncJSONRPCConnection:
+    """JSON-RPC over one keep-alive HTTP/1.1 connection on an asyncio event loop (reconnecting as needed)"""
+    def __init__(self, host, port, path='/', headers=None):
+        self.host, self.port, self.path = host, port, path
+        self.headers = dict(headers or {}, Host="{}:{}".format(host, port))
+        self.reader = self.writer = None
+        self._id = 0
+
+    async def call(self, method, params=None):
+        import asyncio
+        self._id += 1
+        body = json.dumps({'jsonrpc': '2.0', 'id': self._id, 'method': method, 'params': params if params is not None else []}).encode("utf-8")
+        headers = dict(self.headers, **{'Content-Length': str(len(body)), 'Content-Type': "application/json"})
+        request = "POST {} HTTP/1.1\r\n{}\r\n\r\n".format(self.path, "\r\n".join("{}: {}".format(*item) for item in headers.items()))
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self.writer.write(request.encode("latin-1") + body)
+            status, response_headers, data = await self.read_response()
+        except BaseException:
+            self.close()  # (half-read, so it can't be reused)
+            raise
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        if status >= 400:
+            raise BenchAPIError("HTTP {}".format(status))
+        try:
+            reply = json.loads(data.decode("utf-8"))
+        except ValueError:
+            raise BenchAPIError("invalid JSON reply")
+        if reply.get('error'):
+            raise BenchAPIError("RPC error")
+        return reply.get('result')
+
+    async def read_response(self):
+        status, headers = await read_http_head(self.reader)
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)  # (each chunk ends with a CRLF, as does the empty last one)
+                if not size:
+                    return status, headers, data
+                data += chunk[:-2]
+        if 'content-length' in headers:
+            return status, headers, await self.reader.readexactly(int(headers['content-length']))
+        headers['connection'] = 'close'
+        return status, headers, await self.reader.read()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class BenchAPIError(Exception):
+    pass
+
+
+def fill_params(value, address, asset):
+    if isinstance(value, dict):
+        return {key: fill_params(item, address, asset) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_params(item, address, asset) for item in value]
+    if isinstance(value, str):
+        return value.replace('{address}', address or '').replace('{asset}', asset)
+    return value
+
+
+def run_api_benchmark(host, port, path, headers, workloads, concurrency, rps=None, duration=10, timeout=120,
+                      addresses=(), assets=BENCH_API_ASSETS):
+    """Drive a weighted mix of JSON-RPC calls at an API from `concurrency` pooled keep-alive connections.
+
+    workloads is a list of (name, method, params, weight). Without rps, each connection sends its next request as
+    soon as it has a reply (closed loop); with rps, requests are sent on a fixed schedule, shared by the
+    connections. Returns the latencies (seconds) and errors (by kind) per workload, and the elapsed time.
+    """
+    import asyncio
+    import random
+    names = [workload[0] for workload in workloads]
+    weights = [workload[3] for workload in workloads]
+    calls = {workload[0]: workload[1:3] for workload in workloads}
+    results = collections.OrderedDict((name, {'latencies': [], 'errors': collections.Counter()}) for name in names)
+    state = {'sent': 0}
+
+    async def worker(conn, start):
+        while True:
+            now = time.perf_counter()
+            if now - start >= duration:
+                break
+            if rps:
+                send_at = start + state['sent'] / rps
+                state['sent'] += 1
+                if send_at - start >= duration:
+                    break
+                if send_at > now:
+                    await asyncio.sleep(send_at - now)
+            name = random.choices(names, weights)[0]
+            method, params = calls[name]
+            params = fill_params(params, random.choice(addresses) if addresses else None, random.choice(assets))
+            sent = time.perf_counter()
+            try:
+                await asyncio.wait_for(conn.call(method, params), timeout)
+                results[name]['latencies'].append(time.perf_counter() - sent)
+            except asyncio.TimeoutError:
+                results[name]['errors']['timeout'] += 1
+            except BenchAPIError as e:
+                results[name]['errors'][str(e)] += 1
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+                results[name]['errors']['connection error'] += 1
+                await asyncio.sleep(0.01)  # don't spin on a refused connection
+        conn.close()
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(AsyncJSONRPCConnection(host, port, path, headers), start) for i in range(concurrency)])
+        return time.perf_counter() - start
+
+    loop = asyncio.new_event_loop()
+    try:
+        elapsed = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    return {'workloads': results, 'elapsed': elapsed}
+
+
+def summarize_api_benchmark(result, target_rps=None):
+    summary = {'elapsed': result['elapsed'], 'target_rps': target_rps, 'workloads': collections.OrderedDict()}
+    all_latencies = []
+    all_errors = collections.Counter()
+    for name, workload in list(result['workloads'].items()) + [('total', None)]:
+        latencies = all_latencies if workload is None else workload['latencies']
+        errors = all_errors if workload is None else workload['errors']
+        if workload is not None:
+            all_latencies.extend(latencies)
+            all_errors.update(errors)
+        requests = len(latencies) + sum(errors.values())
+        summary['workloads'][name] = {
+            'requests': requests, 'ok': len(latencies), 'errors': dict(errors),
+            'error_rate': sum(errors.values()) / requests if requests else 0.0,
+            'rps': requests / result['elapsed'] if result['elapsed'] else 0.0,
+            'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None,
+        }
+        if latencies:
+            for pct in (50, 95, 99):
+                summary['workloads'][name]['p{}_ms'.format(pct)] = percentile(latencies, pct) * 1000
+            summary['workloads'][name]['max_ms'] = max(latencies) * 1000
+    return summary
+
+
+def print_api_benchmark(summary):
+    rows = [["Workload", "Requests", "Req/s", "Errors", "p50", "p95", "p99", "Max"]]
+    for name, workload in summary['workloads'].items():
+        rows.append([name, workload['requests'], "{:.1f}".format(workload['rps']),
+                     "{} ({:.1%})".format(sum(workload['errors'].values()), workload['error_rate'])] +
+                    ["-" if workload[key] is None else "{:.1f}ms".format(workload[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')])
+    print_table(rows)
+    total = summary['workloads']['total']
+    print("{} requests in {:.1f}s: {:.1f} req/s{}".format(total['requests'], summary['elapsed'], total['rps'],
+                                                          " (target {:g})".format(summary['target_rps']) if summary['target_rps'] else ""))
+    for kind, count in sorted(total['errors'].items(), key=lambda item: -item[1]):
+        print("  {}: {}".format(kind, count))
+
+
+def watch_log(message):
+    print("{} {}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message), flush=True)
+
+
+def parse_docker_event(event):
+    """Turn a docker container event into a watchdog event, or None if it isn't about a compose service"""
+    attributes = (event.get('Actor') or {}).get('Attributes') or {}
+    service = attributes.get('com.docker.compose.service')
+    if service is None:
+        return None
+    action = event.get('Action') or event.get('status', '')
+    if action.startswith('health_status'):
+        action = action.partition(':')[2].strip()  # 'healthy' or 'unhealthy'
+    exit_code = attributes.get('exitCode')
+    return {'time': event['timeNano'] / 1e9 if 'timeNano' in event else event.get('time', time.time()),
+            'service': service, 'action': action, 'exit_code': int(exit_code) if exit_code is not None else None}
+
+
+async def docker_api_events(socket_path=DOCKER_SOCKET_PATH):
+    """Yield the events of the project's containers from the docker API, over one streaming request"""
+    import asyncio
+    import urllib.parse
+    filters = {'type': ['container'], 'event': WATCH_DOCKER_EVENTS, 'label': ['com.docker.compose.project={}'.format(PROJECT_NAME)]}
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write("GET /v{}/events?{} HTTP/1.1\r\nHost: docker\r\n\r\n".format(
+            DOCKER_API_VERSION, urllib.parse.urlencode({'filters': json.dumps(filters)})).encode("latin-1"))
+        status, headers = await read_http_head(reader)
+        if status >= 400:
+            raise DockerAPIError(status, (await reader.read(4096)).decode("utf-8", "replace").strip())
+        chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        pending = b''
+        while True:
+            if chunked:
+                size = int((await reader.readuntil(b"\r\n")).split(b';')[0], 16)
+                if not size:
+                    break
+                data = (await reader.readexactly(size + 2))[:-2]
+            else:
+                data = await reader.read(65536)
+                if not data:
+                    break
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                event = parse_docker_event(json.loads(line.decode("utf-8"))) if line.strip() else None
+                if event is not None:
+                    yield event
+    finally:
+        writer.close()
+
+
+async def docker_cli_events():
+    """Yield the events of the project's containers from `docker events` (if the docker API can't be used)"""
+    import asyncio
+    cmd = "{} docker events --format '{{{{json .}}}}' --filter type=container --filter label=com.docker.compose.project={} {}".format(
+        get_sudo_cmd(), PROJECT_NAME, " ".join("--filter event={}".format(event) for event in WATCH_DOCKER_EVENTS))
+    with traced_command(cmd) as trace:
+        proc = await asyncio.create_subprocess_shell(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                event = parse_docker_event(json.loads(line.decode("utf-8"))) if line.strip() else None
+                if event is not None:
+                    yield event
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            trace.returncode = await proc.wait()
+
+
+async def reconnecting_events(source, log, delay=5):
+    """Yield the events of an event source forever, starting it again whenever it ends or fails"""
+    import asyncio
+    while True:
+        try:
+            async for event in source():
+                yield event
+            log("docker events stream ended; reconnecting")
+        except (OSError, ValueError, DockerAPIError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            log("docker events stream failed ({}); reconnecting in {}s".format(e, delay))
+        await asyncio.sleep(delay)
+
+
+async def poll_block_heights(networks, host='127.0.0.1', interval=WATCH_POLL_INTERVAL):
+    """Yield a 'height' event for each sync layer service of each network every interval seconds.
+
+    The target of a service is the height it should be at (the chain height; headers for unobtanium itself).
+    """
+    import asyncio
+    monitor = SyncMonitor({network: get_sync_clients(network, host) for network in networks})
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            for network, clients in sorted(monitor.clients.items()):
+                heights = await loop.run_in_executor(None, monitor.get_heights, clients)  # (the RPC clients block)
+                now = time.time()
+                for layer, (height, target) in heights.items():
+                    yield {'time': now, 'service': layer + SYNC_NETWORKS[network]['suffix'], 'action': 'height',
+                           'height': height, 'target': target}
+            await asyncio.sleep(interval)
+    finally:
+        monitor.close()
+
+
+async def read_fake_events(path):
+    """Yield events from a file (or stdin, for '-') of JSON lines, for trying out and testing the watchdog.
+
+    Each line is an event such as {"service": "unoparty", "action": "die", "exit_code": 1} or {"service": "unoparty",
+    "action": "height", "height": 100, "target": 200}; "after" delays it by that many seconds.
+    """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        while True:
+            line = await loop.run_in_executor(None, f.readline)
+            if not line:
+                break
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            event = json.loads(line)
+            if event.get('after'):
+                await asyncio.sleep(event['after'])
+            event.setdefault('exit_code', None)
+            event['time'] = time.time()
+            yield event
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def merge_events(sources):
+    """Yield the events of several async event sources as they come, until all of them end"""
+    import asyncio
+    queue = asyncio.Queue()
+    done = object()
+
+    async def pump(source):
+        try:
+            async for event in source:
+                await queue.put(event)
+        finally:
+            await queue.put(done)
+
+    tasks = [asyncio.ensure_future(pump(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event is done:
+                remaining -= 1
+            else:
+                yield event
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Watchdog:
+    """Restarts services that die, turn unhealthy or stop making block progress, with exponential backoff.
+
+    Driven by events (see merge_events()) from a single asyncio loop, so it costs nothing while all is well.
+    restart is a coroutine function taking a service name (or None to only log and alert), and alert one
+    taking the service, the kind of failure and a message.
+    """
+    def __init__(self, services, restart=None, alert=None, stall_time=WATCH_STALL_MINUTES * 60, backoff_min=WATCH_BACKOFF_MIN,
+                 backoff_max=WATCH_BACKOFF_MAX, max_restarts=WATCH_MAX_RESTARTS, log=None):
+        self.restart = restart
+        self.alert = alert
+        self.stall_time = stall_time
+        self.backoff_min, self.backoff_max = backoff_min, backoff_max
+        self.max_restarts = max_restarts
+        self.log = log or watch_log
+        self.tasks = set()
+        self.state = {service: {'height': None, 'progress': None, 'killed': None, 'stopped': False, 'failures': 0,
+                                'restarted': None, 'last_restart': None, 'pending': False, 'gave_up': False} for service in services}
+
+    def spawn(self, coro):
+        import asyncio
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def handle(self, event):
+        state = self.state.get(event['service'])
+        if state is None:
+            return
+        service, action, now = event['service'], event['action'], event['time']
+        if action == 'kill':
+            state['killed'] = now
+        elif action == 'start':
+            state['stopped'] = state['gave_up'] = False
+            state['progress'] = now  # (give it a full stall_time to make progress again)
+        elif action == 'die' and state['killed'] is not None and now - state['killed'] <= WATCH_STOP_GRACE:
+            state['stopped'] = True
+            if not state['pending'] and (state['restarted'] is None or state['killed'] < state['restarted']):  # (not by us)
+                self.log("{}: stopped".format(service))
+        elif action in ('die', 'oom', 'unhealthy'):
+            message = {'die': "died (exit code {})".format(event.get('exit_code')), 'oom': "ran out of memory",
+                       'unhealthy': "turned unhealthy"}[action]
+            self.fail(service, {'die': 'died'}.get(action, action), message, now)
+        elif action == 'height':
+            self.check_progress(service, event.get('height'), event.get('target'), now)
+
+    def check_progress(self, service, height, target, now):
+        """A service is stalled if it hasn't advanced for stall_time while behind its (known) target"""
+        state = self.state[service]
+        if not self.stall_time:
+            return
+        if height is not None and (state['height'] is None or height > state['height']):
+            state['height'], state['progress'] = height, now
+            return
+        if state['progress'] is None or target is None or (height is not None and height >= target):
+            state['progress'] = now
+            return
+        if not state['stopped'] and now - state['progress'] >= self.stall_time:
+            state['progress'] = now  # (so it's only reported once per stall_time)
+            self.fail(service, 'stalled', "stalled at block {} of {} for {}".format(
+                "-" if height is None else height, target, format_duration(self.stall_time)), now)
+
+    def fail(self, service, kind, message, now):
+        state = self.state[service]
+        if state['pending'] or state['gave_up']:
+            return
+        if state['last_restart'] is not None and now - state['last_restart'] >= WATCH_RECOVERY_TIME:
+            state['failures'] = 0
+        if self.restart is not None and state['failures'] >= self.max_restarts:
+            state['gave_up'] = True
+            message = "{}; giving up after {} restarts".format(message, state['failures'])
+        elif self.restart is not None:
+            delay = min(self.backoff_min * 2 ** state['failures'], self.backoff_max)
+            state['failures'] += 1
+            state['pending'] = True
+            self.spawn(self.restart_later(service, delay))
+            message = "{}; restarting in {}s (attempt {})".format(message, delay, state['failures'])
+        self.log("{}: {}".format(service, message))
+        if self.alert is not None:
+            self.spawn(self.alert(service, 'gave-up' if state['gave_up'] else kind, message))
+
+    async def restart_later(self, service, delay):
+        import asyncio
+        state = self.state[service]
+        try:
+            await asyncio.sleep(delay)
+            self.log("{}: restarting".format(service))
+            state['restarted'] = time.time()
+            await self.restart(service)
+        except Exception as e:
+            self.log("{}: restart failed: {}".format(service, e))
+            if self.alert is not None:
+                self.spawn(self.alert(service, 'restart-failed', str(e)))
+        finally:
+            state['pending'] = False
+            state['last_restart'] = state['progress'] = time.time()
+
+    async def run(self, events):
+        """Handle events until the source ends, then wait for any restarts and alerts still under way"""
+        import asyncio
+        async for event in events:
+            self.handle(event)
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+
+async def run_alert_hook(cmd, service, kind, message):
+    """Run the alert command, with the details of the failure in FEDNODE_ALERT_* environment variables"""
+    import asyncio
+    env = dict(os.environ, FEDNODE_ALERT_SERVICE=service, FEDNODE_ALERT_KIND=kind, FEDNODE_ALERT_MESSAGE=message,
+               FEDNODE_ALERT_HOST=socket.gethostname())
+    with traced_command(cmd) as trace:
+        proc = await asyncio.create_subprocess_shell(cmd, env=env, stdin=subprocess.DEVNULL)
+        try:
+            trace.returncode = await asyncio.wait_for(proc.wait(), WATCH_ALERT_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            trace.returncode = await proc.wait()
+    if trace.returncode:
+        watch_log("{}: alert command exited with code {}".format(service, trace.returncode))
+
+
+def get_readiness_probe(service):
+    """Return a function telling, from a started service's container info, whether it's ready to be depended on.
+
+    The unobtanium, addrindexrs and unoparty layers are ready once their RPC answers (unobtaniumd
+    answers with an error while it loads, addrindexrs doesn't listen until it has indexed), services
+    with a docker healthcheck once healthy, services with a known host port once it's open, and
+    anything else once its container has stayed up for a few seconds.
+    """
+    network = 'testnet' if service.endswith('-testnet') else 'mainnet'
+    layer = service[:-len('-testnet')] if service.endswith('-testnet') else service
+    rpc_calls = {'unobtanium': ('getblockchaininfo', None), 'addrindexrs': ('blockchain.headers.subscribe', None),
+                 'unoparty': ('get_running_info', {})}
+    if layer in rpc_calls:
+        client = get_sync_clients(network)[layer]
+        method, params = rpc_calls[layer]
+
+        def probe(info):
+            try:
+                client.call(method, params)
+                return True
+            except (OSError, ValueError):
+                client.close()
+                return False
+        return probe
+
+    def probe(info):
+        health = info['State'].get('Health')
+        if health is not None:
+            return health.get('Status') == 'healthy'
+        if service in READINESS_PORTS:
+            return is_port_open(READINESS_PORTS[service])
+        return time.time() - docker_time_to_epoch(info['State']['StartedAt']) >= READINESS_MIN_UPTIME
+    return probe
+
+
+def start_and_wait(service, exists, timeout=READINESS_TIMEOUT):
+    """Start one service, then wait (up to timeout seconds) until its readiness probe passes"""
+    start = time.time()
+    if exists:
+        service_cmd('start', [service])
+    else:
+        run_compose_cmd("up -d --no-deps {}".format(service))
+    started = time.time()
+    probe = get_readiness_probe(service)
+    state = 'timeout'
+    while time.time() - start < timeout:
+        info = inspect_containers([container_name(service)])[container_name(service)]
+        if info is None or not info['State']['Running']:
+            state = 'exited'
+            break
+        if probe(info):
+            state = 'ready'
+            break
+        time.sleep(READINESS_POLL_INTERVAL)
+    return {'service': service, 'state': state, 'start_time': started - start, 'ready_time': time.time() - start}
+
+
+def start_services(services, links, timeout=READINESS_TIMEOUT):
+    """Start services in dependency order, each as soon as the services it links to are ready.
+
+    Independent branches (e.g. the mainnet and testnet chains) start concurrently. A service is
+    started anyway once its dependencies time out, but not if one of them exited. Returns the
+    per-service results (state and timings), in completion order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    ensure_active_configs()
+    dependencies = {service: [linked for linked in links.get(service, []) if linked in services] for service in services}
+    infos = inspect_containers([container_name(service) for service in services])
+    pending = list(services)
+    running = {}
+    results = collections.OrderedDict()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, len(services))) as executor:
+        while pending or running:
+            progress = True
+            while progress:
+                progress = False
+                for service in list(pending):
+                    if not all(linked in results for linked in dependencies[service]):
+                        continue
+                    pending.remove(service)
+                    progress = True
+                    blocked = [linked for linked in dependencies[service] if results[linked]['state'] in ('exited', 'skipped')]
+                    if blocked:
+                        results[service] = {'service': service, 'state': 'skipped', 'waited': time.time() - start, 'blocked_by': blocked}
+                        print("{}: not started, as {} didn't come up".format(service, ", ".join(blocked)))
+                        continue
+                    slow = [linked for linked in dependencies[service] if results[linked]['state'] == 'timeout']
+                    if slow:
+                        print("{}: starting although {} isn't ready yet".format(service, ", ".join(slow)))
+                    future = executor.submit(start_and_wait, service, infos[container_name(service)] is not None, timeout)
+                    running[future] = (service, time.time() - start)
+            if not running:
+                for service in pending:  # a dependency cycle (which compose wouldn't accept anyway)
+                    results[service] = {'service': service, 'state': 'skipped', 'waited': time.time() - start, 'blocked_by': []}
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                service, waited = running.pop(future)
+                results[service] = dict(future.result(), waited=waited)
+                print("{}: {} after {:.1f}s".format(service, results[service]['state'], results[service]['ready_time']))
+    return list(results.values())
+
+
+def print_start_results(results, elapsed):
+    rows = [["Service", "Waited", "Start", "Ready", "State"]]
+    for result in results:
+        rows.append([result['service'], "{:.1f}s".format(result['waited']),
+                     "{:.1f}s".format(result['start_time']) if 'start_time' in result else "-",
+                     "{:.1f}s".format(result['ready_time']) if 'ready_time' in result else "-", result['state']])
+    print_table(rows)
+    print("Started {} service(s) in {:.1f}s".format(sum(1 for result in results if result['state'] != 'skipped'), elapsed))
+
+
+def parse_time_arg(value):
+    """Parse a time given as a relative age (30s, 15m, 2h, 1d) or a local date/time, into a UNIX timestamp"""
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', value)
+    if match:
+        return time.time() - float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("invalid time: '{}'".format(value))
+
+
+def docker_time_to_epoch(value):
+    fraction = value[19:].rstrip('Z')
+    return parse_docker_time(value).timestamp() + (float(fraction) if fraction.startswith('.') else 0.0)
+
+
+def log_line_time(line):
+    # json-file log lines end with "time":"<RFC3339Nano>"}, so find the time without decoding the whole line
+    start = line.rfind(b'"time":')
+    if start < 0:
+        return None
+    start = line.find(b'"', start + 7) + 1
+    return docker_time_to_epoch(line[start:line.find(b'"', start)].decode("ascii"))
+
+
+def log_level(message):
+    match = LOG_LEVEL_RE.search(message)
+    if not match:
+        return -1
+    level = {'WARN': 'WARNING', 'FATAL': 'CRITICAL'}.get(match.group(1), match.group(1))
+    return LOG_LEVELS.index(level.lower())
+
+
+def build_log_index(mm):
+    """Build a sparse (offset, time) index of a json-file log, with one entry per LOG_INDEX_STRIDE bytes"""
+    entries = []
+    for offset in range(0, len(mm), LOG_INDEX_STRIDE):
+        # index the first line starting at or after this offset
+        line_start = mm.find(b'\n', offset - 1) + 1 if offset else 0
+        if offset and line_start == 0:
+            break
+        line_end = mm.find(b'\n', line_start)
+        if line_end < 0:
+            break
+        line_time = log_line_time(mm[line_start:line_end])
+        if line_time is not None and (not entries or entries[-1][0] != line_start):
+            entries.append([line_start, line_time])
+    last_end = mm.rfind(b'\n')
+    last_time = log_line_time(mm[mm.rfind(b'\n', 0, last_end) + 1:last_end]) if last_end > 0 else None
+    return {'entries': entries, 'last_time': last_time}
+
+
+def get_log_index(path, mm):
+    """Return the sparse index of a log file, cached until the file changes"""
+    stat = os.stat(path)
+    cache_name = os.path.join("logindex", hashlib.sha1(path.encode("utf-8")).hexdigest() + ".json")
+    key = [stat.st_ino, stat.st_size, stat.st_mtime]
+    index = read_cache(cache_name)
+    if index is None or index.get('key') != key:
+        index = build_log_index(mm)
+        index['key'] = key
+        write_cache(cache_name, index)
+    return index
+
+
+def read_log_file(path, since=None, until=None):
+    """Yield (time, message) for the lines of one json-file log within the [since, until] time window"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        index = get_log_index(path, mm)
+        entries = index['entries']
+        if not entries or (since is not None and index['last_time'] is not None and index['last_time'] < since) \
+                or (until is not None and entries[0][1] > until):
+            return
+        pos = 0
+        if since is not None:  # jump to the last indexed line before the window
+            i = bisect.bisect_left([entry[1] for entry in entries], since) - 1
+            if i >= 0:
+                pos = entries[i][0]
+        while True:
+            end = mm.find(b'\n', pos)
+            if end < 0:
+                break
+            line = mm[pos:end]
+            pos = end + 1
+            line_time = log_line_time(line)
+            if line_time is None or (since is not None and line_time < since):
+                continue
+            if until is not None and line_time > until:
+                break
+            yield line_time, json.loads(line.decode("utf-8")).get('log', '').rstrip('\n')
+    finally:
+        mm.close()
+
+
+def get_log_files(log_path):
+    """Return a container's json-file log and its rotated predecessors, oldest first"""
+    rotated = []
+    for path in glob.glob(glob.escape(log_path) + ".*"):
+        suffix = path[len(log_path) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), path))
+    return [path for _, path in sorted(rotated, reverse=True)] + [log_path]
+
+
+def read_service_logs(service, log_path, since=None, until=None, pattern=None, min_level=None):
+    for path in get_log_files(log_path):
+        if not os.path.exists(path):
+            continue
+        for line_time, message in read_log_file(path, since, until):
+            if pattern is not None and not pattern.search(message):
+                continue
+            if min_level is not None and log_level(message) < min_level:
+                continue
+            yield line_time, service, message
+
+
+def native_logs(services, since=None, until=None, pattern=None, level=None, timestamps=False):
+    """Print the json-file logs of the given services, merged in time order.
+
+    Returns False if the log files aren't readable by this user.
+    """
+    infos = inspect_containers([container_name(service) for service in services])
+    min_level = LOG_LEVELS.index(level) if level else None
+    streams = []
+    for service in services:
+        info = infos[container_name(service)]
+        if info is None:
+            print("Container {} doesn't seem to exist".format(service))
+            continue
+        if info['HostConfig']['LogConfig']['Type'] != 'json-file' or not info.get('LogPath'):
+            print("Container {} doesn't use the json-file logging driver".format(service))
+            continue
+        if not os.access(os.path.dirname(info['LogPath']), os.R_OK | os.X_OK):
+            return False
+        streams.append(read_service_logs(service, info['LogPath'], since, until, pattern, min_level))
+
+    width = max(len(service) for service in services)
+    for line_time, service, message in heapq.merge(*streams):
+        prefix = "{} | ".format(service.ljust(width)) if len(services) > 1 else ""
+        if timestamps:
+            prefix += datetime.fromtimestamp(line_time, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ ")
+        print(prefix + message)
+    return True
+
+
+def get_block_device_type(path):
+    """Return 'ssd' or 'hdd' for the block device holding path (None if unknown)"""
+    try:
+        dev = os.stat(path).st_dev
+        sys_path = os.path.realpath("/sys/dev/block/{}:{}".format(os.major(dev), os.minor(dev)))
+        for candidate in (sys_path, os.path.dirname(sys_path)):  # partitions have no queue/ of their own
+            rotational_path = os.path.join(candidate, "queue", "rotational")
+            if os.path.exists(rotational_path):
+                with open(rotational_path) as f:
+                    return 'hdd' if f.read().strip() == '1' else 'ssd'
+    except OSError:
+        pass
+    return None
+
+
+def detect_hardware():
+    memory_mb = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    memory_mb = int(line.split()[1]) // 1024
+    except OSError:  # not linux
+        try:
+            memory_mb = int(traced_check_output(["sysctl", "-n", "hw.memsize"]).decode("utf-8")) // (1024 * 1024)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    docker_root = "/var/lib/docker"
+    return {
+        'cores': os.cpu_count() or 1,
+        'memory_mb': memory_mb,
+        'disk': get_block_device_type(docker_root if os.path.exists(docker_root) else SCRIPTDIR),
+    }
+
+
+def clamp(value, low, high):
+    return max(low, min(high, int(value)))
+
+
+def get_tuned_profile(build_config, hardware):
+    """Size the services' settings for the given hardware.
+
+    Returns a list of [dirname, filename, {key: value}] for the active config files to change.
+    All caches together are sized to TUNE_MEMORY_BUDGET of the RAM, leaving the rest to the OS page
+    cache and the services' own working sets: unobtaniumd (mainnet) gets the biggest share, as its
+    UTXO cache is what makes the initial sync fast. mongodb only takes whole GB of cache; when that
+    wouldn't be less than what it sizes its cache to by itself, its setting is left out.
+    """
+    cores, memory_mb, hdd = hardware['cores'], hardware['memory_mb'], hardware['disk'] == 'hdd'
+    budget_mb = memory_mb * TUNE_MEMORY_BUDGET
+    shares = collections.OrderedDict()  # (of the budget, between the caches the build config runs)
+    if build_config != 'base_extbtc':
+        shares['unobtanium.conf'], shares['unobtanium.testnet.conf'] = 0.7 if hdd else 0.6, 0.1
+    if build_config in ('unoblock', 'full'):
+        shares['redis.conf'], shares['mongod.conf'] = 0.06, 0.24
+    total_share, cache_size_gb = sum(shares.values()), None
+    if 'mongod.conf' in shares:
+        mongodb_default_mb = max(0.5 * (memory_mb - 1024), 256)  # (what mongodb sizes its cache to by itself)
+        cache_size_gb = clamp(budget_mb * shares.pop('mongod.conf') / total_share / 1024, 1, 64)
+        if cache_size_gb * 1024 >= mongodb_default_mb:
+            cache_size_gb = None
+        budget_mb = max(0, budget_mb - (mongodb_default_mb if cache_size_gb is None else cache_size_gb * 1024))
+    sizes = {name: budget_mb * share / sum(shares.values()) for name, share in shares.items()}
+
+    profile = []
+    if build_config != 'base_extbtc':
+        rpcthreads = clamp(cores, 4, 32)
+        for conf, high in (('unobtanium.conf', 16384), ('unobtanium.testnet.conf', 2048)):
+            profile.append(['unobtanium', conf, collections.OrderedDict([
+                ('dbcache', clamp(sizes[conf], 4, high)),  # (4 MB is the least unobtaniumd accepts)
+                ('par', clamp(cores, 1, 16)),
+                ('rpcthreads', rpcthreads),
+                ('rpcworkqueue', max(16, rpcthreads * 8)),
+            ])])
+    for env in ('addrindexrs.env', 'addrindexrs.testnet.env'):
+        # big hosts can afford to answer address queries with longer transaction histories
+        profile.append(['addrindexrs', env, {'ADDRINDEXRS_TXID_LIMIT': clamp(15000 * memory_mb / 8192, 15000, 100000)}])
+    for conf in ('server.conf', 'server.testnet.conf'):
+        profile.append(['unoparty', conf, {'rpc-batch-size': clamp(20 * cores / (8 if hdd else 4), 20, 100)}])
+    if build_config in ('unoblock', 'full'):
+        profile.append(['redis', 'redis.conf', {'maxmemory': "{}mb".format(clamp(sizes['redis.conf'], 1, 4096))}])
+        if cache_size_gb is not None:
+            profile.append(['mongodb', 'mongod.conf', {'storage.wiredTiger.engineConfig.cacheSizeGB': cache_size_gb}])
+    return profile
+
+
+def yaml_set_value(text, path, value):
+    """Set a nested key (given as a dotted path) of a block-style YAML document, adding the missing levels"""
+    keys = path.split('.')
+    lines = text.splitlines()
+    start, end, indent = 0, len(lines), -1  # the block holding the current level: lines[start:end], indented by more than indent
+    for depth, key in enumerate(keys):
+        child_indent = found = None
+        for i in range(start, end):
+            stripped = lines[i].lstrip(' ')
+            if not stripped.strip() or stripped.startswith('#'):
+                continue
+            if stripped.startswith('\t'):
+                raise ValueError("tab-indented YAML is not supported")
+            line_indent = len(lines[i]) - len(stripped)
+            child_indent = line_indent if child_indent is None else child_indent
+            if line_indent == child_indent and re.match(r'{}\s*:'.format(re.escape(key)), stripped):
+                found = i
+                break
+        if found is None:
+            base = child_indent if child_indent is not None else indent + 2 if indent >= 0 else 0
+            while end > start and not lines[end - 1].strip():
+                end -= 1
+            lines[end:end] = ["{}{}:{}".format(' ' * (base + 2 * j), name, " {}".format(value) if depth + j == len(keys) - 1 else "")
+                              for j, name in enumerate(keys[depth:])]
+            break
+        rest = re.sub(r'(^|\s)#.*$', '', lines[found].split(':', 1)[1]).strip()
+        block_end = found + 1
+        while block_end < end and (not lines[block_end].strip() or len(lines[block_end]) - len(lines[block_end].lstrip(' ')) > child_indent):
+            block_end += 1
+        has_children = any(line.strip() and not line.lstrip().startswith('#') for line in lines[found + 1:block_end])
+        if depth == len(keys) - 1:
+            if has_children:
+                raise ValueError("{} is a mapping, not a value".format(path))
+            lines[found] = "{}{}: {}".format(' ' * child_indent, key, value)
+        elif rest:
+            raise ValueError("{} is not a block mapping".format('.'.join(keys[:depth + 1])))
+        start, end, indent = found + 1, block_end, child_indent
+    return "\n".join(lines) + "\n"
+
+
+def set_config_value(text, key, value, syntax):
+    """Set key to value in the text of a config file, in the file's own syntax (see CONFIG_SYNTAXES).
+
+    Raises ValueError if the key can't be added in a way the service would understand.
+    """
+    if syntax == 'yaml':
+        return yaml_set_value(text, key, value)
+    if syntax == 'redis':
+        line, key_re = "{} {}".format(key, value), r'^{}\s.*$'.format(re.escape(key))
+    else:
+        line, key_re = "{}={}".format(key, value), r'^{}\s*=.*$'.format(re.escape(key))
+    new_text, count = re.subn(key_re, lambda m: line, text, count=1, flags=re.MULTILINE)
+    if count:
+        return new_text
+    sections = [m.start() for m in re.finditer(r'^\[.*\]\s*$', text, re.MULTILINE)]
+    if syntax == 'bitcoin' and sections:  # (settings before the first [section] apply to every network)
+        head = text[:sections[0]].rstrip("\n")
+        return (head + "\n" + line if head else line + "\n") + text[len(head):]
+    if syntax == 'ini' and len(sections) != 1:
+        raise ValueError("don't know which section to add {} to".format(key))
+    return text + ("" if not text or text.endswith("\n") else "\n") + line + "\n"
+
+
+def tune(build_config, hardware, apply=False):
+    import difflib
+    ensure_active_configs()
+    print("Tuning for {} CPU cores, {} MB RAM, {} disk".format(hardware['cores'], hardware['memory_mb'], hardware['disk'] or "unknown"))
+    changes = []
+    for dirname, filename, values in get_tuned_profile(build_config, hardware):
+        path = os.path.join(SCRIPTDIR, 'config', dirname, filename)
+        if not os.path.exists(path):
+            print("Config file not found at {}".format(path))
+            continue
+        with open(path) as f:
+            text = f.read()
+        tuned_text = text
+        try:
+            for key, value in values.items():
+                tuned_text = set_config_value(tuned_text, key, value, CONFIG_SYNTAXES[dirname])
+        except ValueError as e:  # (checked for every file before any of them is written)
+            print("Cannot tune {}: {}. Nothing was changed.".format(path, e))
+            sys.exit(1)
+        if tuned_text == text:
+            print("{}: OK".format(os.path.join(dirname, filename)))
+            continue
+        changes.append((path, tuned_text))
+        diff = difflib.unified_diff(text.splitlines(True), tuned_text.splitlines(True), filename, filename + " (tuned)", n=1)
+        print("Tuned settings for {}:\n".format(path))
+        print("".join(diff))
+    if changes and apply:
+        for path, tuned_text in changes:
+            with open(path, 'w') as f:
+                f.write(tuned_text)
+        print("Settings written. Restart the affected services (or run 'fednode restart') for them to take effect.")
+    elif changes:
+        print("Run 'fednode tune --apply' to write these settings.")
+
+
+def db_connect(path):
+    import sqlite3
+    return sqlite3.connect(path, timeout=60, isolation_level=None)
+
+
+def get_db_stats(path):
+    """Report page and freelist counts, planner statistics and table/index sizes of a SQLite database"""
+    import sqlite3
+    conn = db_connect(path)
+    try:
+        pragma = lambda name: conn.execute("PRAGMA {}".format(name)).fetchone()[0]
+        stats = {'path': path, 'page_size': pragma('page_size'), 'page_count': pragma('page_count'),
+                 'freelist_count': pragma('freelist_count'), 'auto_vacuum': pragma('auto_vacuum'),
+                 'journal_mode': pragma('journal_mode'), 'objects': None}
+        stats['free_ratio'] = stats['freelist_count'] / stats['page_count'] if stats['page_count'] else 0.0
+        stats['size'] = stats['page_size'] * stats['page_count']
+        stats['analyzed'] = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+        try:  # needs SQLite built with the dbstat virtual table
+            stats['objects'] = conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC").fetchall()
+        except sqlite3.OperationalError:
+            pass
+    finally:
+        conn.close()
+    return stats
+
+
+def print_db_stats(stats, max_objects=15):
+    print("Database {}".format(stats['path']))
+    print("  size: {} ({} pages of {} bytes)".format(format_size(stats['size']), stats['page_count'], stats['page_size']))
+    print("  free pages: {} ({:.1%})".format(stats['freelist_count'], stats['free_ratio']))
+    print("  auto_vacuum: {}, journal_mode: {}, analyzed: {}".format(
+        {0: "none", 1: "full", 2: "incremental"}.get(stats['auto_vacuum']), stats['journal_mode'], "yes" if stats['analyzed'] else "no"))
+    if stats['objects']:
+        rows = [["Table/index", "Size"]] + [[name, format_size(size)] for name, size in stats['objects'][:max_objects]]
+        print_table(rows)
+
+
+def db_analyze(path):
+    conn = db_connect(path)
+    try:
+        conn.execute("PRAGMA analysis_limit = {}".format(DB_ANALYSIS_LIMIT))  # sampled (fast) ANALYZE, on SQLite 3.32+
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def db_incremental_vacuum(path):
+    """Release the free pages of an auto_vacuum=INCREMENTAL database in small steps, letting writers in between"""
+    conn = db_connect(path)
+    try:
+        while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # run via executescript, which steps the pragma to completion (execute() frees a single page)
+            conn.executescript("PRAGMA incremental_vacuum({});".format(DB_INCREMENTAL_VACUUM_PAGES))
+            time.sleep(0.01)
+    finally:
+        conn.close()
+
+
+def db_copy_and_swap(path, stop_service, start_service):
+    """Compact a database with minimal downtime: make a compacted copy while the service keeps running,
+    then stop the service just long enough to check nothing was written meanwhile and swap the copy in.
+
+    Writes are detected with PRAGMA data_version on one connection held open from before the copy until
+    the service is stopped, so updates and deletes count as well as inserts.
+    Returns False (leaving the database untouched) if it was written to while being copied.
+    """
+    import sqlite3
+    copy_path = path + ".compact"
+    for leftover in (copy_path, copy_path + "-journal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    conn = db_connect(path)
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if sqlite3.sqlite_version_info >= (3, 27, 0):
+            conn.execute("VACUUM INTO ?", (copy_path, ))
+        else:
+            copy_conn = db_connect(copy_path)
+            conn.backup(copy_conn)
+            copy_conn.execute("VACUUM")
+            copy_conn.close()
+
+        copy_conn = db_connect(copy_path)
+        integrity = copy_conn.execute("PRAGMA quick_check").fetchone()[0]
+        copy_conn.execute("PRAGMA journal_mode = {}".format(journal_mode))  # the copy doesn't inherit WAL mode
+        copy_conn.close()
+        if integrity != 'ok':
+            os.remove(copy_path)
+            raise sqlite3.DatabaseError("compacted copy failed its integrity check: {}".format(integrity))
+
+        stop_service()
+        try:
+            # (data_version only changes for commits made by other connections, not for the copy made on this one)
+            unchanged = conn.execute("PRAGMA data_version").fetchone()[0] == data_version
+            if unchanged:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+            if not unchanged:
+                os.remove(copy_path)
+                return False
+            stat = os.stat(path)
+            if not IS_WINDOWS:
+                os.chown(copy_path, stat.st_uid, stat.st_gid)
+            os.chmod(copy_path, stat.st_mode)
+            os.replace(copy_path, path)
+            for stale in (path + "-wal", path + "-shm"):  # these belong to the old file and must not be applied to the new one
+                if os.path.exists(stale):
+                    os.remove(stale)
+        finally:
+            start_service()
+    finally:
+        conn.close()
+    return True
+
+
+def db_maintenance(path, stop_service, start_service, max_free_ratio=DB_MAX_FREE_RATIO, force=False):
+    """Analyze and/or compact a database, but only what its statistics say is needed"""
+    stats = get_db_stats(path)
+    print_db_stats(stats)
+    if force or not stats['analyzed']:
+        print("Updating query planner statistics (ANALYZE) ...")
+        db_analyze(path)
+    if not force and stats['free_ratio'] <= max_free_ratio:
+        print("Free page ratio {:.1%} is below the {:.1%} threshold; not compacting".format(stats['free_ratio'], max_free_ratio))
+        return
+    start = time.time()
+    if stats['auto_vacuum'] == 2:
+        print("Releasing free pages (incremental vacuum) ...")
+        db_incremental_vacuum(path)
+    else:
+        print("Compacting a copy of the database while the service keeps running ...")
+        if not db_copy_and_swap(path, stop_service, start_service):
+            print("The database was written to while it was being compacted, so it was left as it was. "
+                  "Try again when the service is idle (e.g. once synced), or use --offline")
+            sys.exit(1)
+    stats = get_db_stats(path)
+    print("Done in {:.1f}s. New size: {} ({:.1%} free)".format(time.time() - start, format_size(stats['size']), stats['free_ratio']))
+
+
+def db_block_index(path):
+    """Return the index of the last block parsed into a unoparty database (or None if there's none yet)"""
+    import sqlite3
+    conn = db_connect(path)
+    try:
+        return conn.execute("SELECT MAX(block_index) FROM blocks").fetchone()[0]
+    except sqlite3.OperationalError:  # no blocks table yet
+        return None
+    finally:
+        conn.close()
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def reflink_copy(src, dst):
+    """Copy a file sharing its data blocks with the original (copy-on-write, e.g. on btrfs or XFS).
+
+    Returns False, without copying anything, if the filesystem doesn't support that.
+    """
+    if IS_WINDOWS:
+        return False
+    if traced_call(["cp", "--reflink=always", src, dst], stderr=subprocess.DEVNULL) == 0:
+        return True
+    if os.path.exists(dst):
+        os.remove(dst)
+    return False
+
+
+def get_snapshot_dir(config, volume_path, service):
+    # by default, keep the snapshots next to (not in) the volume's data, so they're on the same filesystem
+    base_dir = config.get('Default', 'snapshot_dir', fallback=None) or os.path.join(os.path.dirname(volume_path), "fednode-snapshots")
+    return os.path.join(base_dir, service)
+
+
+def list_snapshots(snapshot_dir):
+    """Return the complete snapshots in snapshot_dir, oldest block first"""
+    snapshots = []
+    if not os.path.isdir(snapshot_dir):
+        return snapshots
+    for name in os.listdir(snapshot_dir):
+        try:
+            with open(os.path.join(snapshot_dir, name, SNAPSHOT_MANIFEST)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):  # not a snapshot, or an unfinished one
+            continue
+        snapshot['path'] = os.path.join(snapshot_dir, name)
+        snapshots.append(snapshot)
+    return sorted(snapshots, key=lambda snapshot: snapshot['block_index'])
+
+
+def find_snapshot(snapshots, block_index):
+    """Return the snapshot closest to, but not after, block_index"""
+    candidates = [snapshot for snapshot in snapshots if snapshot['block_index'] <= block_index]
+    return candidates[-1] if candidates else None
+
+
+def create_snapshot(db_path, snapshot_dir, stop_service, start_service, min_blocks=0):
+    """Snapshot a unoparty database, keyed by the last block parsed into it.
+
+    Where the filesystem supports reflinks the service is stopped for the (near instant) copy-on-write copy,
+    and the snapshot only takes up space as the live database diverges from it. Otherwise the copy is
+    made with SQLite's online backup, which doesn't need the service to be stopped but copies everything.
+    Returns the new snapshot, or None if none was needed.
+    """
+    import sqlite3
+    snapshots = list_snapshots(snapshot_dir)
+    block_index = db_block_index(db_path)
+    if block_index is None:
+        print("The database hasn't parsed any blocks yet")
+        return None
+    if snapshots and block_index - snapshots[-1]['block_index'] < max(min_blocks, 1):
+        print("The newest snapshot is at block {} and the database at block {}; not snapshotting".format(
+            snapshots[-1]['block_index'], block_index))
+        return None
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_dir = os.path.join(snapshot_dir, ".tmp.{}".format(os.getpid()))
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.mkdir(tmp_dir)
+    db_name = os.path.basename(db_path)
+    copy_path = os.path.join(tmp_dir, db_name)
+    start = time.time()
+    try:
+        probe_path = os.path.join(tmp_dir, ".probe")
+        with open(probe_path, 'w') as f:
+            f.write("probe")
+        method = 'reflink' if reflink_copy(probe_path, probe_path + ".copy") else 'backup'
+        for leftover in glob.glob(probe_path + "*"):
+            os.remove(leftover)
+
+        if method == 'reflink':
+            stop_service()
+            try:
+                for suffix in ('', '-wal'):
+                    if os.path.exists(db_path + suffix) and not reflink_copy(db_path + suffix, copy_path + suffix):
+                        raise OSError("reflink copy of {} failed".format(db_path + suffix))
+            finally:
+                start_service()
+            conn = db_connect(copy_path)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # fold the copied WAL into the snapshot itself
+            conn.close()
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(copy_path + suffix):
+                    os.remove(copy_path + suffix)
+        else:
+            conn = db_connect(db_path)
+            copy_conn = db_connect(copy_path)
+            try:
+                conn.backup(copy_conn)
+            finally:
+                copy_conn.close()
+                conn.close()
+
+        conn = db_connect(copy_path)
+        try:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            conn.execute("PRAGMA journal_mode = DELETE")  # a snapshot is a single, self-contained file
+            integrity = conn.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            conn.close()
+        if integrity != 'ok':
+            raise sqlite3.DatabaseError("snapshot failed its integrity check: {}".format(integrity))
+        snapshot = {
+            'block_index': db_block_index(copy_path),  # the service may have parsed more blocks before it was stopped
+            'created': int(time.time()),
+            'method': method,
+            'journal_mode': journal_mode,
+            'files': {db_name: {'size': os.path.getsize(copy_path), 'sha256': file_sha256(copy_path)}},
+        }
+        with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST), 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        snapshot['path'] = os.path.join(snapshot_dir, "{:010d}".format(snapshot['block_index']))
+        if os.path.exists(snapshot['path']):
+            shutil.rmtree(snapshot['path'])
+        os.rename(tmp_dir, snapshot['path'])
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    print("Snapshotted block {} ({}, {}) in {:.1f}s".format(
+        snapshot['block_index'], method, format_size(snapshot['files'][db_name]['size']), time.time() - start))
+    return snapshot
 
-REPO_BASE_HTTPS = "https://github.com/terhnt/{}.git"
-REPO_BASE_SSH = "git@github.com:terhnt/{}.git"
-REPOS_BASE = ['unoparty-lib', 'unoparty-cli', 'addrindexrs']
-REPOS_UNOBLOCK = REPOS_BASE + ['unoblock', ]
-REPOS_FULL = REPOS_UNOBLOCK + ['unowallet', 'armory-utxsvr', 'xup-proxy']
 
-HOST_PORTS_USED = {
-    'base': [65535, 65531, 8122, 18122, 4120, 14120],
-    'base_extbtc': [8122, 18122, 4120, 14120],
-    'unoblock': [65535, 65531, 8122, 18122, 4120, 14120, 4420, 14420, 27017],
-    'full': [65535, 65531, 8122, 18122, 4120, 14120, 4420, 14420, 80, 443, 27017]
-}
-VOLUMES_USED = {
-    'base': ['unobtanium-data', 'addrindexrs-data', 'unoparty-data'],
-    'base_extbtc': ['addrindexrs-data', 'unoparty-data'],
-    'unoblock': ['unobtanium-data', 'addrindexrs-data', 'unoparty-data', 'unoblock-data', 'mongodb-data'],
-    'full': ['unobtanium-data', 'addrindexrs-data', 'unoparty-data', 'unoblock-data', 'mongodb-data', 'armory-data', 'xup-proxy']
-}
-UPDATE_CHOICES = ['addrindexrs', 'addrindexrs-testnet',
-                  'unoparty', 'unoparty-testnet', 'unoblock',
-                  'unoblock-testnet', 'unowallet', 'armory-utxsvr',
-                  'armory-utxsvr-testnet', 'xup-proxy', 'xup-proxy-testnet']
-REPARSE_CHOICES = ['unoparty', 'unoparty-testnet', 'unoblock', 'unoblock-testnet']
-ROLLBACK_CHOICES = ['unoparty', 'unoparty-testnet']
-VACUUM_CHOICES = ['unoparty', 'unoparty-testnet']
-SHELL_CHOICES = UPDATE_CHOICES + ['mongodb', 'redis', 'unobtanium', 'unobtanium-testnet', 'addrindexrs', 'addrindexrs-testnet']
+def prune_snapshots(snapshots, keep_last=SNAPSHOT_KEEP_LAST, keep_every=SNAPSHOT_KEEP_EVERY, keep_sparse=SNAPSHOT_KEEP_SPARSE):
+    """Delete the snapshots the retention policy doesn't keep, returning the deleted ones.
 
-CONFIGCHECK_FILES_BASE_EXTERNAL_UNOBTANIUM = [
-    ['addrindexrs', 'addrindexrs.env.default', 'addrindexrs.env'],
-    ['addrindexrs', 'addrindexrs.testnet.env.default', 'addrindexrs.testnet.env'],
-    ['unoparty', 'client.conf.default', 'client.conf'],
-    ['unoparty', 'client.testnet.conf.default', 'client.testnet.conf'],
-    ['unoparty', 'server.conf.default', 'server.conf'],
-    ['unoparty', 'server.testnet.conf.default', 'server.testnet.conf'],
-];
-CONFIGCHECK_FILES_BASE = [
-    ['unobtanium', 'unobtanium.conf.default', 'unobtanium.conf'],
-    ['unobtanium', 'unobtanium.testnet.conf.default', 'unobtanium.testnet.conf'],
-    ['addrindexrs', 'addrindexrs.env.default', 'addrindexrs.env'],
-    ['addrindexrs', 'addrindexrs.testnet.env.default', 'addrindexrs.testnet.env'],
-    ['unoparty', 'client.conf.default', 'client.conf'],
-    ['unoparty', 'client.testnet.conf.default', 'client.testnet.conf'],
-    ['unoparty', 'server.conf.default', 'server.conf'],
-    ['unoparty', 'server.testnet.conf.default', 'server.testnet.conf'],
-];
-CONFIGCHECK_FILES_UNOBLOCK = CONFIGCHECK_FILES_BASE + [
-    ['unoblock', 'server.conf.default', 'server.conf'],
-    ['unoblock', 'server.testnet.conf.default', 'server.testnet.conf'],
-]
-CONFIGCHECK_FILES_FULL = CONFIGCHECK_FILES_UNOBLOCK;
-CONFIGCHECK_FILES = {
-    'base_extbtc': CONFIGCHECK_FILES_BASE_EXTERNAL_UNOBTANIUM,
-    'base': CONFIGCHECK_FILES_BASE,
-    'unoblock': CONFIGCHECK_FILES_UNOBLOCK,
-    'full': CONFIGCHECK_FILES_FULL,
-}
-# set in setup_env()
-IS_WINDOWS = None
-SESSION_USER = None
-SUDO_CMD = None
-# set in main()
-DOCKER_CONFIG_PATH = None
+    Kept are the keep_last newest snapshots, plus the oldest snapshot in each of the keep_sparse newest
+    keep_every-block intervals, so there's always something reasonably close to roll back to (a keep_every of 0
+    keeps only the newest snapshots).
+    """
+    keep = set(snapshot['path'] for snapshot in snapshots[-keep_last:]) if keep_last > 0 else set()
+    sparse = collections.OrderedDict()
+    for snapshot in snapshots if keep_every > 0 else []:
+        sparse.setdefault(snapshot['block_index'] // keep_every, snapshot['path'])
+    keep.update(list(sparse.values())[-keep_sparse:] if keep_sparse > 0 else [])
+    pruned = [snapshot for snapshot in snapshots if snapshot['path'] not in keep]
+    for snapshot in pruned:
+        shutil.rmtree(snapshot['path'])
+    return pruned
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(prog='fednode', description='fednode utility v{}'.format(VERSION))
-    parser.add_argument("-V", '--version', action='version', version='%(prog)s {}'.format(VERSION))
-    parser.add_argument("-d", "--debug", action='store_true', default=False, help="increase output verbosity")
-    parser.add_argument("--no-pull", action='store_true', default=False, help="use only local docker images (for debugging)")
+def verify_snapshot(snapshot):
+    """Check a snapshot's files against its manifest and SQLite's own integrity check; returns a list of problems"""
+    problems = []
+    for name, info in sorted(snapshot['files'].items()):
+        path = os.path.join(snapshot['path'], name)
+        if not os.path.exists(path):
+            problems.append("{} is missing".format(name))
+        elif os.path.getsize(path) != info['size']:
+            problems.append("{} has the wrong size".format(name))
+        elif file_sha256(path) != info['sha256']:
+            problems.append("{} has the wrong checksum".format(name))
+        else:
+            conn = db_connect(path)
+            try:
+                integrity = conn.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                conn.close()
+            if integrity != 'ok':
+                problems.append("{} failed its integrity check: {}".format(name, integrity))
+    return problems
 
-    subparsers = parser.add_subparsers(help='help on modes', dest='command')
-    subparsers.required = True
 
-    parser_install = subparsers.add_parser('install', help="install fednode services")
-    parser_install.add_argument("config", choices=['base', 'base_extbtc', 'unoblock', 'full'], help="The name of the service configuration to utilize")
-    parser_install.add_argument("branch", choices=['master', 'develop'], help="The name of the git branch to utilize for the build (note that 'master' pulls the docker 'latest' tags)")
-    parser_install.add_argument("--use-ssh-uris", action="store_true", help="Use SSH URIs for source checkouts from Github, instead of HTTPS URIs")
-    parser_install.add_argument("--mongodb-interface", default="127.0.0.1",
-        help="Bind mongo to this host interface. Localhost by default, enter 0.0.0.0 for all host interfaces.")
+def restore_snapshot(snapshot, volume_path):
+    """Copy a snapshot's database back into the volume; the service must be stopped"""
+    for name in snapshot['files']:
+        src_path = os.path.join(snapshot['path'], name)
+        db_path = os.path.join(volume_path, name)
+        tmp_path = db_path + ".restore"
+        # never hardlink: the restored database is written to, and the snapshot must stay as it is
+        if not reflink_copy(src_path, tmp_path):
+            shutil.copyfile(src_path, tmp_path)
+        if os.path.exists(db_path):
+            stat = os.stat(db_path)
+            if not IS_WINDOWS:
+                os.chown(tmp_path, stat.st_uid, stat.st_gid)
+            os.chmod(tmp_path, stat.st_mode)
+        conn = db_connect(tmp_path)
+        conn.execute("PRAGMA journal_mode = {}".format(snapshot.get('journal_mode', 'delete')))
+        conn.close()
+        os.replace(tmp_path, db_path)
+        for stale in (db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(stale):
+                os.remove(stale)
 
-    parser_uninstall = subparsers.add_parser('uninstall', help="uninstall fednode services")
 
-    parser_start = subparsers.add_parser('start', help="start fednode services")
-    parser_start.add_argument("services", nargs='*', default='', help="The service or services to start (or blank for all services)")
+def rollback_from_snapshot(config, service, block_index):
+    """Restore the newest snapshot at or before block_index, if there is one; returns the restored snapshot"""
+    volume_path = get_docker_volume_path("{}_unoparty-data".format(PROJECT_NAME))
+    if volume_path is None:
+        return None
+    if not os.access(volume_path, os.R_OK | os.W_OK | os.X_OK):
+        reexec_with_sudo()
+    snapshot = find_snapshot(list_snapshots(get_snapshot_dir(config, volume_path, service)), block_index)
+    if snapshot is None:
+        print("No snapshot at or before block {}".format(block_index))
+        return None
+    print("Verifying the block {} snapshot ...".format(snapshot['block_index']))
+    problems = verify_snapshot(snapshot)
+    if problems:
+        print("Not using the block {} snapshot: {}".format(snapshot['block_index'], "; ".join(problems)))
+        return None
+    run_compose_cmd("stop {}".format(service))
+    restore_snapshot(snapshot, volume_path)
+    print("Restored the block {} snapshot. Blocks after it will be parsed again once {} is started".format(snapshot['block_index'], service))
+    return snapshot
 
-    parser_stop = subparsers.add_parser('stop', help="stop fednode services")
-    parser_stop.add_argument("services", nargs='*', default='', help="The service or services to stop (or blank for all services)")
 
-    parser_restart = subparsers.add_parser('restart', help="restart fednode services")
-    parser_restart.add_argument("services", nargs='*', default='', help="The service or services to restart (or blank for all services)")
+def print_snapshots(snapshots):
+    rows = [["Block", "Created", "Method", "Size", "Path"]]
+    for snapshot in snapshots:
+        rows.append([snapshot['block_index'], datetime.fromtimestamp(snapshot['created'], timezone.utc).astimezone().strftime("%Y-%m-%d %H:%M"),
+                     snapshot['method'], format_size(sum(info['size'] for info in snapshot['files'].values())), snapshot['path']])
+    print_table(rows)
 
-    parser_reparse = subparsers.add_parser('reparse', help="reparse a unoparty-server or unoblock service")
-    parser_reparse.add_argument("service", choices=REPARSE_CHOICES, help="The name of the service for which to kick off a reparse")
 
-    parser_rollback = subparsers.add_parser('rollback', help="rollback a unoparty-server")
-    parser_rollback.add_argument("block_index", help="the index of the last known good block")
-    parser_rollback.add_argument("service", choices=ROLLBACK_CHOICES, help="The name of the service to rollback")
+def get_running_services():
+    services = get_compose_services()
+    infos = inspect_containers([container_name(service) for service in services])
+    return [service for service in services
+            if infos[container_name(service)] is not None and infos[container_name(service)]['State']['Running']]
 
-    parser_vacuum = subparsers.add_parser('vacuum', help="vacuum the unoparty-server database for better runtime performance")
-    parser_vacuum.add_argument("service", choices=VACUUM_CHOICES, help="The name of the service whose database to vacuum")
 
-    parser_ps = subparsers.add_parser('ps', help="list installed services")
+class HashingFile:
+    """Wraps a file object, computing the sha256 of everything read from or written to it"""
 
-    parser_tail = subparsers.add_parser('tail', help="tail fednode logs")
-    parser_tail.add_argument("services", nargs='*', default='', help="The name of the service or services whose logs to tail (or blank for all services)")
-    parser_tail.add_argument("-n", "--num-lines", type=int, default=50, help="Number of lines to tail")
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
 
-    parser_logs = subparsers.add_parser('logs', help="tail fednode logs")
-    parser_logs.add_argument("services", nargs='*', default='', help="The name of the service or services whose logs to view (or blank for all services)")
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
 
-    parser_exec = subparsers.add_parser('exec', help="execute a command on a specific container")
-    parser_exec.add_argument("service", choices=SHELL_CHOICES, help="The name of the service to execute the command on")
-    parser_exec.add_argument("cmd", nargs=argparse.REMAINDER, help="The shell command to execute")
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
 
-    parser_shell = subparsers.add_parser('shell', help="get a shell on a specific service container")
-    parser_shell.add_argument("service", choices=SHELL_CHOICES, help="The name of the service to shell into")
 
-    parser_update = subparsers.add_parser('update', help="upgrade fednode services (i.e. update source code and restart the container, but don't update the container itself')")
-    parser_update.add_argument("-n", "--no-restart", action="store_true", help="Don't restart the container after updating the code'")
-    parser_update.add_argument("services", nargs='*', default='', help="The name of the service or services to update (or blank to for all applicable services)")
+def plan_archive_parts(root, part_size):
+    """Split the files under root into parts of about part_size bytes each (relative paths, directories first)"""
+    dirs, parts, current, current_size = [], [], [], 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, root)
+        if rel_dir != '.':
+            dirs.append(rel_dir)
+        for filename in sorted(filenames):
+            size = os.lstat(os.path.join(dirpath, filename)).st_size
+            if current and current_size + size > part_size:
+                parts.append(current)
+                current, current_size = [], 0
+            current.append(os.path.normpath(os.path.join(rel_dir, filename)))
+            current_size += size
+    if current or not parts:
+        parts.append(current)
+    parts[0] = dirs + parts[0]  # so they're restored with their own ownership and permissions
+    return parts
 
-    parser_rebuild = subparsers.add_parser('rebuild', help="rebuild fednode services (i.e. remove and refetch/install docker containers)")
-    parser_rebuild.add_argument("services", nargs='*', default='', help="The name of the service or services to rebuild (or blank for all services)")
-    parser_rebuild.add_argument("--mongodb-interface", default="127.0.0.1")
 
-    parser_docker_clean = subparsers.add_parser('docker_clean', help="remove ALL docker containers and cached images (use with caution!)")
+def export_part(root, rel_paths, path):
+    """Write one compressed tar archive part (zstd if available, else gzip); returns its sha256 and size"""
+    import tarfile
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        out = HashingFile(f)
+        if path.endswith('.zst'):
+            with traced_command("zstd -q -T1 -c > {}".format(path)) as trace:
+                proc = subprocess.Popen(['zstd', '-q', '-T1', '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                drainer = threading.Thread(target=lambda: shutil.copyfileobj(proc.stdout, out, 1024 * 1024))
+                drainer.start()
+                try:
+                    with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                        for rel_path in rel_paths:
+                            tar.add(os.path.join(root, rel_path), rel_path, recursive=False)
+                finally:
+                    proc.stdin.close()
+                    drainer.join()
+                    trace.returncode, trace.output_bytes = proc.wait(), out.size
+            if trace.returncode != 0:
+                raise OSError("zstd failed compressing {}".format(path))
+        else:
+            with tarfile.open(fileobj=out, mode='w|gz') as tar:
+                for rel_path in rel_paths:
+                    tar.add(os.path.join(root, rel_path), rel_path, recursive=False)
+    os.replace(tmp_path, path)
+    return {'sha256': out.sha256.hexdigest(), 'size': out.size}
 
-    parser_configcheck = subparsers.add_parser('configcheck', help="check configuration")
 
-    return parser.parse_args()
+def extract_part(path, root, expected_sha256):
+    """Stream-extract one archive part into root, checksumming it as it's read; returns whether the checksum matched.
 
+    The part is read once: the same reads feed the checksum and the decompressor. It is extracted into a
+    staging directory in root, whose contents are only moved into place once the checksum matched, so a
+    corrupt part leaves nothing behind.
+    """
+    import tarfile
+    staging = os.path.join(root, ARCHIVE_STAGING_PREFIX + os.path.basename(path))
+    if os.path.lexists(staging):
+        shutil.rmtree(staging)
+    os.mkdir(staging, 0o700)
+    extract_args = {'numeric_owner': True}
+    if hasattr(tarfile, 'tar_filter'):  # keeps ownership and permissions, but still refuses paths escaping root
+        extract_args['filter'] = 'tar'
+    members = []
+    try:
+        with open(path, 'rb') as f:
+            archive = HashingFile(f)
+            proc = None
+            if path.endswith('.zst'):
+                trace = traced_command(['zstd', '-d', '-q', '-c'])  # (timed from here until zstd exits)
+                proc = subprocess.Popen(['zstd', '-d', '-q', '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                feeder = threading.Thread(target=feed_process, args=(archive, proc))
+                feeder.start()
+                fileobj, mode = proc.stdout, 'r|'
+            else:
+                fileobj, mode = archive, 'r|gz'
+            try:
+                with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+                    for member in tar:
+                        name = os.path.normpath(member.name)
+                        if os.path.isabs(name) or name.split(os.sep)[0] == '..':
+                            raise tarfile.TarError("{} contains an unsafe path: {}".format(path, member.name))
+                        tar.extract(member, staging, **extract_args)
+                        members.append(member)
+                while fileobj.read(1024 * 1024):  # (the end-of-archive padding tarfile stops short of, so it's all checksummed)
+                    pass
+            finally:
+                if proc is not None:
+                    proc.stdout.close()
+                    feeder.join()
+                    with trace:
+                        trace.returncode = proc.wait()
+        if proc is not None and trace.returncode != 0:
+            raise OSError("zstd failed decompressing {}".format(path))
+        if archive.sha256.hexdigest() != expected_sha256:
+            return False
+        move_staged_members(staging, root, members)
+        return True
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
-def write_config(config):
-    cfg_file = open(FEDNODE_CONFIG_PATH, 'w')
-    config.write(cfg_file)
-    cfg_file.close()
 
+def feed_process(f, proc):
+    """Copy a file object into a process' stdin, then close it (from a thread, while the output is read)"""
+    try:
+        shutil.copyfileobj(f, proc.stdin, 1024 * 1024)
+    except OSError:  # the process exited early (its exit status says why)
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
 
-def run_compose_cmd(cmd):
-    assert DOCKER_CONFIG_PATH
-    assert os.environ['FEDNODE_RELEASE_TAG']
-    return os.system("{} docker-compose -f {} -p {} {}".format(SUDO_CMD, DOCKER_CONFIG_PATH, PROJECT_NAME, cmd))
 
+def move_staged_members(staging, root, members):
+    """Move the archive members extracted into staging to the same paths under root.
 
-def is_port_open(port):
-    # TCP ports only
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    return sock.connect_ex(('127.0.0.1', port)) == 0  # returns True if the port is open
+    Directories are merged into existing ones (taking their ownership and permissions), anything else replaces
+    what is there.
+    """
+    for member in members:
+        name = os.path.normpath(member.name)
+        staged, target = os.path.join(staging, name), os.path.join(root, name)
+        if member.isdir():
+            os.makedirs(target, exist_ok=True)
+            stat = os.lstat(staged)
+            if not IS_WINDOWS and os.geteuid() == 0:
+                os.chown(target, stat.st_uid, stat.st_gid)
+            os.chmod(target, stat.st_mode & 0o7777)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            os.replace(staged, target)
 
 
-def setup_env():
-    global IS_WINDOWS
-    global SESSION_USER
-    global SUDO_CMD
-    if os.name != 'nt':
-        IS_WINDOWS = False
-        SESSION_USER = subprocess.check_output("logname", shell=True).decode("utf-8").strip()
-        assert SESSION_USER
-        SUDO_CMD = "sudo -E"
-        IS_SUDO_ACTIVE = subprocess.check_output('sudo -n uptime 2>&1|grep "load"|wc -l', shell=True).decode("utf-8").strip() == "1"
+def export_volume(volume, mountpoint, output_dir, part_size=ARCHIVE_PART_SIZE, jobs=ARCHIVE_JOBS_DEFAULT):
+    """Archive a volume into compressed parts, written concurrently, plus a manifest listing their checksums"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    extension = 'tar.zst' if shutil.which('zstd') else 'tar.gz'
+    parts = plan_archive_parts(mountpoint, part_size)
+    names = ["{}.{:04d}.{}".format(volume, i, extension) for i in range(len(parts))]
+    results = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(export_part, mountpoint, rel_paths, os.path.join(output_dir, name)): name
+                   for name, rel_paths in zip(names, parts)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            print("[{}/{}] {} ({})".format(len(results), len(names), futures[future], format_size(results[futures[future]]['size'])))
+    manifest = {
+        'volume': volume,
+        'created': int(time.time()),
+        'parts': [dict(results[name], name=name) for name in names],
+    }
+    manifest_path = os.path.join(output_dir, "{}.manifest.json".format(volume))
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    if not IS_WINDOWS and os.geteuid() == 0 and 'SUDO_UID' in os.environ:  # leave the archives to the session user
+        for path in [manifest_path] + [os.path.join(output_dir, name) for name in names]:
+            os.chown(path, int(os.environ['SUDO_UID']), int(os.environ['SUDO_GID']))
+    print("Exported {} in {:.1f}s ({} in {} parts)".format(volume, time.time() - start,
+          format_size(sum(part['size'] for part in manifest['parts'])), len(names)))
+
+
+def bootstrap_volume(manifest, archive_dir, mountpoint, jobs=ARCHIVE_JOBS_DEFAULT, overwrite=False):
+    """Restore a volume from the archive parts listed in manifest, extracting them concurrently.
+
+    Progress is recorded part by part in fednode's cache, so an interrupted restore resumes where it left off.
+    Returns False on failure.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    volume = manifest['volume']
+    state_name = os.path.join("bootstrap", "{}.json".format(volume))
+    manifest_id = hashlib.sha256(json.dumps(manifest['parts'], sort_keys=True).encode('utf-8')).hexdigest()
+    for name in os.listdir(mountpoint):  # parts whose extraction was cut short (e.g. by a crash)
+        if name.startswith(ARCHIVE_STAGING_PREFIX):
+            shutil.rmtree(os.path.join(mountpoint, name))
+    state = read_cache(state_name)
+    if state is not None and state['manifest'] == manifest_id and state.get('mountpoint') == mountpoint:
+        print("Resuming the restore of {} ({} of {} parts done)".format(volume, len(state['done']), len(manifest['parts'])))
     else:
-        IS_WINDOWS = True
-        SESSION_USER = None
-        SUDO_CMD = ''
-        IS_SUDO_ACTIVE = True
+        if os.listdir(mountpoint):
+            if not overwrite:
+                print("Volume {} isn't empty; not restoring it (use --overwrite to replace its contents)".format(volume))
+                return False
+            for name in os.listdir(mountpoint):
+                path = os.path.join(mountpoint, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        state = {'manifest': manifest_id, 'mountpoint': mountpoint, 'done': []}
 
-    if os.name != 'nt' and os.geteuid() == 0:
-        print("Please run this script as a non-root user.")
-        sys.exit(1)
+    todo = [part for part in manifest['parts'] if part['name'] not in state['done']]
+    for part in todo:
+        path = os.path.join(archive_dir, part['name'])
+        if not os.path.exists(path) or os.path.getsize(path) != part['size']:
+            print("Archive part {} is missing or incomplete".format(path))
+            return False
 
-    if not IS_SUDO_ACTIVE:
-        print("This script requires root access (via sudo) to run. Please enter your sudo password below.")
-        os.system("bash -c 'sudo whoami > /dev/null'")
+    write_cache(state_name, state)
+    failed = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(extract_part, os.path.join(archive_dir, part['name']), mountpoint, part['sha256']): part['name']
+                   for part in todo}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:  # e.g. a corrupt or truncated part
+                print("{}: {}".format(name, e))
+                ok = False
+            if ok:
+                state['done'].append(name)
+                write_cache(state_name, state)
+            else:
+                failed.append(name)
+            print("[{}/{}] {} {}".format(len(state['done']), len(manifest['parts']), name, "OK" if ok else "FAILED"))
+    if failed:
+        print("Restoring {} failed for {}. Replace those archive parts and run bootstrap again to resume".format(volume, ", ".join(sorted(failed))))
+        return False
+    os.remove(os.path.join(FEDNODE_CACHE_DIR, state_name))
+    print("Restored {} in {:.1f}s".format(volume, time.time() - start))
+    return True
 
 
-def is_container_running(service, abort_on_not_exist=True):
-    try:
-        container_running = subprocess.check_output('{} docker inspect --format="{{{{ .State.Running }}}}" federatednode_{}_1'.format(SUDO_CMD, service), shell=True).decode("utf-8").strip()
-        container_running = container_running == 'true'
-    except subprocess.CalledProcessError:
-        container_running = None
-        if abort_on_not_exist:
-            print("Container {} doesn't seem to exist'".format(service))
-            sys.exit(1)
-    return container_running
+def scan_dir(path, cached, full=False):
+    """Total up the disk usage of the files directly in one directory.
 
+    A directory's mtime only changes when entries are added, removed or renamed, not when a file in it
+    grows. So if the mtime matches the cached scan, the directory isn't listed again, but each of the files
+    it had is still stat'ed (databases, logs and block files grow in place, even after being idle for days).
+    """
+    stat = os.lstat(path)
+    if not full and cached is not None and cached['mtime'] == stat.st_mtime_ns and 'sizes' in cached:
+        sizes = {}
+        for name in cached['sizes']:
+            try:
+                sizes[name] = os.lstat(os.path.join(path, name)).st_blocks * 512
+            except OSError:  # removed in the meantime
+                pass
+        return dict(cached, sizes=sizes), True
+    result = {'mtime': stat.st_mtime_ns, 'sizes': {}, 'dirs': []}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    result['dirs'].append(entry.name)
+                    continue
+                result['sizes'][entry.name] = entry.stat(follow_symlinks=False).st_blocks * 512
+            except OSError:
+                continue
+    return result, False
 
-def get_docker_volume_path(volume_name):
-    try:
-        json_output = subprocess.check_output('{} docker volume inspect {}'.format(SUDO_CMD, volume_name), shell=True).decode("utf-8").strip()
-    except subprocess.CalledProcessError:
+
+def scan_volume(mountpoint, jobs=DU_JOBS_DEFAULT, full=False):
+    """Walk a volume with concurrent scandir workers, reusing the cached results of unchanged directories"""
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    cache_name = os.path.join("du", hashlib.sha1(mountpoint.encode("utf-8")).hexdigest() + ".json")
+    cache = read_cache(cache_name) or {}
+    new_cache = {}
+    totals = {'size': 0, 'files': 0, 'dirs': 0, 'cached_dirs': 0}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {executor.submit(scan_dir, mountpoint, cache.get('.'), full): '.'}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path = running.pop(future)
+                try:
+                    result, from_cache = future.result()
+                except OSError:  # removed while scanning
+                    continue
+                new_cache[rel_path] = result
+                totals['size'] += sum(result['sizes'].values())
+                totals['files'] += len(result['sizes'])
+                totals['dirs'] += 1
+                totals['cached_dirs'] += from_cache
+                for name in result['dirs']:
+                    sub_path = os.path.normpath(os.path.join(rel_path, name))
+                    running[executor.submit(scan_dir, os.path.join(mountpoint, sub_path), cache.get(sub_path), full)] = sub_path
+    write_cache(cache_name, new_cache)
+    totals['elapsed'] = time.time() - start
+    return totals
+
+
+def get_mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def growth_rate(samples):
+    """Least-squares slope (per day) of (timestamp, value) samples, or None if they span less than an hour"""
+    if len(samples) < 2 or samples[-1][0] - samples[0][0] < 3600:
         return None
-    volume_info = json.loads(json_output)
-    return volume_info[0]['Mountpoint']
+    mean_t = sum(t for t, _ in samples) / len(samples)
+    mean_v = sum(v for _, v in samples) / len(samples)
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    return sum((t - mean_t) * (v - mean_v) for t, v in samples) / variance * 86400
+
+
+def disk_usage_report(mountpoints, jobs=DU_JOBS_DEFAULT, full=False, record=True):
+    """Scan the volumes, record the result in the usage history and forecast when their filesystems fill up"""
+    now = time.time()
+    volumes = collections.OrderedDict()
+    for volume, mountpoint in mountpoints.items():
+        volumes[volume] = scan_volume(mountpoint, jobs, full)
+    filesystems = collections.OrderedDict()
+    for volume, mountpoint in mountpoints.items():
+        mount_point = get_mount_point(mountpoint)
+        if mount_point not in filesystems:
+            usage = shutil.disk_usage(mount_point)
+            filesystems[mount_point] = {'total': usage.total, 'used': usage.used, 'free': usage.free, 'volumes': []}
+        filesystems[mount_point]['volumes'].append(volume)
+
+    history = read_cache(os.path.join("du", "history.json")) or []
+    if record:
+        history.append({'time': int(now), 'volumes': {volume: totals['size'] for volume, totals in volumes.items()},
+                        'filesystems': {mount_point: fs['used'] for mount_point, fs in filesystems.items()}})
+        history = [sample for sample in history if sample['time'] >= now - DU_HISTORY_DAYS * 86400]
+        write_cache(os.path.join("du", "history.json"), history)
+    window = [sample for sample in history if sample['time'] >= now - DU_FORECAST_DAYS * 86400]
+    for volume, totals in volumes.items():
+        totals['growth_per_day'] = growth_rate([(sample['time'], sample['volumes'][volume]) for sample in window if volume in sample['volumes']])
+    for mount_point, fs in filesystems.items():
+        fs['growth_per_day'] = growth_rate([(sample['time'], sample['filesystems'][mount_point]) for sample in window
+                                            if mount_point in sample['filesystems']])
+        fs['days_until_full'] = fs['free'] / fs['growth_per_day'] if fs['growth_per_day'] and fs['growth_per_day'] > 0 else None
+    return {'time': int(now), 'volumes': volumes, 'filesystems': filesystems}
+
+
+def print_disk_usage(report):
+    rows = [["Volume", "Size", "Files", "Growth/day", "Scanned"]]
+    for volume, totals in report['volumes'].items():
+        rows.append([volume, format_size(totals['size']), totals['files'],
+                     "-" if totals['growth_per_day'] is None else format_size(totals['growth_per_day']),
+                     "{:.1f}s ({} of {} dirs cached)".format(totals['elapsed'], totals['cached_dirs'], totals['dirs'])])
+    print_table(rows)
+    print()
+    rows = [["Filesystem", "Used", "Free", "Growth/day", "Full in", "Volumes"]]
+    for mount_point, fs in report['filesystems'].items():
+        rows.append([mount_point, "{} ({:.0%})".format(format_size(fs['used']), fs['used'] / fs['total'] if fs['total'] else 0),
+                     format_size(fs['free']), "-" if fs['growth_per_day'] is None else format_size(fs['growth_per_day']),
+                     "-" if fs['days_until_full'] is None else "{:.1f} days".format(fs['days_until_full']), ", ".join(fs['volumes'])])
+    print_table(rows)
+    if any(fs['growth_per_day'] is None for fs in report['filesystems'].values()):
+        print("(growth rates need at least two runs, an hour or more apart; e.g. run 'fednode du' hourly from cron)")
+
 
 def file_mtime(path):
     t = datetime.fromtimestamp(os.stat(path).st_mtime, timezone.utc)
     return t.astimezone().isoformat()
 
-def config_check(build_config):
-    for dirname, fromfile, tofile in CONFIGCHECK_FILES[build_config]:
-        # dirname, fromfile, tofile = config_spec
+def get_configcheck_rules(build_config):
+    """Return the cross-service consistency rules that apply to a build config.
 
-        try:
-            fromfilepath = os.path.join(SCRIPTDIR, 'config', dirname, fromfile)
-            fromdate = file_mtime(fromfilepath)
-        except FileNotFoundError as e:
-            print("Config file not found at {}".format(fromfilepath))
-            continue
+    Each rule is [severity, [dirname, file, key], expected], where expected is either another
+    [dirname, file, key] or a literal value. Rules whose key is not set are skipped (the service
+    then uses its built-in default), as are rules for files not used by the build config.
+    """
+    rules = []
+    for conf, service_suffix, indexd_port in (('', '', '8122'), ('.testnet', '-testnet', '18122')):
+        unobtanium = ['unobtanium', 'unobtanium{}.conf'.format(conf)]
+        server = ['unoparty', 'server{}.conf'.format(conf)]
+        client = ['unoparty', 'client{}.conf'.format(conf)]
+        unoblock = ['unoblock', 'server{}.conf'.format(conf)]
+        rules += [
+            ['error', server + ['backend-user'], unobtanium + ['rpcuser']],
+            ['error', server + ['backend-password'], unobtanium + ['rpcpassword']],
+            ['error', server + ['backend-port'], unobtanium + ['rpcport']],
+            ['error', client + ['wallet-user'], unobtanium + ['rpcuser']],
+            ['error', client + ['wallet-password'], unobtanium + ['rpcpassword']],
+            ['error', client + ['unoparty-rpc-password'], server + ['rpc-password']],
+            ['error', unoblock + ['backend-user'], unobtanium + ['rpcuser']],
+            ['error', unoblock + ['backend-password'], unobtanium + ['rpcpassword']],
+            ['error', unoblock + ['unoparty-user'], server + ['rpc-user']],
+            ['error', unoblock + ['unoparty-password'], server + ['rpc-password']],
+            ['warning', server + ['indexd-connect'], 'addrindexrs{}'.format(service_suffix)],
+            ['warning', server + ['indexd-port'], indexd_port],
+            ['warning', unoblock + ['unoparty-connect'], 'unoparty{}'.format(service_suffix)],
+        ]
+        if build_config != 'base_extbtc':  # otherwise, pointing at an external unobtaniumd is the whole point
+            rules += [
+                ['warning', server + ['backend-connect'], 'unobtanium{}'.format(service_suffix)],
+                ['warning', client + ['wallet-connect'], 'unobtanium{}'.format(service_suffix)],
+                ['warning', unoblock + ['backend-connect'], 'unobtanium{}'.format(service_suffix)],
+            ]
+    return rules
 
-        try:
-            tofilepath = os.path.join(SCRIPTDIR, 'config', dirname, tofile)
-            todate = file_mtime(tofilepath)
-        except FileNotFoundError as e:
-            print("Config file not found at {}".format(tofilepath))
-            continue
+
+def load_config_file(path, cache):
+    """Return the cache entry (content hash and parsed values) for a config file, re-reading it only if it changed"""
+    stat = os.stat(path)
+    stat_key = [stat.st_size, stat.st_mtime_ns]
+    entry = cache['files'].get(path)
+    if entry is None or entry['stat'] != stat_key:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if entry is None or entry['hash'] != digest:
+            sections = ['Default', 'test' if 'testnet' in os.path.basename(path) else 'main']
+            entry = {'hash': digest, 'values': parse_config_values(content.decode("utf-8"), sections)}
+        entry['stat'] = stat_key
+        cache['files'][path] = entry
+    return entry
 
 
+def config_diff(dirname, fromfile, tofile, cache, used_keys):
+    """Return the unified diff between a default and an active config file (cached by content hash)"""
+    import difflib
+    fromfilepath = os.path.join(SCRIPTDIR, 'config', dirname, fromfile)
+    tofilepath = os.path.join(SCRIPTDIR, 'config', dirname, tofile)
+    fromdate, todate = file_mtime(fromfilepath), file_mtime(tofilepath)
+    key = ":".join([load_config_file(fromfilepath, cache)['hash'], load_config_file(tofilepath, cache)['hash'], fromdate, todate])
+    used_keys.update([fromfilepath, tofilepath, key])
+    if key not in cache['diffs']:
         linejunk_filter = lambda x: len(x.strip()) > 0 and x.strip()[0:1] != '#'
         with open(fromfilepath) as ff:
             fromlines = list(filter(linejunk_filter, ff.readlines()))
@@ -251,36 +3689,301 @@ def config_check(build_config):
             tolines = list(filter(linejunk_filter, tf.readlines()))
 
         diff = difflib.unified_diff(fromlines, tolines, fromfile, tofile, fromdate, todate, n=3)
-        diff_string = "".join(diff)
-        if len(diff_string):
-            print("Found these differences in the file {}:\n".format(tofilepath))
-            print("{}".format(diff_string))
+        cache['diffs'][key] = "".join(diff)
+    return cache['diffs'][key]
+
+
+def config_check(build_config):
+    """Diff the active configs against their defaults and check them for cross-service consistency.
+
+    Parsed files and diffs are cached (by content hash) in .fednode.cache, so unchanged files cost a stat() each.
+    """
+    start = time.time()
+    cache_name = "configcheck.{}.json".format(build_config)
+    cache = read_cache(cache_name) or {'files': {}, 'diffs': {}}
+    result = {'config': build_config, 'files': [], 'checks': []}
+    active_files = {}
+    used_keys = set()
+    for dirname, fromfile, tofile in CONFIGCHECK_FILES[build_config]:
+        fromfilepath = os.path.join(SCRIPTDIR, 'config', dirname, fromfile)
+        tofilepath = os.path.join(SCRIPTDIR, 'config', dirname, tofile)
+        file_result = {'file': os.path.join(dirname, tofile), 'path': tofilepath, 'status': 'ok', 'diff': None}
+        for path in (fromfilepath, tofilepath):
+            if not os.path.exists(path):
+                file_result.update({'status': 'missing', 'path': path})
+                break
+        else:
+            active_files[(dirname, tofile)] = load_config_file(tofilepath, cache)['values']
+            file_result['diff'] = config_diff(dirname, fromfile, tofile, cache, used_keys) or None
+            if file_result['diff']:
+                file_result['status'] = 'changed'
+        result['files'].append(file_result)
+
+    for severity, (dirname, filename, key), expected in get_configcheck_rules(build_config):
+        values = active_files.get((dirname, filename))
+        if values is None or values.get(key) is None:
+            continue
+        if isinstance(expected, list):
+            expected_values = active_files.get((expected[0], expected[1]))
+            if expected_values is None:
+                continue
+            expected_value = expected_values.get(expected[2])
+            expected_desc = "{} in {}".format(expected[2], os.path.join(expected[0], expected[1]))
+        else:
+            expected_value = expected
+            expected_desc = "the '{}' service".format(expected)
+        ok = values[key] == expected_value
+        result['checks'].append({
+            'status': 'ok' if ok else severity,
+            'file': os.path.join(dirname, filename), 'key': key, 'value': values[key], 'expected': expected_value,
+            'message': "{} in {} {} {}".format(key, os.path.join(dirname, filename), "matches" if ok else "does not match", expected_desc),
+        })
+
+    # drop entries for files and diffs that are no longer current, so the cache doesn't grow forever
+    for section in ('files', 'diffs'):
+        cache[section] = {key: value for key, value in cache[section].items() if key in used_keys}
+    write_cache(cache_name, cache)
+    result['elapsed_ms'] = round((time.time() - start) * 1000, 2)
+    return result
+
+
+def print_config_check(result):
+    for file_result in result['files']:
+        if file_result['status'] == 'missing':
+            print("Config file not found at {}".format(file_result['path']))
+        elif file_result['status'] == 'changed':
+            print("Found these differences in the file {}:\n".format(file_result['path']))
+            print("{}".format(file_result['diff']))
         else:
-            print("{}: OK".format(os.path.join(dirname, tofile)))
+            print("{}: OK".format(file_result['file']))
+
+    failed = [check for check in result['checks'] if check['status'] != 'ok']
+    print("\nCross-service checks: {} passed, {} failed".format(len(result['checks']) - len(failed), len(failed)))
+    for check in failed:
+        print("{}: {} ('{}' vs. '{}')".format(check['status'].upper(), check['message'], check['value'], check['expected']))
+
+
+class FleetTransport(abc.ABC):
+    """A way of running fednode on a node of the fleet; subclasses build the command line"""
+    cwd = None
+
+    def __init__(self, name, options):
+        self.name = name
+
+    @abc.abstractmethod
+    def command(self, args):
+        """Return the command line that runs fednode with args on the node"""
+
+    def run(self, args, timeout=None):
+        """Run fednode with args; returns its exit code, stdout and stderr (raises subprocess.TimeoutExpired)"""
+        cmd = self.command(args)
+        with traced_command(cmd) as trace:
+            proc = subprocess.run(cmd, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+            trace.returncode, trace.output_bytes = proc.returncode, len(proc.stdout)
+        return proc.returncode, proc.stdout.decode("utf-8", "replace"), proc.stderr.decode("utf-8", "replace")
+
+
+class LocalTransport(FleetTransport):
+    """Runs fednode from a checkout on this machine (e.g. a second node on the same host, or for testing fleet mode)"""
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.cwd = os.path.expanduser(options.get('path', SCRIPTDIR))
+
+    def command(self, args):
+        return [sys.executable, os.path.join(self.cwd, "fednode.py")] + args
+
+
+class SSHTransport(FleetTransport):
+    """Runs fednode on a node over ssh, multiplexing all commands to a node over one persistent connection"""
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.host = options.get('host', name)
+        self.port = options.get('port')
+        self.path = options.get('path', "~/federatednode")  # (expanded by the remote shell)
+        self.python = options.get('python', "python3")
+        # (in /tmp, as the socket path has to be short)
+        control_dir = os.path.join("/tmp", "fednode-ssh-{}".format(os.getuid()))
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+        self.control_path = os.path.join(control_dir, "%C")
+
+    def command(self, args):
+        import shlex
+        cmd = ["ssh", "-o", "BatchMode=yes", "-o", "ControlMaster=auto", "-o", "ControlPath={}".format(self.control_path),
+               "-o", "ControlPersist={}".format(FLEET_SSH_PERSIST)]
+        if self.port:
+            cmd += ["-p", str(self.port)]
+        return cmd + [self.host, "cd {} && {} fednode.py {}".format(self.path, self.python, ' '.join(shlex.quote(arg) for arg in args))]
+
+
+FLEET_TRANSPORTS = {'ssh': SSHTransport, 'local': LocalTransport}
+
+
+def read_fleet_inventory(path, names=None):
+    """Return a transport for each node in an inventory file, in file order.
+
+    Each section is a node: 'host' (default: the section name), 'port', 'path' of the federatednode checkout,
+    'python' and 'transport' ('ssh' or 'local'). Keys in [DEFAULT] apply to every node.
+    """
+    inventory = configparser.ConfigParser()
+    inventory.read(path)
+    nodes = []
+    for name in inventory.sections():
+        if names and name not in names:
+            continue
+        options = dict(inventory.items(name))
+        transport = options.get('transport', 'ssh')
+        if transport not in FLEET_TRANSPORTS:
+            print("Invalid transport for node {}: {} (choose from {})".format(name, transport, ", ".join(FLEET_TRANSPORTS)))
+            sys.exit(1)
+        nodes.append(FLEET_TRANSPORTS[transport](name, options))
+    for name in names or []:
+        if not inventory.has_section(name):
+            print("Invalid node: {} (the inventory has: {})".format(name, ", ".join(inventory.sections())))
+            sys.exit(1)
+    return nodes
+
+
+def run_fleet_node(node, args, timeout=None):
+    start = time.time()
+    result = {'node': node.name, 'state': 'ok', 'returncode': None, 'output': '', 'error': '', 'data': None}
+    try:
+        result['returncode'], result['output'], result['error'] = node.run(args, timeout)
+    except subprocess.TimeoutExpired:
+        result['state'], result['error'] = 'timeout', "no result after {}s".format(timeout)
+    except OSError as e:
+        result['state'], result['error'] = 'failed', str(e)
+    if '--json' in args and result['output']:
+        # the JSON comes last, after anything printed on the way (e.g. configs generated from defaults)
+        lines = result['output'].rstrip().split('\n')
+        for i in range(len(lines)):
+            if lines[i].startswith(('[', '{')):
+                try:
+                    result['data'] = json.loads('\n'.join(lines[i:]))
+                    result['output'] = '\n'.join(lines[:i])
+                    break
+                except ValueError:
+                    continue
+    # status and configcheck exit 1 when something's wrong on the node, but still report it
+    if result['returncode'] not in (0, None) and result['data'] is None:
+        result['state'] = 'failed'
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def run_fleet(nodes, args, jobs=FLEET_JOBS_DEFAULT, rolling=None, keep_going=False, timeout=None, progress=None):
+    """Run fednode with args on every node, jobs at a time (or in rolling batches of N nodes).
+
+    In rolling mode, the nodes of a batch that come after one with a failure are skipped, unless keep_going.
+    Returns the per-node results (state, exit code, output, parsed JSON data, elapsed), in inventory order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    batches = [nodes[i:i + rolling] for i in range(0, len(nodes), rolling)] if rolling else [nodes]
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, rolling or jobs)) as executor:
+        for batch in batches:
+            if rolling and not keep_going and any(result['state'] != 'ok' for result in results.values()):
+                for node in batch:
+                    results[node.name] = {'node': node.name, 'state': 'skipped', 'returncode': None, 'output': '',
+                                          'error': "an earlier batch failed", 'data': None, 'elapsed': 0.0}
+                continue
+            futures = [executor.submit(run_fleet_node, node, args, timeout) for node in batch]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['node']] = result
+                print("[{}/{}] {}: {} ({:.1f}s)".format(len(results), len(nodes), result['node'], result['state'], result['elapsed']),
+                      file=progress, flush=True)
+    return [results[node.name] for node in nodes]
+
+
+def print_fleet_results(command, results, elapsed, as_json=False):
+    if as_json:
+        print(json.dumps({'command': command, 'elapsed': elapsed, 'nodes': results}, indent=2))
+        return
+    rows = None
+    if command == 'status':
+        rows = [["Node", "Service", "State", "Health", "Restarts", "Uptime"]]
+        for result in results:
+            for status in result['data'] or []:
+                rows.append([result['node'], status['service'], status['state'], status['health'] or "-",
+                             "-" if status['restarts'] is None else status['restarts'], format_duration(status.get('uptime'))])
+    elif command == 'sync':
+        rows = [["Node", "Network", "Layer", "Height", "Target", "Behind", "ETA"]]
+        for result in results:
+            for row in result['data'] or []:
+                rows.append([result['node'], row['network'], row['layer'], "-" if row['height'] is None else row['height'],
+                             "-" if row['target'] is None else row['target'], "-" if row['lag'] is None else row['lag'],
+                             format_duration(row['eta'])])
+    elif command == 'configcheck':
+        rows = [["Node", "Changed files", "Checks failed", "First failure"]]
+        for result in results:
+            if result['data'] is not None:
+                failed = [check for check in result['data']['checks'] if check['status'] != 'ok']
+                rows.append([result['node'], sum(1 for file_result in result['data']['files'] if file_result['status'] != 'ok'),
+                             len(failed), failed[0]['message'] if failed else "-"])
+    if rows is not None and len(rows) > 1:
+        print_table(rows)
+        print()
+
+    rows = [["Node", "Result", "Exit", "Time", "Output"]]
+    for result in results:
+        lines = [line for line in (result['error'] or result['output']).split('\n') if line.strip()]
+        last_line = lines[-1].strip() if lines and result['data'] is None else "-"
+        rows.append([result['node'], result['state'], "-" if result['returncode'] is None else result['returncode'],
+                     "{:.1f}s".format(result['elapsed']), last_line if len(last_line) <= 80 else last_line[:77] + "..."])
+    print_table(rows)
+    print("Ran '{}' on {} node(s) in {:.1f}s: {} ok".format(command, len(results), elapsed,
+                                                          sum(1 for result in results if result['state'] == 'ok')))
 
-    return
 
 def main():
     global DOCKER_CONFIG_PATH
-    setup_env()
+    global DOCKER_API_ENABLED
+    global COMMAND_TRACE
     args = parse_args()
+    if not IS_WINDOWS and os.geteuid() == 0 and args.command not in ROOT_ALLOWED_COMMANDS:
+        print("Please run this script as a non-root user.")
+        sys.exit(1)
+    DOCKER_API_ENABLED = not args.no_docker_api
+    if args.timings or args.trace:
+        import atexit
+        COMMAND_TRACE = CommandTrace()
+        atexit.register(COMMAND_TRACE.finish, args.trace)
 
     use_docker_pulls = not args.no_pull
 
     # run utility commands (docker_clean) if specified
     if args.command == 'docker_clean':
-        docker_containers = subprocess.check_output("{} docker ps -a -q".format(SUDO_CMD), shell=True).decode("utf-8").split('\n')
-        docker_images = subprocess.check_output("{} docker images -q".format(SUDO_CMD), shell=True).decode("utf-8").split('\n')
+        client = get_docker_client()
+        if client is not None:
+            docker_containers = [container['Id'][:12] for container in client.list_containers(all=True)]
+            docker_images = [image['Id'].split(':')[-1][:12] for image in client.list_images()]
+        else:
+            docker_containers = traced_check_output("{} docker ps -a -q".format(get_sudo_cmd()), shell=True).decode("utf-8").split('\n')
+            docker_images = traced_check_output("{} docker images -q".format(get_sudo_cmd()), shell=True).decode("utf-8").split('\n')
         for container in docker_containers:
             if not container:
                 continue
-            os.system("{} docker rm {}".format(SUDO_CMD, container))
+            traced_system("{} docker rm {}".format(get_sudo_cmd(), container))
         for image in docker_images:
             if not image:
                 continue
-            os.system("{} docker rmi {}".format(SUDO_CMD, image))
+            traced_system("{} docker rmi {}".format(get_sudo_cmd(), image))
         sys.exit(1)
 
+    # fleet mode runs fednode on other nodes, so it doesn't need a node set up here
+    if args.command == 'fleet':
+        if not os.path.exists(args.inventory):
+            print("Inventory file {} does not exist".format(args.inventory))
+            sys.exit(1)
+        nodes = read_fleet_inventory(args.inventory, args.nodes)
+        start = time.time()
+        results = run_fleet(nodes, FLEET_COMMANDS[args.fleet_command] + args.fleet_args, args.jobs, args.rolling,
+                            args.keep_going, args.timeout, progress=sys.stderr if args.json else sys.stdout)
+        print_fleet_results(args.fleet_command, results, time.time() - start, args.json)
+        if any(result['state'] != 'ok' or result['returncode'] for result in results):
+            sys.exit(1)
+        sys.exit(0)
+
     # for all other commands
     # if config doesn't exist, only the 'install' command may be run
     config_existed = os.path.exists(FEDNODE_CONFIG_PATH)
@@ -307,46 +4010,57 @@ def main():
     os.environ['HOSTNAME_BASE'] = socket.gethostname()
     os.environ['MONGODB_HOST_INTERFACE'] = getattr(args, 'mongodb_interface', "127.0.0.1")
 
+    # check any service names given against the services of the active docker-compose config
+    named_services = [getattr(args, 'service', None)] + list(getattr(args, 'services', None) or [])
+    if any(named_services):
+        compose_services = get_compose_services()
+        for service in named_services:
+            if service and service not in compose_services:
+                print("Invalid service: {} (the {} configuration has: {})".format(service, build_config, ", ".join(compose_services)))
+                sys.exit(1)
+
     # perform action for the specified command
     if args.command == 'install':
         if config_existed:
             print("Cannot install, as it appears a configuration already exists. Please run the 'uninstall' command first")
             sys.exit(1)
 
-        # check port usage
-        for port in HOST_PORTS_USED[build_config]:
-            if is_port_open(port):
-                print("Cannot install, as it appears a process is already listening on host port {}".format(port))
-                sys.exit(1)
-
         # check out the necessary source trees (don't use submodules due to detached HEAD and other problems)
         REPOS = REPOS_BASE if build_config == 'base' else (REPOS_UNOBLOCK if build_config == 'unoblock' else REPOS_FULL)
+        clone_opts = ""
+        if args.depth:
+            clone_opts += " --depth {} --no-single-branch".format(args.depth)
+        if args.partial:
+            clone_opts += " --filter=blob:none"
+        git_jobs = []
         for repo in REPOS:
             repo_url = REPO_BASE_SSH.format(repo) if args.use_ssh_uris else REPO_BASE_HTTPS.format(repo)
             repo_dir = os.path.join(SCRIPTDIR, "src", repo)
             if not os.path.exists(repo_dir):
-                git_cmd = "git clone -b {} {} {}".format(repo_branch, repo_url, repo_dir)
-                if not IS_WINDOWS:  # make sure to check out the code as the original user, so the permissions are right
-                    os.system("{} -u {} bash -c \"{}\"".format(SUDO_CMD, SESSION_USER, git_cmd))
-                else:
-                    os.system(git_cmd)
+                git_cmd = "git clone{} -b {} {} {}".format(clone_opts, repo_branch, repo_url, repo_dir)
+                git_jobs.append((repo, session_user_cmd(git_cmd)))
+        git_results = run_git_jobs(git_jobs, args.jobs)
+        if any(result['returncode'] != 0 for result in git_results):
+            print("Cannot install, as not all source checkouts succeeded. Fix the errors above and run 'uninstall' and 'install' again")
+            sys.exit(1)
+
+        # check port usage (once the sources are checked out: docker-compose needs the build contexts to resolve the services)
+        for port in sorted(set(port for service in get_compose_model()['services'].values() for port in service['ports'])):
+            if is_port_open(port):
+                print("Cannot install, as it appears a process is already listening on host port {}. Free it, then run "
+                      "'uninstall' and 'install' again".format(port))
+                sys.exit(1)
 
         # make sure we have the newest image for each service
         if use_docker_pulls:
-            run_compose_cmd("pull --ignore-pull-failures")
+            start = time.time()
+            print_pull_results(pull_images(get_compose_images()), time.time() - start)
         else:
             print("skipping docker pull command")
 
 
         # copy over the configs from .default to active versions, if they don't already exist
-        for default_config in glob.iglob(os.path.join(SCRIPTDIR, 'config', '**/*.default'), recursive=True):
-            active_config = default_config.replace('.default', '')
-            if not os.path.exists(active_config):
-                print("Generating config from defaults at {} ...".format(active_config))
-                shutil.copy2(default_config, active_config)
-                default_config_stat = os.stat(default_config)
-                if not IS_WINDOWS:
-                    os.chown(active_config, default_config_stat.st_uid, default_config_stat.st_gid)
+        ensure_active_configs()
 
         # create symlinks to the data volumes (for ease of use)
         if not IS_WINDOWS:
@@ -354,7 +4068,7 @@ def main():
             if not os.path.exists(data_dir):
                 os.mkdir(data_dir)
 
-            for volume in VOLUMES_USED[build_config]:
+            for volume in get_compose_model()['volumes']:
                 symlink_path = os.path.join(data_dir, volume.replace('-data', ''))
                 volume_name = "{}_{}".format(PROJECT_NAME, volume)
                 mountpoint_path = get_docker_volume_path(volume_name)
@@ -363,106 +4077,416 @@ def main():
                     print("For convenience, symlinking {} to {}".format(mountpoint_path, symlink_path))
 
         # launch
-        run_compose_cmd("up -d")
+        if args.no_wait:
+            run_compose_cmd("up -d")
+        else:
+            run_compose_cmd("up --no-start")
+            start = time.time()
+            print_start_results(start_services(get_compose_services(), get_compose_links(), args.timeout), time.time() - start)
     elif args.command == 'uninstall':
         run_compose_cmd("down")
         os.remove(FEDNODE_CONFIG_PATH)
-    elif args.command == 'start':
-        run_compose_cmd("start {}".format(' '.join(args.services)))
-    elif args.command == 'stop':
-        run_compose_cmd("stop {}".format(' '.join(args.services)))
-    elif args.command == 'restart':
-        run_compose_cmd("restart {}".format(' '.join(args.services)))
+    elif args.command in ('start', 'stop', 'restart'):
+        if args.command == 'stop' or args.no_wait:
+            service_cmd(args.command, args.services)
+        else:
+            links = get_compose_links()
+            services = args.services or list(links)
+            services = get_dependents(services, collections.OrderedDict(
+                (service, [linked for linked in links[service] if linked in services]) for service in links if service in services))
+            if args.command == 'restart':
+                service_cmd('stop', list(reversed(services)))
+            start = time.time()
+            results = start_services(services, links, args.timeout)
+            print_start_results(results, time.time() - start)
+            if any(result['state'] in ('exited', 'skipped') for result in results):
+                sys.exit(1)
     elif args.command == 'reparse':
-        run_compose_cmd("stop {}".format(args.service))
-        run_compose_cmd("run -e COMMAND=reparse {}".format(args.service))
+        if args.from_block is not None:
+            if args.service not in ROLLBACK_CHOICES:
+                print("--from-block is only supported for {}".format(", ".join(ROLLBACK_CHOICES)))
+                sys.exit(1)
+            if rollback_from_snapshot(config, args.service, args.from_block) is None:
+                sys.exit(1)
+            service_cmd('start', [args.service])
+        else:
+            run_compose_cmd("stop {}".format(args.service))
+            run_compose_cmd("run -e COMMAND=reparse {}".format(args.service))
     elif args.command == 'rollback':
-        run_compose_cmd("stop {}".format(args.service))
-        run_compose_cmd("run -e COMMAND='rollback {}' {}".format(args.block_index, args.service))
+        if args.no_snapshot or rollback_from_snapshot(config, args.service, args.block_index) is None:
+            run_compose_cmd("stop {}".format(args.service))
+            run_compose_cmd("run -e COMMAND='rollback {}' {}".format(args.block_index, args.service))
+    elif args.command == 'snapshot':
+        volume_path = get_docker_volume_path("{}_unoparty-data".format(PROJECT_NAME))
+        if volume_path is None:
+            print("Cannot find the unoparty-data volume")
+            sys.exit(1)
+        if not os.access(volume_path, os.R_OK | os.W_OK | os.X_OK):
+            reexec_with_sudo()
+        snapshot_dir = get_snapshot_dir(config, volume_path, args.service)
+        if args.action == 'create':
+            db_path = os.path.join(volume_path, UNOPARTY_DB_FILES[args.service])
+            if not os.path.exists(db_path):
+                print("Database {} doesn't exist (yet)".format(db_path))
+                sys.exit(1)
+            was_running = is_container_running(args.service, abort_on_not_exist=False)
+            create_snapshot(db_path, snapshot_dir,
+                            lambda: was_running and service_cmd('stop', [args.service]),
+                            lambda: was_running and service_cmd('start', [args.service]), args.min_blocks)
+        if args.action == 'prune' or (args.action == 'create' and not args.no_prune):
+            for snapshot in prune_snapshots(list_snapshots(snapshot_dir), args.keep_last, args.keep_every, args.keep_sparse):
+                print("Pruned the block {} snapshot".format(snapshot['block_index']))
+        if args.action == 'list':
+            print_snapshots(list_snapshots(snapshot_dir))
+        elif args.action == 'verify':
+            failed = False
+            for snapshot in list_snapshots(snapshot_dir):
+                problems = verify_snapshot(snapshot)
+                print("Block {}: {}".format(snapshot['block_index'], "; ".join(problems) if problems else "OK"))
+                failed = failed or bool(problems)
+            sys.exit(1 if failed else 0)
     elif args.command == 'vacuum':
-        run_compose_cmd("stop {}".format(args.service))
-        run_compose_cmd("run -e COMMAND=vacuum {}".format(args.service))
+        if args.offline:
+            run_compose_cmd("stop {}".format(args.service))
+            run_compose_cmd("run -e COMMAND=vacuum {}".format(args.service))
+        else:
+            volume_path = get_docker_volume_path("{}_unoparty-data".format(PROJECT_NAME))
+            if volume_path is None:
+                print("Cannot find the unoparty-data volume")
+                sys.exit(1)
+            if not os.access(volume_path, os.R_OK | os.W_OK | os.X_OK):
+                reexec_with_sudo()
+            db_path = os.path.join(volume_path, UNOPARTY_DB_FILES[args.service])
+            if not os.path.exists(db_path):
+                print("Database {} doesn't exist (yet)".format(db_path))
+                sys.exit(1)
+            if args.report:
+                print_db_stats(get_db_stats(db_path))
+            else:
+                db_maintenance(db_path, lambda: service_cmd('stop', [args.service]), lambda: service_cmd('start', [args.service]),
+                               args.max_free_ratio, args.force)
+    elif args.command in ('export', 'bootstrap'):
+        archive_dir = os.path.abspath(args.output_dir if args.command == 'export' else args.archive_dir)
+        compose_volumes = get_compose_model()['volumes']
+        volumes = args.volumes or compose_volumes
+        if args.command == 'bootstrap' and not args.volumes:
+            volumes = [volume for volume in volumes if os.path.exists(os.path.join(archive_dir, "{}.manifest.json".format(volume)))]
+        for volume in volumes:
+            if volume not in compose_volumes:
+                print("Invalid volume: {} (choose from {})".format(volume, ", ".join(compose_volumes)))
+                sys.exit(1)
+        if not volumes:
+            print("No volume archives found in {}".format(archive_dir))
+            sys.exit(1)
+        if args.command == 'export':
+            os.makedirs(archive_dir, exist_ok=True)
+        elif any(get_docker_volume_path("{}_{}".format(PROJECT_NAME, volume)) is None for volume in volumes):
+            run_compose_cmd("up --no-start")  # create the volumes (and containers), without starting anything
+
+        mountpoints = {}
+        for volume in volumes:
+            mountpoints[volume] = get_docker_volume_path("{}_{}".format(PROJECT_NAME, volume))
+            if mountpoints[volume] is None:
+                print("Cannot find the {} volume".format(volume))
+                sys.exit(1)
+            if not os.access(mountpoints[volume], os.R_OK | os.W_OK | os.X_OK):
+                reexec_with_sudo()
+
+        running_services = get_running_services()
+        if running_services:  # so the data on the volumes is consistent
+            service_cmd('stop', running_services)
+        failed = False
+        try:
+            for volume in volumes:
+                if args.command == 'export':
+                    export_volume(volume, mountpoints[volume], archive_dir, args.part_size, args.jobs)
+                else:
+                    with open(os.path.join(archive_dir, "{}.manifest.json".format(volume))) as f:
+                        manifest = json.load(f)
+                    failed = not bootstrap_volume(manifest, archive_dir, mountpoints[volume], args.jobs, args.overwrite) or failed
+        finally:
+            if running_services:
+                service_cmd('start', running_services)
+        if args.command == 'bootstrap' and not running_services and not failed:
+            print("Run 'fednode start' to start the services")
+        sys.exit(1 if failed else 0)
+    elif args.command == 'du':
+        compose_volumes = get_compose_model()['volumes']
+        mountpoints = collections.OrderedDict()
+        for volume in args.volumes or compose_volumes:
+            if volume not in compose_volumes:
+                print("Invalid volume: {} (choose from {})".format(volume, ", ".join(compose_volumes)))
+                sys.exit(1)
+            mountpoint = get_docker_volume_path("{}_{}".format(PROJECT_NAME, volume))
+            if mountpoint is None:
+                continue  # not created (yet)
+            if not os.access(mountpoint, os.R_OK | os.X_OK):
+                reexec_with_sudo()
+            mountpoints[volume] = mountpoint
+        report = disk_usage_report(mountpoints, args.jobs, args.full, not args.no_record)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_disk_usage(report)
     elif args.command == 'tail':
-        run_compose_cmd("logs -f --tail={} {}".format(args.num_lines, ' '.join(args.services)))
+        if not api_logs(args.services, tail=args.num_lines, follow=True):
+            run_compose_cmd("logs -f --tail={} {}".format(args.num_lines, ' '.join(args.services)))
     elif args.command == 'logs':
-        run_compose_cmd("logs {}".format(' '.join(args.services)))
+        if args.since is not None or args.until is not None or args.grep or args.level:
+            services = args.services or get_compose_services()
+            if not native_logs(services, args.since, args.until, args.grep, args.level, args.timestamps):
+                reexec_with_sudo()  # the log files are only readable by root
+        elif not api_logs(args.services):
+            run_compose_cmd("logs {}".format(' '.join(args.services)))
     elif args.command == 'ps':
-        run_compose_cmd("ps")
+        if not api_ps():
+            run_compose_cmd("ps")
     elif args.command == 'exec':
         if len(args.cmd) == 1 and re.match("['\"].*?['\"]", args.cmd[0]):
             cmd = args.cmd
         else:
             cmd = '"{}"'.format(' '.join(args.cmd).replace('"', '\\"'))
-        os.system("{} docker exec -i -t federatednode_{}_1 bash -c {}".format(SUDO_CMD, args.service, cmd))
+        traced_system("{} docker exec -i -t federatednode_{}_1 bash -c {}".format(get_sudo_cmd(), args.service, cmd))
     elif args.command == 'shell':
         container_running = is_container_running(args.service)
         if container_running:
-            os.system("{} docker exec -i -t federatednode_{}_1 bash".format(SUDO_CMD, args.service))
+            traced_system("{} docker exec -i -t federatednode_{}_1 bash".format(get_sudo_cmd(), args.service))
         else:
             print("Container is not running -- creating a transient container with a 'bash' shell entrypoint...")
             run_compose_cmd("run --no-deps --rm --entrypoint bash {}".format(args.service))
     elif args.command == 'update':
         # validate
-        if args.services != ['', ]:
-            for service in args.services:
-                if service not in UPDATE_CHOICES:
-                    print("Invalid service: {}".format(service))
-                    sys.exit(1)
+        source_services = get_source_services()
+        for service in args.services:
+            if service not in source_services:
+                print("Invalid service: {} (it isn't built from a source checkout)".format(service))
+                sys.exit(1)
+
+        services_to_update = list(source_services) if not len(args.services) else args.services
 
-        services_to_update = copy.copy(UPDATE_CHOICES) if not len(args.services) else args.services
-        git_has_updated = []
-        while services_to_update:
-            # update source code
-            service = services_to_update.pop(0)
+        # find the source checkouts of the services, and what each has checked out before updating
+        service_dirs = {}
+        heads = collections.OrderedDict()
+        for service in services_to_update:
             service_base = service.replace('-testnet', '')
-            if service_base not in git_has_updated:
-                git_has_updated.append(service_base)
-                if service_base == 'unoparty':  # special case
-                    service_dirs = [os.path.join(SCRIPTDIR, "src", "unoparty-lib"), os.path.join(SCRIPTDIR, "src", "unoparty-cli")]
-                else:
-                    service_dirs = [service_base,]
-                for service_dir in service_dirs:
-                    service_dir_path = os.path.join(SCRIPTDIR, "src", service_dir)
-                    if not os.path.exists(service_dir_path):
-                        continue
-                    service_branch = subprocess.check_output("cd {};git symbolic-ref --short -q HEAD;cd {}".format(service_dir_path, CURDIR), shell=True).decode("utf-8").strip()
-                    if not service_branch:
-                        print("Unknown service git branch name, or repo in detached state")
-                        sys.exit(1)
-                    git_cmd = "cd {}; git pull origin {}; cd {}".format(service_dir_path, service_branch, CURDIR)
-                    if not IS_WINDOWS:  # make sure to update the code as the original user, so the permissions are right
-                        os.system("{} -u {} bash -c \"{}\"".format(SUDO_CMD, SESSION_USER, git_cmd))
-                    else:
-                        os.system(git_cmd)
+            if service_base in service_dirs:
+                continue
+            service_dirs[service_base] = []
+            for repo_name in source_services[service]:
+                service_dir_path = os.path.join(SCRIPTDIR, "src", repo_name)
+                if not os.path.exists(service_dir_path):
+                    continue
+                service_dirs[service_base].append(service_dir_path)
+                heads[service_dir_path] = git_head(service_dir_path)
+                if heads[service_dir_path][0] is None:
+                    print("Unknown service git branch name, or repo in detached state")
+                    sys.exit(1)
+
+        # update source code for all affected repos concurrently (for a dry run, only fetch it)
+        git_jobs = []
+        for service_dir_path, (service_branch, _) in heads.items():
+            git_cmd = "cd {}; git {} origin {}; cd {}".format(service_dir_path, 'fetch' if args.dry_run else 'pull', service_branch, CURDIR)
+            git_jobs.append((os.path.basename(service_dir_path), session_user_cmd(git_cmd)))
+        git_failed = [result['name'] for result in run_git_jobs(git_jobs, args.jobs) if result['returncode'] != 0]
+
+        changed_dirs = []
+        for service_dir_path, (_, old_commit) in heads.items():
+            if os.path.basename(service_dir_path) in git_failed:
+                continue
+            new_commit = git_rev(service_dir_path, 'FETCH_HEAD' if args.dry_run else 'HEAD')
+            if new_commit is not None and new_commit != old_commit:
+                new_commits = git_count_commits(service_dir_path, old_commit, new_commit)
+                if new_commits:  # (a fetched commit may also be one we already have)
+                    changed_dirs.append(service_dir_path)
+                    print("{}: {}..{} ({} new commit{})".format(os.path.basename(service_dir_path), old_commit[:7], new_commit[:7],
+                                                                new_commits, '' if new_commits == 1 else 's'))
+        changed_bases = [service_base for service_base, dirs in service_dirs.items()
+                         if args.force or any(path in changed_dirs for path in dirs)]
 
+        # restart the services whose code changed, and the services linking to them
+        links = get_compose_links()
+        updated_services = [service for service in services_to_update if service.replace('-testnet', '') in changed_bases and service in links]
+        services_to_restart = get_dependents(updated_services, links) if not args.no_restart else []
+        if not changed_bases:
+            print("Everything is up to date; nothing to restart")
+        elif args.dry_run:
+            rows = [["Service", "Action"]]
+            for service in services_to_restart or updated_services:
+                actions = []
+                if service in updated_services:
+                    actions.append("update code")
+                    if service.replace('-testnet', '') in ('unoparty', 'unoblock', 'armory-utxsvr'):
+                        actions.append("remove egg")
+                    if service == 'unowallet':
+                        actions.append("rebuild")
+                if service in services_to_restart:
+                    actions.append("restart" if service in updated_services else "restart (links to an updated service)")
+                rows.append([service, ", ".join(actions)])
+            print("Plan (dry run, nothing was changed):")
+            print_table(rows)
+        else:
+            for service_base in changed_bases:
+                for service_dir_path in service_dirs[service_base]:
                     # delete installed egg (to force egg recreate and deps re-check on next start)
                     if service_base in ('unoparty', 'unoblock', 'armory-utxsvr'):
                         for path in glob.glob(os.path.join(service_dir_path, "*.egg-info")):
                             print("Removing egg path {}".format(path))
                             if not IS_WINDOWS:  # have to use root
-                                os.system("{} bash -c \"rm -rf {}\"".format(SUDO_CMD, path))
+                                traced_system("{} bash -c \"rm -rf {}\"".format(get_sudo_cmd(), path))
                             else:
                                 shutil.rmtree(path)
 
                 if service_base == 'unowallet' and os.path.exists(os.path.join(SCRIPTDIR, "src", "unowallet")):  # special case
                     transifex_cfg_path = os.path.join(os.path.expanduser("~"), ".transifex")
                     if os.path.exists(transifex_cfg_path):
-                        os.system("{} docker cp {} federatednode_unowallet_1:/root/.transifex".format(SUDO_CMD, transifex_cfg_path))
-                    os.system("{} docker exec -i -t federatednode_unowallet_1 bash -c \"cd /unowallet/src ".format(SUDO_CMD) +
+                        traced_system("{} docker cp {} federatednode_unowallet_1:/root/.transifex".format(get_sudo_cmd(), transifex_cfg_path))
+                    traced_system("{} docker exec -i -t federatednode_unowallet_1 bash -c \"cd /unowallet/src ".format(get_sudo_cmd()) +
                               "&& bower --allow-root update && cd /unowallet && npm update && grunt build\"")
                     if not os.path.exists(transifex_cfg_path):
                         print("NOTE: Did not update locales because there is no .transifex file in your home directory")
                         print("If you want locales compiled, sign up for transifex and create this file to" +
                               " contain 'your_transifex_username:your_transifex_password'")
 
-            # and restart container
-            if not args.no_restart:
-                run_compose_cmd("restart {}".format(service))
+            # and restart the containers (dependencies first)
+            if services_to_restart:
+                service_cmd('restart', services_to_restart)
+        if git_failed:
+            sys.exit(1)
     elif args.command == 'configcheck':
-        config_check(build_config)
+        result = config_check(build_config)
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_config_check(result)
+        if any(check['status'] == 'error' for check in result['checks']):
+            sys.exit(1)
+    elif args.command == 'tune':
+        hardware = detect_hardware()
+        for key in ('cores', 'memory', 'disk'):
+            if getattr(args, key) is not None:
+                hardware['memory_mb' if key == 'memory' else key] = getattr(args, key)
+        if hardware['memory_mb'] is None:
+            print("Could not detect the amount of RAM. Please specify it with --memory")
+            sys.exit(1)
+        tune(build_config, hardware, args.apply)
+    elif args.command == 'status':
+        statuses = get_services_status(build_config, args.max_age)
+        print_services_status(statuses, args.json)
+        if any(status['state'] != 'running' or status['health'] == 'unhealthy' for status in statuses):
+            sys.exit(1)
+    elif args.command == 'sync':
+        networks = ['mainnet', 'testnet'] if args.network == 'both' else [args.network]
+        monitor = SyncMonitor({network: get_sync_clients(network, args.host) for network in networks})
+        try:
+            while True:
+                if args.json:
+                    print(json.dumps(monitor.poll()), flush=True)
+                else:
+                    print_sync_status(monitor.poll())
+                if args.once:
+                    break
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            monitor.close()
+    elif args.command == 'bench-api':
+        spec = SYNC_NETWORKS[args.network]
+        if args.api == 'unoparty':
+            api_config = read_config_values(os.path.join(SCRIPTDIR, 'config', 'unoparty', spec['unoparty_conf']), ['Default'])
+        else:
+            api_config = read_config_values(os.path.join(SCRIPTDIR, 'config', 'unoblock', "server{}.conf".format(
+                '.testnet' if args.network == 'testnet' else '')), ['Default'])
+        port = args.port or int(api_config.get('rpc-port') or BENCH_API_PORTS[args.api][args.network])
+        headers = {}
+        if api_config.get('rpc-user'):
+            credentials = "{}:{}".format(api_config['rpc-user'], api_config.get('rpc-password') or '').encode("utf-8")
+            headers['Authorization'] = "Basic " + base64.b64encode(credentials).decode("ascii")
+        available = BENCH_API_WORKLOADS[args.api]
+        workloads = []
+        for setting in args.workload or list(available):
+            name, _, weight = setting.partition('=')
+            if name not in available:
+                print("Invalid workload for {}: {} (choose from {})".format(args.api, name, ", ".join(available)))
+                sys.exit(1)
+            method, params = available[name]
+            if '{address}' in json.dumps(params) and not args.address:
+                if args.workload:
+                    print("The {} workload needs --address".format(name))
+                    sys.exit(1)
+                continue  # (only left out of the default mix)
+            workloads.append((name, method, params, float(weight or 1)))
+        if not args.json:
+            print("Loading {}:{} with {} ({} connections{}) for {:g}s ...".format(
+                args.host, port, ", ".join("{}={:g}".format(workload[0], workload[3]) for workload in workloads),
+                args.concurrency, ", {:g} req/s".format(args.rps) if args.rps else "", args.duration))
+        result = run_api_benchmark(args.host, port, '/api/', headers, workloads, args.concurrency, args.rps, args.duration,
+                                   args.timeout, args.address, args.asset or BENCH_API_ASSETS)
+        summary = summarize_api_benchmark(result, args.rps)
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            print_api_benchmark(summary)
+    elif args.command == 'watch':
+        import asyncio
+        services = args.services or get_compose_services()
+        if args.events:
+            sources = [read_fake_events(args.events)]
+        else:
+            sources = [reconnecting_events(docker_api_events if get_docker_client() is not None else docker_cli_events, watch_log)]
+            networks = [network for network, spec in sorted(SYNC_NETWORKS.items())
+                        if any(layer + spec['suffix'] in services for layer in ('unobtanium', 'addrindexrs', 'unoparty'))]
+            if networks and args.stall_minutes:
+                sources.append(poll_block_heights(networks, args.host, args.poll_interval))
+
+        async def restart(service):
+            if args.dry_run:
+                watch_log("{}: (dry run, not restarted)".format(service))
+            else:
+                await asyncio.get_event_loop().run_in_executor(None, service_cmd, 'restart', [service])
+
+        async def alert(service, kind, message):
+            await run_alert_hook(args.alert_cmd, service, kind, message)
+
+        watchdog = Watchdog(services, None if args.no_restart else restart, alert if args.alert_cmd else None,
+                            args.stall_minutes * 60, args.backoff, args.max_backoff, args.max_restarts)
+        watch_log("watching {} ({})".format(", ".join(services), "no stall checks" if not args.stall_minutes else
+                                            "stalled after {} without progress".format(format_duration(args.stall_minutes * 60))))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        task = loop.create_task(watchdog.run(merge_events(sources)))
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            for pending in [task] + list(watchdog.tasks):
+                pending.cancel()
+            loop.run_until_complete(asyncio.gather(task, *watchdog.tasks, return_exceptions=True))
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+    elif args.command == 'metrics':
+        services = args.services or get_compose_services()
+        collector = MetricsCollector(services, args.window)
+        collector.start()
+        if args.port:
+            serve_metrics(collector, args.listen, args.port)
+            print("Serving Prometheus metrics at http://{}:{}/metrics".format(args.listen, args.port))
+        try:
+            while True:
+                time.sleep(args.interval)
+                collector.print_summary()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'pull':
+        start = time.time()
+        results = pull_images(get_compose_images(args.services), args.jobs, args.check, args.force)
+        print_pull_results(results, time.time() - start)
+        if any(result['state'] == 'failed' for result in results):
+            sys.exit(1)
     elif args.command == 'rebuild':
         if use_docker_pulls:
-            run_compose_cmd("pull --ignore-pull-failures {}".format(' '.join(args.services)))
+            start = time.time()
+            print_pull_results(pull_images(get_compose_images(args.services)), time.time() - start)
         else:
             print("skipping docker pull command")
         run_compose_cmd("up -d --build --force-recreate --no-deps {}".format(' '.join(args.services)))
@@ -0,0 +1,100 @@
+import io
+import os
+import sys
+import time
+import unittest
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "extras", "benchmark"))
+import fednode  # noqa: E402
+import api_stub  # noqa: E402
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = list(range(100, 0, -1))  # (unsorted)
+        self.assertEqual([fednode.percentile(values, pct) for pct in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(fednode.percentile([3.0], 99), 3.0)
+        self.assertIsNone(fednode.percentile([], 50))
+
+    def test_summary(self):
+        result = {'elapsed': 2.0, 'workloads': {
+            'running_info': {'latencies': [i / 1000.0 for i in range(1, 101)], 'errors': {'RPC error': 20, 'HTTP 500': 5}},
+            'asset_info': {'latencies': [], 'errors': {'timeout': 25}},
+        }}
+        summary = fednode.summarize_api_benchmark(result, target_rps=100)
+        running_info = summary['workloads']['running_info']
+        self.assertEqual((running_info['requests'], running_info['ok']), (125, 100))
+        self.assertAlmostEqual(running_info['error_rate'], 0.2)
+        self.assertAlmostEqual(running_info['rps'], 62.5)
+        for key, expected in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99), ('max_ms', 100)):
+            self.assertAlmostEqual(running_info[key], expected)
+        self.assertEqual((summary['workloads']['asset_info']['error_rate'], summary['workloads']['asset_info']['p50_ms']), (1.0, None))
+        total = summary['workloads']['total']
+        self.assertEqual((total['requests'], total['errors']), (150, {'RPC error': 20, 'HTTP 500': 5, 'timeout': 25}))
+        self.assertAlmostEqual(total['error_rate'], 1 / 3.0)
+
+
+class APIBenchmarkTest(unittest.TestCase):
+    workloads = [('running_info', 'get_running_info', {}, 3.0), ('asset_info', 'get_asset_info', {'assets': ['{asset}']}, 1.0)]
+
+    def run_benchmark(self, server, **kwargs):
+        result = fednode.run_api_benchmark('127.0.0.1', server.server_address[1], '/api/', {}, self.workloads, **kwargs)
+        time.sleep(0.05)  # (the stub counts a call once its reply is sent)
+        return fednode.summarize_api_benchmark(result, kwargs.get('rps'))
+
+    def test_latency_percentiles(self):
+        # 80% of the calls take 5ms and 20% take 100ms: the p50 is a fast call, the p95 and p99 slow ones
+        server = api_stub.start_api_stub(latency=0.005, slow_rate=0.2, slow_latency=0.1)
+        try:
+            summary = self.run_benchmark(server, concurrency=4, duration=1.5)
+        finally:
+            server.shutdown()
+        total = summary['workloads']['total']
+        self.assertEqual(total['requests'], sum(server.calls.values()))
+        self.assertEqual((total['errors'], total['error_rate']), ({}, 0.0))
+        self.assertGreater(total['requests'], 40)
+        self.assertTrue(5 <= total['p50_ms'] < 50, total['p50_ms'])
+        self.assertTrue(100 <= total['p95_ms'] <= total['p99_ms'] <= total['max_ms'] < 1000, total)
+        self.assertAlmostEqual(total['rps'], total['requests'] / summary['elapsed'])
+        # the mix follows the weights
+        self.assertEqual(summary['workloads']['running_info']['requests'], server.calls['get_running_info'])
+        self.assertGreater(server.calls['get_running_info'], server.calls['get_asset_info'])
+
+    def test_error_ratio(self):
+        server = api_stub.start_api_stub(latency=0.002, error_rate=0.2, http_error_rate=0.1)
+        try:
+            summary = self.run_benchmark(server, concurrency=4, duration=1.0)
+        finally:
+            server.shutdown()
+        total = summary['workloads']['total']
+        self.assertEqual(total['requests'], sum(server.calls.values()))
+        self.assertEqual(set(total['errors']), {'RPC error', 'HTTP 500'})
+        self.assertEqual(total['ok'] + sum(total['errors'].values()), total['requests'])
+        self.assertAlmostEqual(total['error_rate'], sum(total['errors'].values()) / total['requests'])
+        self.assertAlmostEqual(total['error_rate'], 0.3, delta=0.1)
+        self.assertAlmostEqual(total['errors']['HTTP 500'] / total['requests'], 0.1, delta=0.07)
+        self.assertEqual(total['ok'], summary['workloads']['running_info']['ok'] + summary['workloads']['asset_info']['ok'])
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            fednode.print_api_benchmark(summary)
+        total_row = [line for line in out.getvalue().split('\n') if line.split()[:1] == ['total']][0]
+        self.assertIn("{} ({:.1%})".format(sum(total['errors'].values()), total['error_rate']), total_row)
+        self.assertIn("RPC error: {}".format(total['errors']['RPC error']), out.getvalue())
+
+    def test_target_rps(self):
+        server = api_stub.start_api_stub(latency=0.001)
+        try:
+            summary = self.run_benchmark(server, concurrency=4, rps=50, duration=1.0)
+        finally:
+            server.shutdown()
+        total = summary['workloads']['total']
+        self.assertEqual(total['requests'], 50)  # (one every 20ms, for a second)
+        self.assertEqual(summary['target_rps'], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
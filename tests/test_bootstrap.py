@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+def read_tree(root):
+    """Map each path under root to its contents (file), target (symlink) or None (directory)"""
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(path, root)
+            if os.path.islink(path):
+                tree[rel_path] = "-> " + os.readlink(path)
+            elif os.path.isdir(path):
+                tree[rel_path] = None
+            else:
+                with open(path, 'rb') as f:
+                    tree[rel_path] = f.read()
+    return tree
+
+
+class BootstrapTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, "source")
+        self.archives = os.path.join(self.dir, "archives")
+        self.volume = os.path.join(self.dir, "volume")
+        for path in (self.archives, self.volume, os.path.join(self.source, "blocks", "index")):
+            os.makedirs(path)
+        for i in range(6):
+            with open(os.path.join(self.source, "blocks", "blk{:05d}.dat".format(i)), 'wb') as f:
+                f.write(os.urandom(50000))
+        with open(os.path.join(self.source, "blocks", "index", "000001.ldb"), 'wb') as f:
+            f.write(b"index" * 1000)
+        os.symlink("blocks/blk00000.dat", os.path.join(self.source, "latest"))
+        patches = [mock.patch.object(fednode, 'FEDNODE_CACHE_DIR', os.path.join(self.dir, "cache")), mock.patch('sys.stdout'),
+                   mock.patch.object(fednode, 'file_sha256', side_effect=AssertionError("parts are checksummed as they're read"))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self):
+        fednode.export_volume("unobtanium-data", self.source, self.archives, part_size=100000, jobs=2)
+        with open(os.path.join(self.archives, "unobtanium-data.manifest.json")) as f:
+            return json.load(f)
+
+    def state_path(self):
+        return os.path.join(self.dir, "cache", "bootstrap", "unobtanium-data.json")
+
+    def assert_no_staging(self):
+        self.assertEqual([name for name in os.listdir(self.volume) if name.startswith(fednode.ARCHIVE_STAGING_PREFIX)], [])
+
+    def check_restore(self):
+        manifest = self.export()
+        self.assertGreater(len(manifest['parts']), 2)
+        self.assertTrue(fednode.bootstrap_volume(manifest, self.archives, self.volume, jobs=2))
+        self.assertEqual(read_tree(self.volume), read_tree(self.source))
+        self.assertFalse(os.path.exists(self.state_path()))
+
+    def test_restore_zstd(self):
+        if not shutil.which('zstd'):
+            self.skipTest("zstd is not installed")
+        self.check_restore()
+        self.assertTrue(os.listdir(self.archives)[0].endswith(".zst"))
+
+    def test_restore_gzip(self):
+        with mock.patch.object(fednode.shutil, 'which', return_value=None):
+            self.check_restore()
+
+    def test_corrupt_part_leaves_nothing_behind_and_resumes(self):
+        with mock.patch.object(fednode.shutil, 'which', return_value=None):
+            manifest = self.export()
+        bad = manifest['parts'][-1]
+        bad_path = os.path.join(self.archives, bad['name'])
+        shutil.copyfile(bad_path, bad_path + ".good")
+        with open(bad_path, 'r+b') as f:  # (same size, so only the checksum can tell)
+            f.seek(bad['size'] - 20)
+            f.write(b"\0" * 20)
+        self.assertFalse(fednode.bootstrap_volume(manifest, self.archives, self.volume, jobs=2))
+        self.assert_no_staging()
+        with open(self.state_path()) as f:
+            state = json.load(f)
+        self.assertEqual(sorted(state['done']), sorted(part['name'] for part in manifest['parts'][:-1]))
+        self.assertEqual(state['mountpoint'], self.volume)
+        restored = read_tree(self.volume)
+        self.assertNotIn("blocks/blk00005.dat", restored)  # (in the corrupt part)
+        self.assertNotIn("blocks/index/000001.ldb", restored)
+        self.assertIn("blocks/blk00004.dat", restored)
+
+        os.makedirs(os.path.join(self.volume, fednode.ARCHIVE_STAGING_PREFIX + "interrupted", "blocks"))
+        os.replace(bad_path + ".good", bad_path)
+        self.assertTrue(fednode.bootstrap_volume(manifest, self.archives, self.volume, jobs=2))
+        self.assertEqual(read_tree(self.volume), read_tree(self.source))
+        self.assert_no_staging()
+
+    def test_non_empty_volume_needs_overwrite(self):
+        manifest = self.export()
+        with open(os.path.join(self.volume, "stray"), 'w') as f:
+            f.write("synced meanwhile")
+        self.assertFalse(fednode.bootstrap_volume(manifest, self.archives, self.volume))
+        self.assertTrue(fednode.bootstrap_volume(manifest, self.archives, self.volume, overwrite=True))
+        self.assertEqual(read_tree(self.volume), read_tree(self.source))
+
+
+if __name__ == '__main__':
+    unittest.main()
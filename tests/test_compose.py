@@ -0,0 +1,199 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+# as written by docker-compose 1.x (PyYAML, wrapping long scalars at 80 columns)
+RENDERED_V1 = """networks: {{}}
+services:
+  addrindexrs:
+    build:
+      context: {src}/addrindexrs
+      dockerfile: ./Dockerfile
+    command: cargo run --release -- -vvvv --db-dir /home/user/db --daemon-dir /root/.unobtanium
+      --jsonrpc-import
+    environment:
+      ADDRINDEXRS_COOKIE: unobtaniumrpc:rpc
+      ADDRINDEXRS_TXID_LIMIT: '15000'
+      NOTE: 'a single-quoted value that is long enough to be wrapped onto the next
+        line, with an ''escaped'' quote'
+      ESCAPED: "a double-quoted value with a tab\\t that is wrapped with an escaped\\
+        \\ line break"
+    ports:
+    - 8122:8122/tcp
+    volumes:
+    - {root}/config/addrindexrs:/root/.config/addrindexrs:rw
+    - addrindexrs-data:/home/user/db:rw
+  redis:
+    image: redis:3.2
+    ports:
+    - 127.0.0.1:6379:6379/tcp
+  unoparty:
+    build:
+      context: {src}/unoparty-lib
+    links:
+    - addrindexrs
+    - unobtanium:bitcoind
+    volumes:
+    - {src}/unoparty-lib:/unoparty-lib:rw
+    - unoparty-data:/root/.local/share/unoparty:rw
+version: '2.0'
+volumes:
+  addrindexrs-data: {{}}
+  unoparty-data: {{}}
+"""
+
+# as written by docker compose 2.x (long syntax)
+RENDERED_V2 = """name: federatednode
+services:
+  mongodb:
+    image: mongo:3.2
+    ports:
+      - mode: ingress
+        host_ip: 127.0.0.1
+        target: 27017
+        published: "27017"
+        protocol: tcp
+    volumes:
+      - type: volume
+        source: mongodb-data
+        target: /data/db
+        volume: {{}}
+      - type: bind
+        source: {root}/config/mongodb
+        target: /etc/mongo
+  unoblock:
+    build:
+      context: {src}/unoblock
+      dockerfile: Dockerfile
+    depends_on:
+      mongodb:
+        condition: service_started
+        required: true
+    image: federatednode-unoblock
+    ports:
+      - mode: ingress
+        target: 4420
+        published: "4420"
+        protocol: tcp
+volumes:
+  mongodb-data:
+    name: federatednode_mongodb-data
+"""
+
+
+def as_strings(value):
+    """parse_yaml() keeps all scalars as strings; do the same to what PyYAML parsed"""
+    if isinstance(value, dict):
+        return {key: as_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [as_strings(item) for item in value]
+    return value if value is None or isinstance(value, str) else str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def render(template):
+    return template.format(root=fednode.SCRIPTDIR, src=os.path.join(fednode.SCRIPTDIR, "src"))
+
+
+class ParseYAMLTest(unittest.TestCase):
+    def test_wrapped_scalars(self):
+        service = fednode.parse_yaml(render(RENDERED_V1))['services']['addrindexrs']
+        self.assertEqual(service['command'], "cargo run --release -- -vvvv --db-dir /home/user/db --daemon-dir "
+                                             "/root/.unobtanium --jsonrpc-import")
+        self.assertEqual(service['environment']['NOTE'], "a single-quoted value that is long enough to be wrapped "
+                                                         "onto the next line, with an 'escaped' quote")
+        self.assertEqual(service['environment']['ESCAPED'], "a double-quoted value with a tab\t that is wrapped with "
+                                                            "an escaped line break")
+        self.assertEqual(service['environment']['ADDRINDEXRS_TXID_LIMIT'], "15000")
+
+    def test_matches_pyyaml(self):
+        try:
+            import yaml
+        except ImportError:
+            self.skipTest("PyYAML is not installed")
+        for template in (RENDERED_V1, RENDERED_V2):
+            self.assertEqual(fednode.parse_yaml(render(template)), as_strings(yaml.safe_load(render(template))))
+
+
+class ComposeModelTest(unittest.TestCase):
+    def test_short_syntax(self):
+        model = fednode.build_compose_model(fednode.parse_yaml(render(RENDERED_V1)))
+        self.assertEqual(model['volumes'], ['addrindexrs-data', 'unoparty-data'])
+        self.assertEqual(model['services']['addrindexrs'], {'links': [], 'ports': [8122], 'volumes': ['addrindexrs-data'],
+                                                            'sources': ['addrindexrs'], 'image': None})
+        self.assertEqual(model['services']['redis']['ports'], [6379])
+        self.assertEqual(model['services']['redis']['image'], "redis:3.2")
+        self.assertEqual(model['services']['unoparty']['links'], ['addrindexrs', 'unobtanium'])
+        self.assertEqual(model['services']['unoparty']['sources'], ['unoparty-lib'])
+
+    def test_long_syntax(self):
+        model = fednode.build_compose_model(fednode.parse_yaml(render(RENDERED_V2)))
+        self.assertEqual(model['services']['mongodb'], {'links': [], 'ports': [27017], 'volumes': ['mongodb-data'],
+                                                        'sources': [], 'image': "mongo:3.2"})
+        self.assertEqual(model['services']['unoblock'], {'links': ['mongodb'], 'ports': [4420], 'volumes': [],
+                                                         'sources': ['unoblock'], 'image': None})
+
+
+class ComposeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.compose_path = os.path.join(self.dir, "docker-compose.base.yml")
+        self.env_path = os.path.join(self.dir, "addrindexrs.env")
+        with open(self.compose_path, 'w') as f:
+            f.write("services:\n  addrindexrs:\n    env_file: ./addrindexrs.env\n")
+        with open(self.env_path, 'w') as f:
+            f.write("ADDRINDEXRS_TXID_LIMIT=15000\n")
+        self.renders = []
+        patches = [mock.patch.object(fednode, 'FEDNODE_CACHE_DIR', os.path.join(self.dir, "cache")),
+                   mock.patch.object(fednode, 'COMPOSE_MODELS', {}),
+                   mock.patch.object(fednode, 'ensure_active_configs'),
+                   mock.patch.object(fednode, 'traced_check_output', side_effect=self.docker_compose_config)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def docker_compose_config(self, cmd, **kwargs):
+        self.renders.append(cmd)
+        return render(RENDERED_V1).encode("utf-8")
+
+    def get_model(self):
+        fednode.COMPOSE_MODELS.clear()  # (as in a new run)
+        return fednode.get_compose_model(self.compose_path)
+
+    def test_rendered_once_per_change(self):
+        self.assertEqual(self.get_model()['services']['addrindexrs']['ports'], [8122])
+        self.assertEqual(self.get_model()['services']['addrindexrs']['ports'], [8122])
+        self.assertEqual(fednode.render_compose_file(self.compose_path), fednode.render_compose_file(self.compose_path))
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.renders[0][-1], "config")
+        with open(self.env_path, 'a') as f:  # (docker-compose config includes the env_files' contents)
+            f.write("ADDRINDEXRS_NETWORK=mainnet\n")
+        self.get_model()
+        self.assertEqual(len(self.renders), 2)
+        with mock.patch.dict(os.environ, {'HOSTNAME_BASE': "elsewhere"}):
+            self.get_model()
+        self.assertEqual(len(self.renders), 3)
+        self.assertEqual(len(os.listdir(os.path.join(self.dir, "cache", "compose"))), 2)  # (older renders are pruned)
+
+    def test_render_failure(self):
+        error = subprocess.CalledProcessError(1, "docker-compose", stderr=b"build path /src/addrindexrs does not exist")
+        with mock.patch.object(fednode, 'traced_check_output', side_effect=error), mock.patch('sys.stdout') as stdout:
+            with self.assertRaises(SystemExit):
+                self.get_model()
+            printed = "".join(call.args[0] for call in stdout.write.call_args_list)
+            self.assertIn("build path /src/addrindexrs does not exist", printed)
+            with mock.patch.object(fednode, 'DOCKER_CONFIG_PATH', self.compose_path):
+                self.assertEqual(fednode.get_rendered_compose_file(), self.compose_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "extras", "benchmark"))
+import fednode  # noqa: E402
+import docker_api_stub  # noqa: E402
+import stub  # noqa: E402
+
+
+class DockerClientTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.dir, "docker.sock")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def start(self, **kwargs):
+        self.server = docker_api_stub.start_docker_api_stub(self.socket_path, **kwargs)
+        self.client = fednode.DockerClient(self.socket_path, timeout=5)
+
+    def test_inspect_reuses_one_connection(self):
+        self.start(containers=['federatednode_unoparty_1'])
+        self.assertTrue(self.client.ping())
+        for i in range(5):
+            info = self.client.inspect_container('federatednode_unoparty_1')
+            self.assertEqual(info['Name'], '/federatednode_unoparty_1')
+            self.assertTrue(info['State']['Running'])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests[-1], ('GET', '/containers/federatednode_unoparty_1/json'))
+
+    def test_reconnects_when_idle_connection_is_dropped(self):
+        self.start(containers=['federatednode_unoparty_1'], drop_idle=True)
+        for i in range(3):
+            self.assertEqual(self.client.inspect_container('federatednode_unoparty_1')['Name'], '/federatednode_unoparty_1')
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_not_found(self):
+        self.start(containers=['federatednode_unoparty_1'])
+        self.assertIsNone(self.client.inspect_container('federatednode_missing_1'))
+        self.assertIsNone(self.client.inspect_image('no/such:image'))
+        with self.assertRaises(fednode.DockerAPIError) as raised:
+            self.client.start('federatednode_missing_1')
+        self.assertEqual(raised.exception.status, 404)
+        self.assertIn("No such container", str(raised.exception))
+        self.assertEqual(self.server.connections, 1)  # (error responses don't cost the keep-alive connection)
+
+    def test_stop_and_start(self):
+        self.start(containers=['federatednode_unoparty_1'])
+        self.client.stop('federatednode_unoparty_1')
+        self.assertFalse(self.client.inspect_container('federatednode_unoparty_1')['State']['Running'])
+        self.client.start('federatednode_unoparty_1')
+        self.assertTrue(self.client.inspect_container('federatednode_unoparty_1')['State']['Running'])
+        self.assertIn(('POST', '/containers/federatednode_unoparty_1/stop'), self.server.requests)
+
+    def test_connection_class_is_built_once(self):
+        self.start()
+        first = fednode.unix_http_connection(self.socket_path)
+        second = fednode.unix_http_connection(os.path.join(self.dir, "other.sock"))
+        self.assertIs(type(first), type(second))
+        self.assertEqual((first.socket_path, second.socket_path), (self.socket_path, os.path.join(self.dir, "other.sock")))
+
+
+class ServicesStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.dir, "docker.sock")
+        self.state_dir = os.path.join(self.dir, "state")
+        self.server = docker_api_stub.start_docker_api_stub(self.socket_path, state_dir=self.state_dir, containers={
+            'federatednode_unoparty_1': "unoblock/unoparty:develop", 'federatednode_redis_1': "redis"})
+        self.client = fednode.DockerClient(self.socket_path, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def add_image(self, image, image_id, repo_digests):
+        os.makedirs(os.path.dirname(stub.image_path(image)), exist_ok=True)
+        with open(stub.image_path(image), 'w') as f:
+            json.dump({'Id': image_id, 'RepoTags': [image], 'RepoDigests': repo_digests}, f)
+
+    def test_reports_the_digest_pull_compares(self):
+        self.add_image("unoblock/unoparty:develop", "sha256:" + "1" * 64,
+                       ["mirror.example.com/unoblock/unoparty@sha256:" + "a" * 64, "unoblock/unoparty@sha256:" + "b" * 64])
+        with mock.patch.object(fednode, 'DOCKER_CLIENT', self.client), \
+                mock.patch.object(fednode, 'FEDNODE_CACHE_DIR', os.path.join(self.dir, "cache")), \
+                mock.patch.object(fednode, 'get_compose_services', return_value=['unoparty', 'redis', 'unobtanium']):
+            statuses = {status['service']: status for status in fednode.get_services_status('base', max_age=0)}
+        self.assertEqual(statuses['unoparty']['image'], "sha256:" + "1" * 64)
+        self.assertEqual(statuses['unoparty']['digest'], "sha256:" + "b" * 64)  # (the one for the image's own repository)
+        self.assertTrue(statuses['redis']['image'].startswith("sha256:"))
+        self.assertIsNone(statuses['redis']['digest'])  # (built locally or never pulled: no digest)
+        self.assertEqual(statuses['unobtanium']['state'], 'missing')
+        image_requests = [path for method, path in self.server.requests if path.startswith('/images/')]
+        self.assertEqual(len(image_requests), 2)  # (one inspect per distinct image)
+
+
+if __name__ == '__main__':
+    unittest.main()
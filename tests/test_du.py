@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+class ScanVolumeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.volume = os.path.join(self.dir, "volume")
+        os.makedirs(os.path.join(self.volume, "db"))
+        patcher = mock.patch.object(fednode, 'FEDNODE_CACHE_DIR', os.path.join(self.dir, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, rel_path, size, mode='wb', age=0):
+        path = os.path.join(self.volume, rel_path)
+        with open(path, mode) as f:
+            f.write(os.urandom(size))
+        if age:
+            os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_unchanged_dirs_come_from_the_cache(self):
+        self.write("db/collection-0.wt", 4096)
+        self.write("top.log", 8192)
+        first = fednode.scan_volume(self.volume, jobs=2)
+        self.assertEqual((first['files'], first['dirs'], first['cached_dirs']), (2, 2, 0))
+        self.assertGreaterEqual(first['size'], 4096 + 8192)
+        second = fednode.scan_volume(self.volume, jobs=2)
+        self.assertEqual((second['size'], second['files'], second['cached_dirs']), (first['size'], 2, 2))
+
+        os.remove(os.path.join(self.volume, "db", "collection-0.wt"))
+        self.write("db/collection-1.wt", 16384)
+        third = fednode.scan_volume(self.volume, jobs=2)
+        self.assertEqual((third['files'], third['cached_dirs']), (2, 1))
+        self.assertEqual(fednode.scan_volume(self.volume, full=True)['cached_dirs'], 0)
+
+    def test_old_file_growing_in_place(self):
+        # a file last written 3 days ago (e.g. the database of a service that was down), then appended to
+        path = self.write("db/collection-0.wt", 4096, age=3 * 86400)
+        first = fednode.scan_volume(self.volume)
+        old_size = os.stat(path).st_blocks * 512
+        dir_mtime = os.stat(os.path.join(self.volume, "db")).st_mtime_ns
+        self.write("db/collection-0.wt", 10 * 1024 * 1024, mode='ab')
+        self.assertEqual(os.stat(os.path.join(self.volume, "db")).st_mtime_ns, dir_mtime)
+        second = fednode.scan_volume(self.volume)
+        self.assertEqual(second['cached_dirs'], 2)
+        self.assertEqual(second['size'] - first['size'], os.stat(path).st_blocks * 512 - old_size)
+        self.assertGreaterEqual(second['size'], 10 * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
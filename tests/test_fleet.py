@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fednode  # noqa: E402
+
+# stands in for fednode.py in each node's checkout: logs when it ran, then answers `status --json` for its node
+NODE_SCRIPT = '''import os, sys, json, time
+node = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+started = time.time()
+time.sleep(0.2)
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runs.log"), "a") as f:
+    f.write(json.dumps([node, sys.argv[1:], started, time.time()]) + "\\n")
+if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "broken")):
+    print("Cannot connect to the docker daemon")
+    sys.exit(2)
+print("Generating the config files from the defaults")
+print(json.dumps([{"service": "unoparty", "state": "running", "health": "healthy", "restarts": 0, "uptime": 60,
+                   "node": node}], indent=2))
+'''
+
+
+class LocalFleetTest(unittest.TestCase):
+    nodes = ['node1', 'node2', 'node3', 'node4', 'node5']
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp, "fleet.ini"), 'w') as f:
+            f.write("[DEFAULT]\ntransport = local\n")
+            for name in self.nodes:
+                os.makedirs(os.path.join(self.tmp, name))
+                with open(os.path.join(self.tmp, name, "fednode.py"), 'w') as script:
+                    script.write(NODE_SCRIPT)
+                f.write("\n[{}]\npath = {}\n".format(name, os.path.join(self.tmp, name)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read_runs(self):
+        with open(os.path.join(self.tmp, "runs.log")) as f:
+            return {run[0]: run for run in (json.loads(line) for line in f)}
+
+    def run_fleet(self, **kwargs):
+        nodes = fednode.read_fleet_inventory(os.path.join(self.tmp, "fleet.ini"))
+        return fednode.run_fleet(nodes, fednode.FLEET_COMMANDS['status'], progress=io.StringIO(), **kwargs)
+
+    def test_transport_is_abstract(self):
+        self.assertRaises(TypeError, fednode.FleetTransport, 'node1', {})
+        nodes = fednode.read_fleet_inventory(os.path.join(self.tmp, "fleet.ini"), ['node2'])
+        self.assertIsInstance(nodes[0], fednode.LocalTransport)
+        self.assertEqual(nodes[0].command(['status']), [sys.executable, os.path.join(self.tmp, 'node2', "fednode.py"), 'status'])
+
+    def test_fans_out_and_aggregates_json(self):
+        results = self.run_fleet(jobs=len(self.nodes))
+        self.assertEqual([result['node'] for result in results], self.nodes)  # (inventory order)
+        runs = self.read_runs()
+        self.assertEqual(sorted(runs), self.nodes)
+        self.assertTrue(all(run[1] == ['status', '--json'] for run in runs.values()))
+        # all at once: every node started before any finished
+        self.assertLess(max(run[2] for run in runs.values()), min(run[3] for run in runs.values()))
+        for result in results:
+            self.assertEqual((result['state'], result['returncode']), ('ok', 0))
+            self.assertEqual(result['data'][0]['node'], result['node'])
+            self.assertEqual(result['output'], "Generating the config files from the defaults")
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            fednode.print_fleet_results('status', results, 1.5, as_json=True)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['command'], report['elapsed']), ('status', 1.5))
+        self.assertEqual([node['node'] for node in report['nodes']], self.nodes)
+        self.assertEqual([node['data'][0]['service'] for node in report['nodes']], ['unoparty'] * len(self.nodes))
+
+    def test_rolling_batches(self):
+        results = self.run_fleet(rolling=2)
+        self.assertEqual([result['state'] for result in results], ['ok'] * len(self.nodes))
+        runs = self.read_runs()
+        batches = [self.nodes[i:i + 2] for i in range(0, len(self.nodes), 2)]
+        for batch, next_batch in zip(batches, batches[1:]):
+            # a batch only starts once the one before it is done
+            self.assertLessEqual(max(runs[name][3] for name in batch), min(runs[name][2] for name in next_batch))
+        self.assertLess(max(runs[name][2] for name in batches[0]), min(runs[name][3] for name in batches[0]))
+
+    def test_rolling_stops_after_a_failed_batch(self):
+        open(os.path.join(self.tmp, 'node2', "broken"), 'w').close()
+        results = self.run_fleet(rolling=2)
+        self.assertEqual([result['state'] for result in results], ['ok', 'failed', 'skipped', 'skipped', 'skipped'])
+        self.assertEqual(results[1]['returncode'], 2)
+        self.assertIsNone(results[1]['data'])
+        self.assertEqual(sorted(self.read_runs()), ['node1', 'node2'])
+
+        os.remove(os.path.join(self.tmp, "runs.log"))
+        results = self.run_fleet(rolling=2, keep_going=True)
+        self.assertEqual([result['state'] for result in results], ['ok', 'failed', 'ok', 'ok', 'ok'])
+        self.assertEqual(sorted(self.read_runs()), self.nodes)
+
+    def test_timeout(self):
+        results = self.run_fleet(jobs=2, timeout=0.05)
+        self.assertEqual({result['state'] for result in results}, {'timeout'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+def api_stats(total_usage, system_usage, mem=1024):
+    return {'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': system_usage, 'online_cpus': 2},
+            'precpu_stats': {'cpu_usage': {'total_usage': 0}, 'system_cpu_usage': 1},
+            'memory_stats': {'usage': mem, 'stats': {}}, 'blkio_stats': {}, 'networks': {}}
+
+
+class FakeClient:
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def stats(self, name):
+        stream = self.streams.pop(0)
+        if isinstance(stream, Exception):
+            raise stream
+        for stats in stream:
+            if isinstance(stats, Exception):
+                raise stats
+            yield stats
+
+
+class MetricsCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.collector = fednode.MetricsCollector(['unoparty', 'redis'])
+        stderr = mock.patch('sys.stderr')
+        self.stderr = stderr.start()
+        self.addCleanup(stderr.stop)
+
+    def metric(self, name, service):
+        for line in self.collector.prometheus_text().splitlines():
+            if line.startswith('{}{{service="{}"}} '.format(name, service)):
+                return float(line.split()[-1])
+        return None
+
+    def test_api_malformed_sample_is_skipped(self):
+        malformed = {'precpu_stats': {'system_cpu_usage': 1}, 'cpu_stats': None}
+        client = FakeClient([[api_stats(50, 101), malformed, api_stats(80, 101)]])
+        self.collector.collect_api_once(client, 'unoparty')
+        self.assertEqual(len(self.collector.samples['unoparty']), 2)
+        self.assertEqual(self.collector.up['unoparty'], 0)  # (the stream ended: the container stopped)
+        self.assertIsNotNone(self.metric('fednode_collector_last_sample_timestamp_seconds', 'unoparty'))
+        self.assertIsNone(self.metric('fednode_collector_last_sample_timestamp_seconds', 'redis'))
+
+    def test_api_errors_mark_the_service_down_and_are_logged_once(self):
+        client = FakeClient([iter([api_stats(50, 101), ValueError("garbled stats stream")]),
+                             ValueError("garbled stats stream"), ConnectionRefusedError("no daemon")])
+        for i in range(3):
+            self.collector.collect_api_once(client, 'unoparty')
+        self.assertEqual(self.metric('fednode_collector_up', 'unoparty'), 0)
+        self.assertEqual(len(self.collector.samples['unoparty']), 1)
+        logged = "".join(call.args[0] for call in self.stderr.write.call_args_list)
+        self.assertEqual(logged.count("garbled stats stream"), 1)
+        self.assertEqual(logged.count("no daemon"), 1)
+
+    def test_api_up_while_streaming(self):
+        def stats():
+            yield api_stats(50, 101)
+            self.assertEqual(self.metric('fednode_collector_up', 'unoparty'), 1)
+        self.collector.collect_api_once(FakeClient([stats()]), 'unoparty')
+
+    def test_cli_failure_without_output(self):
+        error = subprocess.CalledProcessError(1, "docker stats", output=None)
+        with mock.patch.object(fednode, 'traced_check_output', side_effect=error), \
+                mock.patch.object(fednode, 'get_sudo_cmd', return_value="sudo"):
+            self.collector.collect_cli_once()
+        self.assertEqual(self.collector.up, {'unoparty': 0, 'redis': 0})
+
+    def test_cli_malformed_line_is_skipped(self):
+        line = json.dumps({'Name': 'federatednode_unoparty_1', 'CPUPerc': "12.5%", 'MemUsage': "1MiB / 2GiB",
+                           'NetIO': "1kB / 2kB", 'BlockIO': "0B / 0B"})
+        output = "{}\n{{not json\n{}\n".format(line, json.dumps(["a list"])).encode("utf-8")
+        with mock.patch.object(fednode, 'traced_check_output', return_value=output), \
+                mock.patch.object(fednode, 'get_sudo_cmd', return_value="sudo"):
+            self.collector.collect_cli_once()
+        self.assertEqual(self.collector.up, {'unoparty': 1, 'redis': 0})
+        self.assertEqual(self.collector.summary('unoparty')['cpu'], 12.5)
+        self.assertEqual(self.metric('fednode_collector_up', 'unoparty'), 1)
+        self.assertEqual(self.metric('fednode_collector_up', 'redis'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import configparser
+from unittest import mock
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+def add_blocks(path, last_block, journal_mode='wal'):
+    """Create (or extend) a fixture unoparty database that has parsed up to last_block"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = {}".format(journal_mode))
+    conn.execute("CREATE TABLE IF NOT EXISTS blocks (block_index INTEGER PRIMARY KEY, block_hash TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS balances (address TEXT, asset TEXT, quantity INTEGER, block_index INTEGER)")
+    first = (conn.execute("SELECT MAX(block_index) FROM blocks").fetchone()[0] or 0) + 1
+    conn.execute("BEGIN")
+    for block_index in range(first, last_block + 1):
+        conn.execute("INSERT INTO blocks VALUES (?, ?)", (block_index, "{:064x}".format(block_index)))
+        conn.execute("INSERT INTO balances VALUES (?, 'XUP', ?, ?)", ("address{}".format(block_index % 5), block_index, block_index))
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def journal_mode(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def copy_as_reflink(src, dst):
+    shutil.copyfile(src, dst)
+    return True
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.volume = os.path.join(self.dir, "unoparty-data")
+        os.mkdir(self.volume)
+        self.db_path = os.path.join(self.volume, "unoparty.db")
+        self.snapshot_dir = os.path.join(self.dir, "fednode-snapshots", "unoparty")
+        self.calls = []
+        patcher = mock.patch.object(fednode, 'reflink_copy', return_value=False)  # (as on ext4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create(self, min_blocks=0):
+        with redirect_stdout(io.StringIO()):
+            return fednode.create_snapshot(self.db_path, self.snapshot_dir, lambda: self.calls.append('stop'),
+                                           lambda: self.calls.append('start'), min_blocks)
+
+    def test_create_with_backup(self):
+        add_blocks(self.db_path, 120)
+        snapshot = self.create()
+        self.assertEqual(snapshot['path'], os.path.join(self.snapshot_dir, "0000000120"))
+        self.assertEqual(self.calls, [])  # (the online backup doesn't need the service stopped)
+        with open(os.path.join(snapshot['path'], fednode.SNAPSHOT_MANIFEST)) as f:
+            manifest = json.load(f)
+        self.assertEqual((manifest['block_index'], manifest['method'], manifest['journal_mode']), (120, 'backup', 'wal'))
+        copy_path = os.path.join(snapshot['path'], "unoparty.db")
+        self.assertEqual(manifest['files'], {'unoparty.db': {'size': os.path.getsize(copy_path), 'sha256': fednode.file_sha256(copy_path)}})
+        self.assertEqual(journal_mode(copy_path), 'delete')  # (self-contained: no -wal file to go with it)
+        self.assertEqual(sorted(os.listdir(snapshot['path'])), [fednode.SNAPSHOT_MANIFEST, "unoparty.db"])
+        self.assertEqual([item['block_index'] for item in fednode.list_snapshots(self.snapshot_dir)], [120])
+
+        self.assertIsNone(self.create())  # (no new blocks)
+        add_blocks(self.db_path, 150)
+        self.assertIsNone(self.create(min_blocks=100))
+        self.assertEqual(self.create(min_blocks=30)['block_index'], 150)
+        self.assertEqual(sorted(os.listdir(self.snapshot_dir)), ["0000000120", "0000000150"])  # (no leftover .tmp dirs)
+
+    def test_create_with_reflink(self):
+        add_blocks(self.db_path, 50)
+        with mock.patch.object(fednode, 'reflink_copy', side_effect=copy_as_reflink):
+            snapshot = self.create()
+        self.assertEqual((snapshot['method'], snapshot['block_index']), ('reflink', 50))
+        self.assertEqual(self.calls, ['stop', 'start'])
+        self.assertEqual(fednode.verify_snapshot(snapshot), [])
+        self.assertEqual(sorted(os.listdir(snapshot['path'])), [fednode.SNAPSHOT_MANIFEST, "unoparty.db"])
+
+    def test_verify_catches_corruption(self):
+        add_blocks(self.db_path, 80)
+        snapshot = self.create()
+        self.assertEqual(fednode.verify_snapshot(snapshot), [])
+        copy_path = os.path.join(snapshot['path'], "unoparty.db")
+        with open(copy_path, 'r+b') as f:
+            f.seek(os.path.getsize(copy_path) // 2)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xff]))
+        self.assertEqual(fednode.verify_snapshot(snapshot), ["unoparty.db has the wrong checksum"])
+        with open(copy_path, 'ab') as f:
+            f.write(b'\0')
+        self.assertEqual(fednode.verify_snapshot(snapshot), ["unoparty.db has the wrong size"])
+        os.remove(copy_path)
+        self.assertEqual(fednode.verify_snapshot(snapshot), ["unoparty.db is missing"])
+
+    def test_restore(self):
+        add_blocks(self.db_path, 100)
+        snapshot = self.create()
+        add_blocks(self.db_path, 140)
+        stat = os.stat(self.db_path)
+        fednode.restore_snapshot(snapshot, self.volume)
+        self.assertEqual(fednode.db_block_index(self.db_path), 100)
+        self.assertEqual(journal_mode(self.db_path), 'wal')
+        self.assertEqual(os.stat(self.db_path).st_mode, stat.st_mode)
+        self.assertFalse(os.path.exists(self.db_path + ".restore"))
+        self.assertFalse(os.path.exists(self.db_path + "-wal"))
+        # the restored database is written to, while the snapshot stays as it was
+        add_blocks(self.db_path, 110)
+        self.assertEqual(fednode.verify_snapshot(snapshot), [])
+
+    def test_rollback_picks_the_newest_snapshot_before_the_block(self):
+        for last_block in (100, 200, 300):
+            add_blocks(self.db_path, last_block)
+            self.create()
+        add_blocks(self.db_path, 350)
+        config = configparser.ConfigParser()
+        config.read_dict({'Default': {'snapshot_dir': os.path.dirname(self.snapshot_dir)}})
+        with mock.patch.object(fednode, 'get_docker_volume_path', return_value=self.volume), \
+                mock.patch.object(fednode, 'run_compose_cmd') as run_compose_cmd, redirect_stdout(io.StringIO()):
+            self.assertEqual(fednode.rollback_from_snapshot(config, 'unoparty', 250)['block_index'], 200)
+            self.assertEqual(fednode.db_block_index(self.db_path), 200)
+            run_compose_cmd.assert_called_once_with("stop unoparty")
+
+            os.remove(os.path.join(self.snapshot_dir, "0000000100", "unoparty.db"))
+            self.assertIsNone(fednode.rollback_from_snapshot(config, 'unoparty', 150))  # (not restoring a broken snapshot)
+            self.assertIsNone(fednode.rollback_from_snapshot(config, 'unoparty', 50))
+        self.assertEqual(fednode.db_block_index(self.db_path), 200)
+        self.assertEqual(run_compose_cmd.call_count, 1)
+
+
+class PruneSnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_snapshots(self, block_indexes):
+        for block_index in block_indexes:
+            path = os.path.join(self.dir, "{:010d}".format(block_index))
+            os.mkdir(path)
+            with open(os.path.join(path, fednode.SNAPSHOT_MANIFEST), 'w') as f:
+                json.dump({'block_index': block_index, 'created': 0, 'method': 'backup', 'files': {}}, f)
+        os.mkdir(os.path.join(self.dir, ".tmp.1234"))  # (an unfinished snapshot)
+        return fednode.list_snapshots(self.dir)
+
+    def kept(self):
+        return [snapshot['block_index'] for snapshot in fednode.list_snapshots(self.dir)]
+
+    def test_retention_policy(self):
+        snapshots = self.make_snapshots([50, 120, 150, 180, 250, 320, 350, 390, 410])
+        pruned = fednode.prune_snapshots(snapshots, keep_last=2, keep_every=100, keep_sparse=3)
+        # the 2 newest, plus the oldest of each of the 3 newest 100-block intervals (200s, 300s, 400s)
+        self.assertEqual(self.kept(), [250, 320, 390, 410])
+        self.assertEqual([snapshot['block_index'] for snapshot in pruned], [50, 120, 150, 180, 350])
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, ".tmp.1234")))
+        self.assertEqual(fednode.prune_snapshots(fednode.list_snapshots(self.dir), 2, 100, 3), [])
+
+    def test_no_sparse_retention(self):
+        snapshots = self.make_snapshots([100, 200, 300, 400])
+        fednode.prune_snapshots(snapshots, keep_last=1, keep_every=0, keep_sparse=10)
+        self.assertEqual(self.kept(), [400])
+
+    def test_keep_last_zero(self):
+        snapshots = self.make_snapshots([100, 200, 300])
+        fednode.prune_snapshots(snapshots, keep_last=0, keep_every=1000, keep_sparse=1)
+        self.assertEqual(self.kept(), [100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "extras", "benchmark"))
+import fednode  # noqa: E402
+import sync_stub  # noqa: E402
+
+
+class SyncMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = sync_stub.start_sync_stub(1000, {'unobtanium': 990, 'addrindexrs': 900, 'unoparty': 800}, rate=200.0)
+        self.clients = {
+            'unobtanium': fednode.JSONRPCClient('127.0.0.1', self.stub.ports['unobtanium'], timeout=5),
+            'addrindexrs': fednode.LineJSONRPCClient('127.0.0.1', self.stub.ports['addrindexrs'], timeout=5),
+            'unoparty': fednode.JSONRPCClient('127.0.0.1', self.stub.ports['unoparty'], path='/api/', timeout=5),
+        }
+        self.monitor = fednode.SyncMonitor({'mainnet': self.clients})
+
+    def tearDown(self):
+        self.monitor.close()
+        self.stub.stop()
+
+    def test_heights_lag_and_rate(self):
+        first = {row['layer']: row for row in self.monitor.poll()}
+        self.assertEqual(first['unobtanium']['target'], 1000)
+        self.assertGreaterEqual(first['unobtanium']['height'], 990)
+        self.assertEqual(first['addrindexrs']['target'], first['unobtanium']['height'])  # (indexers chase unobtanium)
+        self.assertEqual(first['unoparty']['lag'], first['unoparty']['target'] - first['unoparty']['height'])
+        self.assertIsNone(first['unoparty']['rate'])
+        time.sleep(0.2)
+        second = {row['layer']: row for row in self.monitor.poll()}
+        self.assertGreater(second['unoparty']['height'], first['unoparty']['height'])
+        self.assertGreater(second['unoparty']['rate'], 0)
+        self.assertAlmostEqual(second['unoparty']['eta'], second['unoparty']['lag'] / second['unoparty']['rate'])
+        calls = [method for layer, method in self.stub.chain.calls]
+        self.assertEqual(sorted(set(calls)), ['blockchain.headers.subscribe', 'get_running_info', 'getblockchaininfo'])
+
+    def test_caught_up(self):
+        time.sleep(1.1)  # (200 blocks/s: every layer reaches the tip)
+        rows = {row['layer']: row for row in self.monitor.poll()}
+        for layer in ('unobtanium', 'addrindexrs', 'unoparty'):
+            self.assertEqual((rows[layer]['height'], rows[layer]['lag'], rows[layer]['eta']), (1000, 0, 0))
+
+    def test_a_layer_down(self):
+        self.stub.stop('addrindexrs')
+        rows = {row['layer']: row for row in self.monitor.poll()}
+        self.assertIsNone(rows['addrindexrs']['height'])
+        self.assertIsNotNone(rows['unobtanium']['height'])
+        self.assertIsNotNone(rows['unoparty']['height'])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            self.clients['addrindexrs'].call('server.version')
+
+
+class SyncClientsTest(unittest.TestCase):
+    def test_addrindexrs_port_from_compose_model(self):
+        model = {'services': {'addrindexrs': {'ports': [8122]}, 'addrindexrs-testnet': {'ports': [28122]}}, 'volumes': []}
+        with mock.patch.object(fednode, 'get_compose_model', return_value=model):
+            self.assertEqual(fednode.get_sync_clients('mainnet')['addrindexrs'].port, 8122)
+            self.assertEqual(fednode.get_sync_clients('testnet')['addrindexrs'].port, 28122)
+        with mock.patch.object(fednode, 'get_compose_model', return_value={'services': {}, 'volumes': []}):
+            self.assertEqual(fednode.get_sync_clients('testnet')['addrindexrs'].port, 18122)
+
+
+if __name__ == '__main__':
+    unittest.main()
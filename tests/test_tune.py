@@ -0,0 +1,93 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+class SetConfigValueTest(unittest.TestCase):
+    def test_yaml_adds_nested_key(self):
+        text = fednode.set_config_value("storage:\n  dbPath: /data/db\n", 'storage.wiredTiger.engineConfig.cacheSizeGB', 3, 'yaml')
+        self.assertEqual(text, "storage:\n  dbPath: /data/db\n  wiredTiger:\n    engineConfig:\n      cacheSizeGB: 3\n")
+
+    def test_yaml_replaces_existing_key(self):
+        text = "storage:\n  wiredTiger:\n    engineConfig:\n      cacheSizeGB: 1\nnet:\n  port: 27017\n"
+        self.assertEqual(fednode.set_config_value(text, 'storage.wiredTiger.engineConfig.cacheSizeGB', 3, 'yaml'),
+                         text.replace("cacheSizeGB: 1", "cacheSizeGB: 3"))
+
+    def test_yaml_refuses_flow_mapping(self):
+        with self.assertRaises(ValueError):
+            fednode.set_config_value("storage: {dbPath: /data/db}\n", 'storage.wiredTiger.engineConfig.cacheSizeGB', 3, 'yaml')
+
+    def test_redis_uses_space(self):
+        self.assertEqual(fednode.set_config_value("maxmemory-policy volatile-lru\n", 'maxmemory', '64mb', 'redis'),
+                         "maxmemory-policy volatile-lru\nmaxmemory 64mb\n")
+        self.assertEqual(fednode.set_config_value("maxmemory 2gb\n", 'maxmemory', '64mb', 'redis'), "maxmemory 64mb\n")
+
+    def test_bitcoin_adds_before_sections(self):
+        self.assertEqual(fednode.set_config_value("testnet=1\n\n[test]\nrpcport=65531\n", 'par', 4, 'bitcoin'),
+                         "testnet=1\npar=4\n\n[test]\nrpcport=65531\n")
+
+    def test_ini_needs_one_section(self):
+        self.assertEqual(fednode.set_config_value("[Default]\na=1\n", 'b', 2, 'ini'), "[Default]\na=1\nb=2\n")
+        with self.assertRaises(ValueError):
+            fednode.set_config_value("[A]\na=1\n[B]\nb=1\n", 'c', 3, 'ini')
+
+
+
+class TunedProfileTest(unittest.TestCase):
+    def cache_sizes(self, build_config, memory_mb, disk='ssd'):
+        """The MB each cache takes with the tuned profile (mongodb's own default size if its setting is left out)"""
+        sizes = {'mongodb': max(0.5 * (memory_mb - 1024), 256)} if build_config in ('unoblock', 'full') else {}
+        for dirname, filename, values in fednode.get_tuned_profile(build_config, {'cores': 2, 'memory_mb': memory_mb, 'disk': disk}):
+            if 'dbcache' in values:
+                sizes[filename] = values['dbcache']
+            elif dirname == 'redis':
+                sizes['redis'] = int(values['maxmemory'][:-len("mb")])
+            elif dirname == 'mongodb':
+                sizes['mongodb'] = values['storage.wiredTiger.engineConfig.cacheSizeGB'] * 1024
+        return sizes
+
+    def test_caches_stay_within_the_budget(self):
+        for memory_mb in (1024, 2048, 4096):
+            for build_config in ('base', 'unoblock', 'full'):
+                for disk in ('ssd', 'hdd'):
+                    sizes = self.cache_sizes(build_config, memory_mb, disk)
+                    self.assertLessEqual(sum(sizes.values()), memory_mb * fednode.TUNE_MEMORY_BUDGET, (build_config, memory_mb, disk, sizes))
+                    self.assertGreater(sizes['unobtanium.conf'], sizes['unobtanium.testnet.conf'])
+        self.assertEqual(set(self.cache_sizes('base_extbtc', 1024)), set())
+
+    def test_mongodb_cache_size_only_when_smaller_than_its_default(self):
+        def cache_size_gb(memory_mb):
+            profile = fednode.get_tuned_profile('full', {'cores': 2, 'memory_mb': memory_mb, 'disk': 'ssd'})
+            for dirname, filename, values in profile:
+                if dirname == 'mongodb':
+                    return values['storage.wiredTiger.engineConfig.cacheSizeGB']
+        # (at 64 GB: 24% of the 32 GB budget)
+        self.assertEqual([cache_size_gb(memory_mb) for memory_mb in (1024, 2048, 4096, 65536)], [None, None, 1, 7])
+
+    def test_apply_writes_the_active_configs_only(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        shutil.copytree(os.path.join(fednode.SCRIPTDIR, 'config'), os.path.join(tmp, 'config'),
+                        ignore=lambda path, names: [name for name in names if not name.endswith('.default') and
+                                                    not os.path.isdir(os.path.join(path, name))])
+        with open(os.path.join(tmp, 'config', 'redis', 'redis.conf.default')) as f:
+            default = f.read()
+        with mock.patch.object(fednode, 'SCRIPTDIR', tmp), mock.patch.object(fednode, 'ACTIVE_CONFIGS_CHECKED', False), \
+                redirect_stdout(io.StringIO()):
+            fednode.tune('full', {'cores': 2, 'memory_mb': 4096, 'disk': 'ssd'}, apply=True)
+        with open(os.path.join(tmp, 'config', 'redis', 'redis.conf.default')) as f:
+            self.assertEqual(f.read(), default)
+        with open(os.path.join(tmp, 'config', 'redis', 'redis.conf')) as f:
+            self.assertEqual(f.read().splitlines()[0], "maxmemory 80mb")
+
+
+if __name__ == '__main__':
+    unittest.main()
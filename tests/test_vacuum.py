@@ -0,0 +1,111 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fednode  # noqa: E402
+
+
+def make_fragmented_db(path, auto_vacuum=0, rows=2000, keep_every=10):
+    """A fixture database whose pages are mostly free, as after unoparty prunes its mempool"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum = {}".format(auto_vacuum))
+    conn.execute("CREATE TABLE messages (message_index INTEGER PRIMARY KEY, category TEXT, bindings BLOB)")
+    conn.execute("CREATE INDEX messages_category ON messages (category)")
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO messages (category, bindings) VALUES (?, ?)",
+                     (("category{}".format(i % 7), b'x' * 1000) for i in range(rows)))
+    conn.execute("COMMIT")
+    conn.execute("DELETE FROM messages WHERE message_index % ? != 0", (keep_every, ))
+    conn.close()
+
+
+class DBMaintenanceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "unoparty.db")
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def stop(self):
+        self.calls.append('stop')
+
+    def start(self):
+        self.calls.append('start')
+
+    def count(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_below_threshold_only_analyzes(self):
+        make_fragmented_db(self.path, keep_every=1)
+        self.assertFalse(fednode.get_db_stats(self.path)['analyzed'])
+        fednode.db_maintenance(self.path, self.stop, self.start)
+        stats = fednode.get_db_stats(self.path)
+        self.assertTrue(stats['analyzed'])
+        self.assertEqual(self.calls, [])
+
+    def test_copy_and_swap_when_fragmented(self):
+        make_fragmented_db(self.path)
+        self.assertGreater(fednode.get_db_stats(self.path)['free_ratio'], fednode.DB_MAX_FREE_RATIO)
+        fednode.db_maintenance(self.path, self.stop, self.start)
+        stats = fednode.get_db_stats(self.path)
+        self.assertEqual(stats['freelist_count'], 0)
+        self.assertTrue(stats['analyzed'])
+        self.assertEqual(self.calls, ['stop', 'start'])
+        self.assertEqual(self.count(), 200)
+        self.assertFalse(os.path.exists(self.path + ".compact"))
+
+    def test_incremental_vacuum_without_downtime(self):
+        make_fragmented_db(self.path, auto_vacuum=2)
+        self.assertGreater(fednode.get_db_stats(self.path)['free_ratio'], fednode.DB_MAX_FREE_RATIO)
+        fednode.db_maintenance(self.path, self.stop, self.start)
+        self.assertEqual(fednode.get_db_stats(self.path)['freelist_count'], 0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.count(), 200)
+
+    def test_write_during_copy_keeps_original(self):
+        make_fragmented_db(self.path)
+        before = fednode.get_db_stats(self.path)
+
+        def stop_after_write():
+            # an UPDATE adds no row, so only a real change counter notices it
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("UPDATE messages SET category = 'updated' WHERE message_index = 10")
+            conn.close()
+            self.stop()
+
+        self.assertFalse(fednode.db_copy_and_swap(self.path, stop_after_write, self.start))
+        self.assertEqual(self.calls, ['stop', 'start'])
+        self.assertFalse(os.path.exists(self.path + ".compact"))
+        self.assertEqual(fednode.get_db_stats(self.path)['page_count'], before['page_count'])
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT category FROM messages WHERE message_index = 10").fetchone()[0], 'updated')
+        conn.close()
+
+    def test_write_during_copy_in_wal_mode(self):
+        make_fragmented_db(self.path)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.close()
+
+        def stop_after_write():
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("DELETE FROM messages WHERE message_index = 20")
+            conn.close()
+            self.stop()
+
+        self.assertFalse(fednode.db_copy_and_swap(self.path, stop_after_write, self.start))
+        self.assertEqual(self.count(), 199)
+
+
+if __name__ == '__main__':
+    unittest.main()
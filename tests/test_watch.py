@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fednode  # noqa: E402
+
+
+class WatchdogTest(unittest.TestCase):
+    """Replays event sequences (as given to `fednode watch --events`) through the watchdog"""
+    def replay(self, events, restart=True, **kwargs):
+        """Run a Watchdog over the events; returns it, with .restarts, .alerts and .messages recorded"""
+        restarts, alerts, messages = [], [], []
+
+        async def do_restart(service):
+            restarts.append((service, time.time()))
+
+        async def alert(service, kind, message):
+            alerts.append((service, kind))
+
+        with tempfile.NamedTemporaryFile('w', suffix=".jsonl", delete=False) as f:
+            f.write("# replayed by test_watch.py\n" + "".join(json.dumps(event) + "\n" for event in events))
+        self.addCleanup(os.remove, f.name)
+        watchdog = fednode.Watchdog(['unoparty', 'unobtanium'], do_restart if restart else None, alert,
+                                    log=messages.append, **kwargs)
+        handle = watchdog.handle
+        watchdog.handled = []
+        watchdog.handle = lambda event: (watchdog.handled.append(event), handle(event))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(watchdog.run(fednode.read_fake_events(f.name)))
+        finally:
+            loop.close()
+        watchdog.restarts, watchdog.alerts, watchdog.messages = restarts, alerts, messages
+        return watchdog
+
+    def failure_times(self, watchdog, actions=('die', 'oom', 'unhealthy')):
+        return [event['time'] for event in watchdog.handled if event['action'] in actions]
+
+    def test_backoff_and_max_restarts(self):
+        watchdog = self.replay([
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1},
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.02},  # (a restart is already pending)
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 137, 'after': 0.15},
+            {'service': 'unoparty', 'action': 'oom', 'after': 0.2},
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.3},
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.05},
+        ], backoff_min=0.05, backoff_max=0.1, max_restarts=3)
+        failed = self.failure_times(watchdog)
+        delays = [restarted - failed_at for (service, restarted), failed_at in zip(watchdog.restarts, [failed[0]] + failed[2:4])]
+        self.assertEqual(len(watchdog.restarts), 3)
+        for delay, expected in zip(delays, [0.05, 0.1, 0.1]):  # (doubled each time, up to backoff_max)
+            self.assertGreaterEqual(delay, expected - 0.005)
+            self.assertLess(delay, expected + 0.05)
+        self.assertEqual(watchdog.alerts, [('unoparty', 'died'), ('unoparty', 'died'), ('unoparty', 'oom'), ('unoparty', 'gave-up')])
+        self.assertEqual([message for message in watchdog.messages if 'restarting in' in message or 'giving up' in message], [
+            "unoparty: died (exit code 1); restarting in 0.05s (attempt 1)",
+            "unoparty: died (exit code 137); restarting in 0.1s (attempt 2)",
+            "unoparty: ran out of memory; restarting in 0.1s (attempt 3)",
+            "unoparty: died (exit code 1); giving up after 3 restarts",
+        ])
+        self.assertTrue(watchdog.state['unoparty']['gave_up'])
+
+    def test_start_after_giving_up(self):
+        watchdog = self.replay([
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1},
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.1},
+            {'service': 'unoparty', 'action': 'start', 'after': 0.05},  # (started by hand)
+            {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.05},
+        ], backoff_min=0.02, max_restarts=1)
+        self.assertEqual(len(watchdog.restarts), 1)
+        self.assertEqual([kind for service, kind in watchdog.alerts], ['died', 'gave-up', 'gave-up'])
+
+    def test_recovery_resets_backoff(self):
+        with mock.patch.object(fednode, 'WATCH_RECOVERY_TIME', 0.2):
+            watchdog = self.replay([
+                {'service': 'unoparty', 'action': 'die', 'exit_code': 1},
+                {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.1},
+                {'service': 'unoparty', 'action': 'die', 'exit_code': 1, 'after': 0.4},  # (up for longer than the recovery time)
+            ], backoff_min=0.02)
+        self.assertEqual([message.rpartition('; ')[2] for message in watchdog.messages if 'restarting in' in message],
+                         ["restarting in 0.02s (attempt 1)", "restarting in 0.04s (attempt 2)", "restarting in 0.02s (attempt 1)"])
+
+    def test_stopped_on_purpose(self):
+        watchdog = self.replay([
+            {'service': 'unobtanium', 'action': 'kill'},
+            {'service': 'unobtanium', 'action': 'die', 'exit_code': 0, 'after': 0.02},
+            {'service': 'unobtanium', 'action': 'height', 'height': 100, 'target': 200},
+            {'service': 'unobtanium', 'action': 'height', 'height': 100, 'target': 200, 'after': 0.15},
+            {'service': 'unoparty', 'action': 'restart'},  # (not an event the watchdog acts on)
+        ], backoff_min=0.02, stall_time=0.1)
+        self.assertEqual((watchdog.restarts, watchdog.alerts), ([], []))
+        self.assertEqual(watchdog.messages, ["unobtanium: stopped"])
+
+    def test_stall(self):
+        watchdog = self.replay([
+            {'service': 'unoparty', 'action': 'height', 'height': 100, 'target': 200},
+            {'service': 'unoparty', 'action': 'height', 'height': 150, 'target': 200, 'after': 0.1},
+            {'service': 'unoparty', 'action': 'height', 'height': 150, 'target': 200, 'after': 0.1},  # (not stalled long enough)
+            {'service': 'unoparty', 'action': 'height', 'height': 150, 'target': 200, 'after': 0.1},
+            {'service': 'unobtanium', 'action': 'height', 'height': 200, 'target': 200},
+            {'service': 'unobtanium', 'action': 'height', 'height': 200, 'target': 200, 'after': 0.2},  # (caught up)
+        ], backoff_min=0.02, stall_time=0.15)
+        self.assertEqual(watchdog.alerts, [('unoparty', 'stalled')])
+        self.assertEqual([service for service, restarted in watchdog.restarts], ['unoparty'])
+        stalled = [event['time'] for event in watchdog.handled if event.get('height') == 150][-1]
+        self.assertLess(watchdog.restarts[0][1] - stalled, 0.07)
+        self.assertEqual(watchdog.messages[0], "unoparty: stalled at block 150 of 200 for 0s; restarting in 0.02s (attempt 1)")
+
+    def test_without_restarts(self):
+        watchdog = self.replay([
+            {'service': 'unoparty', 'action': 'oom'},
+            {'service': 'unoparty', 'action': 'unhealthy', 'after': 0.02},
+        ], restart=False, max_restarts=1)
+        self.assertEqual(watchdog.alerts, [('unoparty', 'oom'), ('unoparty', 'unhealthy')])
+        self.assertEqual(watchdog.messages, ["unoparty: ran out of memory", "unoparty: turned unhealthy"])
+
+    def test_docker_events(self):
+        attributes = {'com.docker.compose.service': 'unoparty', 'com.docker.compose.project': 'federatednode'}
+        events = [fednode.parse_docker_event(event) for event in [
+            {'Type': 'container', 'Action': 'die', 'timeNano': 1500000000 * 10 ** 9,
+             'Actor': {'Attributes': dict(attributes, exitCode='137')}},
+            {'status': 'health_status: unhealthy', 'time': 1500000001, 'Actor': {'Attributes': attributes}},
+            {'Action': 'die', 'time': 1500000002, 'Actor': {'Attributes': {'exitCode': '1'}}},
+        ]]
+        self.assertEqual(events, [
+            {'time': 1500000000.0, 'service': 'unoparty', 'action': 'die', 'exit_code': 137},
+            {'time': 1500000001, 'service': 'unoparty', 'action': 'unhealthy', 'exit_code': None},
+            None,
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()